@@ -0,0 +1,154 @@
+import os
+from typing import Dict, List, Optional
+from fastapi import FastAPI, HTTPException, Query
+import uvicorn
+import numpy as np
+
+from exportar_factores_als import cargar_factores
+
+# --- API ALS SIN SPARK ---
+# Sirve el mismo /recomendar/{user_id} que api_simple.py a partir de los factores
+# exportados con exportar_factores_als.py: la predicción de ALS es el producto punto
+# usuario·producto, así que basta NumPy (sin SparkSession ni JVM en el contenedor).
+
+print("🚀 Iniciando API de Recomendación ALS (sin Spark)...")
+app = FastAPI(title="API de Recomendación MLOps", version="2.1-ALS-NumPy")
+
+FACTORES_ALS_PATH = os.environ.get("FACTORES_ALS_PATH", "modelo_als_factores")
+
+# Factores del modelo (se cargan una vez al arrancar)
+factores = None
+
+def cargar_modelo() -> bool:
+    """Carga los factores ALS exportados"""
+    global factores
+
+    print(f"📁 Cargando factores ALS desde {FACTORES_ALS_PATH}...")
+    try:
+        datos = cargar_factores(FACTORES_ALS_PATH)
+        # user_factors se lee fila a fila (memory-mapped); item_factors se usa entera
+        # en cada petición, así que se copia a memoria contigua
+        datos["item_factors"] = np.ascontiguousarray(datos["item_factors"], dtype=np.float32)
+        factores = datos
+        manifest = datos["manifest"]
+        print(f"🧠 Factores cargados: {manifest['usuarios']} usuarios, {manifest['productos']} productos, "
+              f"rank {manifest['rank']}")
+        return True
+    except Exception as e:
+        print(f"❌ Error al cargar factores: {e}")
+        return False
+
+def _fila_usuario(user_id: int) -> Optional[int]:
+    """Fila del usuario en user_factors (búsqueda binaria sobre los IDs ordenados)"""
+    user_ids = factores["user_ids"]
+    pos = int(np.searchsorted(user_ids, user_id))
+    if pos < len(user_ids) and user_ids[pos] == user_id:
+        return pos
+    return None
+
+def recomendar_als(user_id: int, k: int = 5) -> Optional[List[Dict]]:
+    """
+    Top-k productos por puntuación ALS (equivale a recommendForUserSubset).
+    Devuelve None si el usuario no está en el modelo.
+    """
+    fila = _fila_usuario(user_id)
+    if fila is None:
+        return None
+
+    puntajes = factores["item_factors"] @ factores["user_factors"][fila]
+    k = min(k, len(puntajes))
+    if k == 0:
+        return []
+    # argpartition deja los k mejores sin ordenar todo el catálogo
+    top = np.argpartition(-puntajes, k - 1)[:k]
+    top = top[np.argsort(-puntajes[top], kind="stable")]
+    return [
+        {"producto_id": int(producto_id), "puntuacion": round(float(puntuacion), 3)}
+        for producto_id, puntuacion in zip(factores["item_ids"][top], puntajes[top])
+    ]
+
+# --- ENDPOINTS ---
+
+@app.on_event("startup")
+async def startup_event():
+    """Se ejecuta al iniciar la API"""
+    print("🔧 Inicializando componentes...")
+
+    if not cargar_modelo():
+        raise Exception("No se pudieron cargar los factores ALS")
+
+    print("🎉 ¡API lista para servir recomendaciones!")
+
+@app.get("/")
+async def root():
+    """Endpoint de verificación"""
+    return {
+        "mensaje": "API de Recomendación MLOps funcionando",
+        "version": "2.1-ALS-NumPy",
+        "estado": "activo" if factores else "modelo no cargado"
+    }
+
+@app.get("/salud")
+async def verificar_salud():
+    """Endpoint de salud del sistema"""
+    return {
+        "spark": "no requerido",
+        "modelo": "cargado" if factores else "no cargado",
+        "factores": FACTORES_ALS_PATH
+    }
+
+@app.get("/recomendar/{user_id}")
+async def recomendar_productos(
+    user_id: int,
+    k: int = Query(5, ge=1, le=100, description="Número de recomendaciones")
+):
+    """
+    Entrega k (5 por defecto) recomendaciones de productos para un usuario.
+
+    Args:
+        user_id: ID del usuario (debe estar en el modelo ALS)
+
+    Returns:
+        JSON con recomendaciones de productos
+    """
+    if factores is None:
+        raise HTTPException(status_code=503, detail="Modelo no está disponible")
+
+    try:
+        productos_recomendados = recomendar_als(user_id, k)
+    except Exception as e:
+        print(f"❌ Error al generar recomendaciones para usuario {user_id}: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error interno al generar recomendaciones: {str(e)}"
+        )
+
+    # Usuario sin factores: ALS (coldStartStrategy="drop") no lo conoce
+    if productos_recomendados is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"No se encontraron recomendaciones para el usuario {user_id}"
+        )
+
+    return {
+        "user_id": user_id,
+        "productos_recomendados": productos_recomendados,
+        "total_recomendaciones": len(productos_recomendados)
+    }
+
+# --- FUNCIÓN PRINCIPAL ---
+
+if __name__ == "__main__":
+    print("🌐 Iniciando servidor API ALS sin Spark...")
+    try:
+        uvicorn.run(
+            "api_als:app",
+            host="0.0.0.0",
+            port=int(os.environ.get("PORT", 8000)),
+            reload=False,
+            log_level="info"
+        )
+    except KeyboardInterrupt:
+        print("\n🛑 Servidor detenido por el usuario")
+    except Exception as e:
+        print(f"❌ Error al iniciar servidor: {e}")
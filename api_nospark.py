@@ -2,10 +2,14 @@ import os
 import json
 import random
 from typing import List, Dict
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query
 import uvicorn
+import numpy as np
 import pandas as pd
 
+from construir_modelo_items import cargar_modelo_items
+from snapshot_datos import cargar_snapshot, existe_snapshot, fuentes_cambiadas
+
 # --- API SIN SPARK PARA WINDOWS ---
 
 print("🚀 Iniciando API de Recomendación sin Spark...")
@@ -21,11 +25,43 @@ usuarios_df = None
 productos_df = None
 interacciones_df = None
 
+# Snapshot columnar opcional (ver snapshot_datos.py); si no existe se leen los CSV
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH", "datos_snapshot")
+
+# Catálogo de productos indexado por product_id (se construye una vez al arrancar)
+catalogo = None
+catalogo_ids = None
+
+# Índice disperso usuario↔producto (se construye una vez al arrancar)
+indice_interacciones = None
+
+# Historial agrupado por usuario en rangos contiguos ordenados por tiempo
+indice_historial = None
+
+# Modelo item–item precalculado (ver construir_modelo_items.py); opcional
+MODELO_ITEMS_PATH = os.environ.get("MODELO_ITEMS_PATH", "modelo_items.npz")
+modelo_items = None
+
 def cargar_datos_locales():
-    """Carga los datos CSV locales"""
+    """Carga los datos locales (snapshot columnar si existe, si no los CSV)"""
     global usuarios_df, productos_df, interacciones_df
     
     try:
+        # Un snapshot construido con CSV anteriores no se sirve: se leen los CSV actuales
+        cambiadas = fuentes_cambiadas(SNAPSHOT_PATH, ".") if existe_snapshot(SNAPSHOT_PATH) else []
+        if cambiadas:
+            print(f"⚠️ Snapshot desactualizado ({', '.join(cambiadas)} cambió desde que se construyó); "
+                  f"se leen los CSV. Reconstrúyelo con: python snapshot_datos.py --salida {SNAPSHOT_PATH}")
+        elif existe_snapshot(SNAPSHOT_PATH):
+            print(f"📦 Cargando snapshot columnar desde {SNAPSHOT_PATH} (memory-mapped)...")
+            tablas = cargar_snapshot(SNAPSHOT_PATH)
+            usuarios_df = tablas["usuarios"]
+            productos_df = tablas["productos"]
+            interacciones_df = tablas["interacciones"]
+            print(f"✅ Snapshot cargado: {len(usuarios_df)} usuarios, {len(productos_df)} productos, "
+                  f"{len(interacciones_df)} interacciones")
+            return True
+        
         print("📁 Cargando datos desde archivos CSV...")
         
         # Cargar usuarios
@@ -46,49 +82,186 @@ def cargar_datos_locales():
         print(f"❌ Error al cargar datos: {e}")
         return False
 
+def construir_catalogo(productos: pd.DataFrame) -> Dict[int, Dict]:
+    """
+    Construye el catálogo product_id → fragmentos de respuesta ya formateados,
+    para enriquecer recomendaciones e historial sin filtrar el DataFrame
+    """
+    catalogo = {}
+    for producto_id, nombre, categoria, precio in productos[
+        ['product_id', 'nombre_producto', 'categoria', 'precio']
+    ].itertuples(index=False):
+        catalogo[int(producto_id)] = {
+            "recomendacion": {
+                "nombre": nombre,
+                "categoria": categoria,
+                "precio": f"${precio:.2f}",
+            },
+            "historial": {
+                "nombre_producto": nombre,
+                "categoria": categoria,
+            },
+        }
+    return catalogo
+
+def _muestrear_productos(excluidos: set, cantidad: int) -> List[int]:
+    """Muestrea productos del catálogo que no estén en `excluidos` sin recorrer todo el catálogo"""
+    elegidos = []
+    if cantidad <= 0:
+        return elegidos
+    # Muestreo por rechazo con un número acotado de intentos
+    for _ in range(cantidad * 10):
+        producto_id = catalogo_ids[random.randrange(len(catalogo_ids))]
+        if producto_id not in excluidos and producto_id not in elegidos:
+            elegidos.append(producto_id)
+            if len(elegidos) == cantidad:
+                return elegidos
+    # Catálogo casi agotado para este usuario: caer al recorrido completo
+    restantes = [p for p in catalogo_ids if p not in excluidos and p not in elegidos]
+    return elegidos + random.sample(restantes, min(cantidad - len(elegidos), len(restantes)))
+
+def construir_indice_historial(interacciones: pd.DataFrame) -> Dict:
+    """
+    Agrupa las interacciones por usuario en rangos contiguos ordenados por tiempo:
+    una sola ordenación más un array de offsets (el usuario i ocupa offsets[i]:offsets[i+1])
+    """
+    ordenadas = interacciones.assign(
+        timestamp=pd.to_datetime(interacciones['timestamp'])
+    ).sort_values(['user_id', 'timestamp'], kind='stable')
+    user_ids, inicios = np.unique(ordenadas['user_id'].to_numpy(), return_index=True)
+    return {
+        "user_ids": user_ids,
+        "offsets": np.append(inicios, len(ordenadas)).astype(np.int64),
+        "product_id": ordenadas['product_id'].to_numpy(),
+        "tipo_interaccion": ordenadas['tipo_interaccion'].to_numpy(),
+        "timestamp": ordenadas['timestamp'].to_numpy().astype('datetime64[s]'),
+    }
+
+def _rango_historial(user_id: int):
+    """Devuelve (inicio, fin) del historial del usuario; rango vacío si no tiene interacciones"""
+    user_ids = indice_historial["user_ids"]
+    pos = int(np.searchsorted(user_ids, user_id))
+    if pos < len(user_ids) and user_ids[pos] == user_id:
+        offsets = indice_historial["offsets"]
+        return int(offsets[pos]), int(offsets[pos + 1])
+    return 0, 0
+
+def _csr_desde_pares(filas: np.ndarray, columnas: np.ndarray, n_filas: int, n_columnas: int):
+    """Construye una matriz CSR binaria (indptr, indices) a partir de pares (fila, columna)"""
+    # np.unique deduplica los pares y los deja ordenados por fila y luego por columna
+    claves = np.unique(filas.astype(np.int64) * n_columnas + columnas)
+    indices = (claves % n_columnas).astype(np.int32)
+    indptr = np.zeros(n_filas + 1, dtype=np.int64)
+    np.cumsum(np.bincount(claves // n_columnas, minlength=n_filas), out=indptr[1:])
+    return indptr, indices
+
+def _filas_csr(indptr: np.ndarray, indices: np.ndarray, filas: np.ndarray) -> np.ndarray:
+    """Concatena las columnas de varias filas de una CSR sin bucles en Python"""
+    inicios = indptr[filas]
+    largos = indptr[filas + 1] - inicios
+    if largos.sum() == 0:
+        return indices[:0]
+    desplazamientos = np.repeat(inicios - (np.cumsum(largos) - largos), largos)
+    return indices[desplazamientos + np.arange(largos.sum())]
+
+def construir_indice_interacciones(interacciones: pd.DataFrame) -> Dict:
+    """
+    Construye el índice usuario→productos y producto→usuarios en formato CSR
+    con IDs codificados como enteros consecutivos
+    """
+    codigos_usuario, user_ids = pd.factorize(interacciones['user_id'], sort=True)
+    codigos_producto, product_ids = pd.factorize(interacciones['product_id'], sort=True)
+    n_usuarios, n_productos = len(user_ids), len(product_ids)
+
+    usuario_indptr, usuario_items = _csr_desde_pares(codigos_usuario, codigos_producto, n_usuarios, n_productos)
+    item_indptr, item_usuarios = _csr_desde_pares(codigos_producto, codigos_usuario, n_productos, n_usuarios)
+
+    return {
+        "user_ids": np.asarray(user_ids, dtype=np.int64),
+        "product_ids": np.asarray(product_ids, dtype=np.int64),
+        "usuario_indptr": usuario_indptr,
+        "usuario_items": usuario_items,
+        "item_indptr": item_indptr,
+        "item_usuarios": item_usuarios,
+        "populares": interacciones['product_id'].value_counts().head(20).index.tolist(),
+    }
+
+def _codigo_usuario(user_id: int) -> int:
+    """Devuelve el código interno del usuario o -1 si no tiene interacciones"""
+    user_ids = indice_interacciones["user_ids"]
+    pos = int(np.searchsorted(user_ids, user_id))
+    if pos < len(user_ids) and user_ids[pos] == user_id:
+        return pos
+    return -1
+
+def _candidatos_item_item(items_usuario: np.ndarray) -> List[int]:
+    """Suma las listas de vecinos precalculadas de los productos del usuario"""
+    filas = modelo_items["fila_por_codigo"][items_usuario]
+    filas = filas[filas >= 0]
+    vecinos = modelo_items["vecinos"][filas].ravel()
+    similitudes = modelo_items["similitudes"][filas].ravel()
+
+    # Descartar huecos (-1) y productos que el usuario ya tiene
+    validos = (vecinos >= 0) & ~np.isin(vecinos, filas)
+    candidatos, inverso = np.unique(vecinos[validos], return_inverse=True)
+    puntajes = np.bincount(inverso, weights=similitudes[validos], minlength=len(candidatos))
+
+    orden = np.argsort(-puntajes, kind="stable")
+    return modelo_items["product_ids"][candidatos[orden]].tolist()
+
 def generar_recomendaciones_colaborativas(user_id: int, num_recomendaciones: int = 5) -> List[Dict]:
     """
     Genera recomendaciones usando filtrado colaborativo simple
     """
     try:
+        idx = indice_interacciones
+        codigo = _codigo_usuario(user_id)
+
         # 1. Obtener productos que el usuario ya ha comprado/interactuado
-        productos_usuario = set(
-            interacciones_df[interacciones_df['user_id'] == user_id]['product_id'].tolist()
-        )
-        
-        # 2. Encontrar usuarios similares (que compraron productos similares)
-        usuarios_similares = []
-        for _, row in interacciones_df.iterrows():
-            if row['user_id'] != user_id and row['product_id'] in productos_usuario:
-                usuarios_similares.append(row['user_id'])
-        
-        # 3. Obtener productos comprados por usuarios similares
-        if usuarios_similares:
-            productos_recomendados = set()
-            for similar_user in set(usuarios_similares):
-                productos_similar = interacciones_df[
-                    interacciones_df['user_id'] == similar_user
-                ]['product_id'].tolist()
-                productos_recomendados.update(productos_similar)
-            
-            # 4. Remover productos que el usuario ya tiene
-            productos_recomendados = productos_recomendados - productos_usuario
+        if codigo >= 0:
+            items_usuario = idx["usuario_items"][idx["usuario_indptr"][codigo]:idx["usuario_indptr"][codigo + 1]]
+        else:
+            items_usuario = idx["usuario_items"][:0]
+        productos_usuario = set(idx["product_ids"][items_usuario].tolist())
+
+        metodo = "popular"
+
+        # 2-4. Con modelo item–item: sumar los vecinos de los productos del usuario
+        if modelo_items is not None and len(items_usuario) > 0:
+            productos_recomendados = _candidatos_item_item(items_usuario)
+            if productos_recomendados:
+                metodo = "item_item"
         else:
+            # 2. Encontrar usuarios similares (que interactuaron con los mismos productos)
+            usuarios_similares = np.unique(_filas_csr(idx["item_indptr"], idx["item_usuarios"], items_usuario))
+            usuarios_similares = usuarios_similares[usuarios_similares != codigo]
+
+            # 3. Obtener productos de usuarios similares
+            if len(usuarios_similares) > 0:
+                candidatos = _filas_csr(idx["usuario_indptr"], idx["usuario_items"], usuarios_similares)
+                candidatos, soporte = np.unique(candidatos, return_counts=True)
+
+                # 4. Remover productos que el usuario ya tiene
+                nuevos = ~np.isin(candidatos, items_usuario)
+                candidatos, soporte = candidatos[nuevos], soporte[nuevos]
+
+                # Desempate: primero los productos compartidos por más usuarios similares
+                orden = np.argsort(-soporte, kind="stable")
+                productos_recomendados = idx["product_ids"][candidatos[orden]].tolist()
+                metodo = "colaborativo"
+
+        if metodo == "popular":
             # Si no hay usuarios similares, usar productos populares
-            productos_populares = interacciones_df['product_id'].value_counts()
-            productos_recomendados = set(productos_populares.head(20).index.tolist())
-            productos_recomendados = productos_recomendados - productos_usuario
-        
+            productos_recomendados = [p for p in idx["populares"] if p not in productos_usuario]
+
         # 5. Seleccionar recomendaciones finales
-        productos_finales = list(productos_recomendados)[:num_recomendaciones]
+        productos_finales = productos_recomendados[:num_recomendaciones]
         
         # 6. Si no hay suficientes, completar con productos aleatorios
         if len(productos_finales) < num_recomendaciones:
-            todos_productos = set(productos_df['product_id'].tolist())
-            productos_restantes = todos_productos - productos_usuario - set(productos_finales)
-            productos_adicionales = random.sample(
-                list(productos_restantes), 
-                min(num_recomendaciones - len(productos_finales), len(productos_restantes))
+            productos_adicionales = _muestrear_productos(
+                productos_usuario | set(productos_finales),
+                num_recomendaciones - len(productos_finales)
             )
             productos_finales.extend(productos_adicionales)
         
@@ -100,7 +273,7 @@ def generar_recomendaciones_colaborativas(user_id: int, num_recomendaciones: int
             recomendaciones.append({
                 "producto_id": int(producto_id),
                 "puntuacion": max(score, 1.0),  # Mínimo 1.0
-                "metodo": "colaborativo" if usuarios_similares else "popular"
+                "metodo": metodo
             })
         
         return recomendaciones
@@ -132,7 +305,7 @@ async def verificar_salud():
         "estado": "saludable",
         "spark": "no requerido",
         "datos": "cargados" if usuarios_df is not None else "no cargados",
-        "metodo": "filtrado colaborativo + popularidad"
+        "metodo": "item-item precalculado + popularidad" if modelo_items is not None else "filtrado colaborativo + popularidad"
     }
 
 @app.get("/usuarios")
@@ -159,8 +332,12 @@ async def listar_productos():
     }
 
 @app.get("/usuario/{user_id}/historial")
-async def obtener_historial_usuario(user_id: int):
-    """Obtiene el historial de interacciones de un usuario"""
+async def obtener_historial_usuario(
+    user_id: int,
+    limit: int = Query(100, ge=1, le=1000, description="Interacciones por página"),
+    cursor: int = Query(0, ge=0, description="Posición de inicio dentro del historial")
+):
+    """Obtiene el historial de interacciones de un usuario (paginado, en orden cronológico)"""
     if interacciones_df is None:
         raise HTTPException(status_code=503, detail="Datos no disponibles")
     
@@ -172,9 +349,10 @@ async def obtener_historial_usuario(user_id: int):
         )
     
     # Obtener historial
-    historial = interacciones_df[interacciones_df['user_id'] == user_id]
+    inicio, fin = _rango_historial(user_id)
+    total = fin - inicio
     
-    if len(historial) == 0:
+    if total == 0:
         return {
             "user_id": user_id,
             "mensaje": "Usuario sin historial de interacciones",
@@ -182,22 +360,32 @@ async def obtener_historial_usuario(user_id: int):
             "productos": []
         }
     
+    # Página solicitada: sólo se recorren `limit` filas
+    desde = min(inicio + cursor, fin)
+    hasta = min(desde + limit, fin)
+    pagina = zip(
+        indice_historial["product_id"][desde:hasta].tolist(),
+        indice_historial["tipo_interaccion"][desde:hasta].tolist(),
+        np.datetime_as_string(indice_historial["timestamp"][desde:hasta], unit='s').tolist()
+    )
+    
     # Agregar información de productos
     historial_detallado = []
-    for _, row in historial.iterrows():
-        producto_info = productos_df[productos_df['product_id'] == row['product_id']]
-        if not producto_info.empty:
+    for producto_id, tipo_interaccion, timestamp in pagina:
+        producto = catalogo.get(producto_id)
+        if producto is not None:
             historial_detallado.append({
-                "producto_id": int(row['product_id']),
-                "nombre_producto": producto_info.iloc[0]['nombre_producto'],
-                "categoria": producto_info.iloc[0]['categoria'],
-                "tipo_interaccion": row['tipo_interaccion'],
-                "timestamp": row['timestamp']
+                "producto_id": producto_id,
+                **producto["historial"],
+                "tipo_interaccion": tipo_interaccion,
+                "timestamp": timestamp.replace('T', ' ')
             })
     
     return {
         "user_id": user_id,
-        "total_interacciones": len(historial_detallado),
+        "total_interacciones": total,
+        "cursor": cursor,
+        "siguiente_cursor": hasta - inicio if hasta < fin else None,
         "productos": historial_detallado
     }
 
@@ -233,14 +421,11 @@ async def recomendar_productos(user_id: int):
         # Agregar información de productos recomendados
         recomendaciones_detalladas = []
         for rec in recomendaciones:
-            producto_info = productos_df[productos_df['product_id'] == rec['producto_id']]
-            if not producto_info.empty:
-                producto = producto_info.iloc[0]
+            producto = catalogo.get(rec['producto_id'])
+            if producto is not None:
                 recomendaciones_detalladas.append({
                     "producto_id": rec['producto_id'],
-                    "nombre": producto['nombre_producto'],
-                    "categoria": producto['categoria'],
-                    "precio": f"${producto['precio']:.2f}",
+                    **producto["recomendacion"],
                     "puntuacion": rec['puntuacion'],
                     "metodo": rec['metodo']
                 })
@@ -269,11 +454,33 @@ async def recomendar_productos(user_id: int):
 @app.on_event("startup")
 async def startup_event():
     """Carga los datos al iniciar la API"""
+    global catalogo, catalogo_ids, indice_interacciones, indice_historial, modelo_items
     print("🔧 Inicializando API sin Spark...")
     
     if not cargar_datos_locales():
         raise Exception("No se pudieron cargar los datos locales")
     
+    catalogo = construir_catalogo(productos_df)
+    catalogo_ids = list(catalogo)
+    print(f"✅ Catálogo indexado: {len(catalogo)} productos")
+    
+    indice_interacciones = construir_indice_interacciones(interacciones_df)
+    print(f"✅ Índice usuario↔producto construido: {len(indice_interacciones['usuario_items'])} pares únicos")
+    
+    indice_historial = construir_indice_historial(interacciones_df)
+    print(f"✅ Historial indexado: {len(indice_historial['user_ids'])} usuarios")
+    
+    if os.path.exists(MODELO_ITEMS_PATH):
+        modelo = cargar_modelo_items(MODELO_ITEMS_PATH)
+        # Traducir los códigos del índice a filas del modelo (-1 si el producto no está en el modelo)
+        product_ids = indice_interacciones["product_ids"]
+        pos = np.searchsorted(modelo["product_ids"], product_ids).clip(max=len(modelo["product_ids"]) - 1)
+        modelo["fila_por_codigo"] = np.where(modelo["product_ids"][pos] == product_ids, pos, -1).astype(np.int32)
+        modelo_items = modelo
+        print(f"✅ Modelo item–item cargado desde {MODELO_ITEMS_PATH}: top-{modelo['vecinos'].shape[1]} vecinos por producto")
+    else:
+        print(f"ℹ️ {MODELO_ITEMS_PATH} no encontrado, se usa filtrado colaborativo por usuarios similares")
+    
     print("🎉 ¡API lista para servir recomendaciones!")
 
 # --- FUNCIÓN PRINCIPAL ---
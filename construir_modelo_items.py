@@ -0,0 +1,119 @@
+"""
+🧮 Construcción offline del modelo item–item
+============================================
+
+Calcula la similitud coseno entre productos a partir de interacciones.csv,
+ponderando cada interacción con los mismos pesos que etl_spark.py
+(compra=4, carrito=3, clic=2, visto=1), y guarda para cada producto sólo
+sus top-N vecinos en un archivo binario compacto (.npz).
+
+La API (api_nospark.py) carga este archivo al arrancar y puntúa a cada
+usuario sumando las listas de vecinos de sus productos.
+
+Uso:
+    python construir_modelo_items.py --top-n 20 --salida modelo_items.npz
+"""
+
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Mismos pesos que la tabla 'ratings' de etl_spark.py
+PESOS_INTERACCION = {
+    "compra": 4.0,
+    "agregado_al_carrito": 3.0,
+    "clic": 2.0,
+    "visto": 1.0,
+}
+PESO_POR_DEFECTO = 1.0
+
+FORMATO_VERSION = 1
+
+
+def calcular_vecinos_items(interacciones: pd.DataFrame, top_n: int = 20):
+    """
+    Devuelve (product_ids, vecinos, similitudes):
+    - product_ids: IDs reales de producto ordenados, una fila por producto
+    - vecinos: matriz int32 (n_productos, top_n) con la fila del vecino o -1 si no hay
+    - similitudes: matriz float32 (n_productos, top_n) con la similitud coseno
+    """
+    # scipy sólo hace falta para construir el modelo; la API sólo lo carga
+    from scipy import sparse
+
+    pesos = interacciones["tipo_interaccion"].map(PESOS_INTERACCION).fillna(PESO_POR_DEFECTO)
+    codigos_usuario, _ = pd.factorize(interacciones["user_id"], sort=True)
+    codigos_producto, product_ids = pd.factorize(interacciones["product_id"], sort=True)
+    n_productos = len(product_ids)
+
+    # Matriz usuario×producto con la suma de pesos (los duplicados se suman al convertir a CSR)
+    r = sparse.coo_matrix(
+        (pesos.to_numpy(dtype=np.float32), (codigos_usuario, codigos_producto)),
+        shape=(int(codigos_usuario.max()) + 1, n_productos),
+    ).tocsc()
+
+    # Similitud coseno item–item: columnas normalizadas y producto Rᵀ·R disperso
+    normas = np.sqrt(np.asarray(r.multiply(r).sum(axis=0)).ravel()) + 1e-8
+    r_norm = r @ sparse.diags(1.0 / normas)
+    sim = (r_norm.T @ r_norm).tocsr()
+    sim.setdiag(0.0)
+    sim.eliminate_zeros()
+
+    vecinos = np.full((n_productos, top_n), -1, dtype=np.int32)
+    similitudes = np.zeros((n_productos, top_n), dtype=np.float32)
+    for fila in range(n_productos):
+        inicio, fin = sim.indptr[fila], sim.indptr[fila + 1]
+        cols, vals = sim.indices[inicio:fin], sim.data[inicio:fin]
+        if len(cols) > top_n:
+            top = np.argpartition(-vals, top_n - 1)[:top_n]
+            cols, vals = cols[top], vals[top]
+        orden = np.argsort(-vals, kind="stable")
+        vecinos[fila, :len(cols)] = cols[orden]
+        similitudes[fila, :len(cols)] = vals[orden]
+
+    return np.asarray(product_ids, dtype=np.int64), vecinos, similitudes
+
+
+def guardar_modelo_items(ruta: Path, product_ids: np.ndarray, vecinos: np.ndarray, similitudes: np.ndarray):
+    """Guarda el modelo en un .npz sin comprimir (carga directa de arrays)"""
+    np.savez(
+        ruta,
+        version=np.int32(FORMATO_VERSION),
+        product_ids=product_ids,
+        vecinos=vecinos,
+        similitudes=similitudes,
+    )
+
+
+def cargar_modelo_items(ruta: Path):
+    """Carga el modelo item–item y valida la versión del formato"""
+    with np.load(ruta) as datos:
+        if int(datos["version"]) != FORMATO_VERSION:
+            raise ValueError(f"Versión de modelo item–item no soportada: {int(datos['version'])}")
+        return {
+            "product_ids": datos["product_ids"],
+            "vecinos": datos["vecinos"],
+            "similitudes": datos["similitudes"],
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construye el modelo item–item para api_nospark.py")
+    parser.add_argument("--interacciones", type=str, default="interacciones.csv")
+    parser.add_argument("--top-n", type=int, default=20, help="Vecinos guardados por producto")
+    parser.add_argument("--salida", type=str, default="modelo_items.npz")
+    args = parser.parse_args()
+
+    print(f"📁 Leyendo {args.interacciones}...")
+    interacciones = pd.read_csv(args.interacciones)
+
+    print(f"🧮 Calculando similitud coseno item–item (top {args.top_n})...")
+    product_ids, vecinos, similitudes = calcular_vecinos_items(interacciones, top_n=args.top_n)
+
+    guardar_modelo_items(Path(args.salida), product_ids, vecinos, similitudes)
+    print(f"✅ Modelo guardado en {args.salida}: {len(product_ids)} productos, {int((vecinos >= 0).sum())} vecinos")
+
+
+if __name__ == "__main__":
+    main()
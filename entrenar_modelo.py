@@ -2,6 +2,9 @@ import os
 from pyspark.sql import SparkSession
 from pyspark.ml.recommendation import ALS
 from pyspark.sql.functions import col
+from pathlib import Path
+
+from exportar_factores_als import exportar_factores
 
 # --- CONFIGURACIÓN IMPORTANTE ---
 
@@ -51,6 +54,9 @@ print("¡Sesión de Spark creada con éxito!")
 ruta_gold = f"s3a://{MI_BUCKET}/gold/"
 ruta_modelos = f"s3a://{MI_BUCKET}/models/"
 
+# Factores del modelo en .npy (disco local) para servir con api_als.py sin Spark
+ruta_factores = os.environ.get("FACTORES_ALS_PATH", "modelo_als_factores")
+
 
 # --- 2. Leer los Datos "Dorados" ---
 print(f"Leyendo la tabla 'ratings' de la capa Gold...")
@@ -113,6 +119,18 @@ except Exception as e:
     print(f"Error guardando el modelo: {e}")
 
 
-# --- 5. Finalizar Sesión ---
+# --- 5. Exportar los Factores para la API ---
+print(f"Exportando los factores del modelo a {ruta_factores}...")
+
+try:
+    # userFactors e itemFactors son pequeños (una fila por usuario/producto)
+    manifest = exportar_factores(model, Path(ruta_factores))
+    print(f"¡Factores exportados! {manifest['usuarios']} usuarios, {manifest['productos']} productos")
+
+except Exception as e:
+    print(f"Error exportando los factores: {e}")
+
+
+# --- 6. Finalizar Sesión ---
 print("¡Proceso de entrenamiento finalizado!")
 spark.stop()
\ No newline at end of file
@@ -0,0 +1,637 @@
+"""
+🐼 ETL local (sin Spark): bronze → silver → gold
+================================================
+
+Mismo flujo que etl_spark.py pero en el propio proceso, con pyarrow (pandas sólo
+para los casts de valores inválidos):
+
+    bronze/  usuarios.csv, productos.csv, interacciones.csv
+    silver/  usuarios/, productos/                          (Parquet, tipos casteados)
+             interacciones/fecha=AAAA-MM-DD/                 (particionada por día)
+             _watermarks/interacciones/                      (mayor timestamp cargado)
+    gold/    ratings/bucket=N/ (user_id, product_id, rating)
+             interacciones_categoria/bucket=N/ (user_id, categoria, tipo_interaccion, n_interacciones)
+
+Las cargas son incrementales: sólo entran en silver las interacciones con timestamp
+posterior al watermark, y gold suma lo nuevo y rehace únicamente los buckets que tocan
+(`--completo` recarga todo). Así el coste de cada ejecución sigue al volumen nuevo.
+
+Los CSV se leen en streaming por bloques de `--bloque-mb` MB y la capa silver por
+bloques de `--bloque` filas, así que la memoria no depende del tamaño de los datos
+(salvo el agregado de ratings, que ocupa lo que ocupen los pares usuario–producto).
+
+Las rutas pueden ser locales o URIs de pyarrow.fs (p. ej. s3://bucket/silver/).
+
+Uso:
+    python etl_local.py --bronze . --silver datalake/silver --gold datalake/gold
+"""
+
+import argparse
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+# Mismos puntajes que la tabla 'ratings' de etl_spark.py (otherwise -> 1)
+PUNTAJES = {
+    "compra": 4,
+    "agregado_al_carrito": 3,
+    "clic": 2,
+}
+PUNTAJE_POR_DEFECTO = 1
+
+# Spark guarda los timestamps ajustados a UTC; los CSV traen hora local sin zona
+TIMESTAMP = pa.timestamp("us", tz="UTC")
+
+# Columnas de pocos valores distintos: se guardan codificadas como diccionario
+# (en Parquet siguen siendo strings para Spark; pyarrow las lee como índices int32)
+CATEGORICA = pa.dictionary(pa.int32(), pa.string())
+
+# Esquemas silver: los tipos que deja etl_spark.py tras sus casts
+ESQUEMAS_SILVER = {
+    "usuarios": pa.schema([
+        ("user_id", pa.int32()),
+        ("nombre", pa.string()),
+        ("ciudad", pa.string()),
+        ("email", pa.string()),
+        ("fecha_registro", TIMESTAMP),
+    ]),
+    "productos": pa.schema([
+        ("product_id", pa.int32()),
+        ("nombre_producto", pa.string()),
+        ("categoria", CATEGORICA),
+        ("precio", pa.float64()),
+    ]),
+    "interacciones": pa.schema([
+        ("user_id", pa.int32()),
+        ("product_id", pa.int32()),
+        ("timestamp", TIMESTAMP),
+        ("tipo_interaccion", CATEGORICA),
+    ]),
+}
+
+ESQUEMAS_GOLD = {
+    # sum() de un entero en Spark devuelve bigint
+    "ratings": pa.schema([
+        ("user_id", pa.int32()),
+        ("product_id", pa.int32()),
+        ("rating", pa.int64()),
+    ]),
+    # Pre-agregada: una fila por (usuario, categoría, tipo) en vez de una por interacción
+    "interacciones_categoria": pa.schema([
+        ("user_id", pa.int32()),
+        ("categoria", CATEGORICA),
+        ("tipo_interaccion", CATEGORICA),
+        ("n_interacciones", pa.int64()),
+    ]),
+}
+
+# silver/interacciones se particiona por día (fecha=AAAA-MM-DD) y las tablas gold por
+# bucket = user_id mod N_BUCKETS_GOLD: una carga incremental sólo añade las filas
+# nuevas y reescribe los buckets de los usuarios que tienen interacciones nuevas
+PARTICION_FECHA = ds.partitioning(pa.schema([("fecha", pa.date32())]), flavor="hive")
+PARTICION_BUCKET = ds.partitioning(pa.schema([("bucket", pa.int32())]), flavor="hive")
+N_BUCKETS_GOLD = 64
+
+# Formatos aceptados en bronze: ficheros candidatos por tabla (el primero que exista).
+# Los .gz se descomprimen al vuelo; Parquet/Arrow pueden ser un fichero o un directorio.
+FORMATOS_BRONZE = {
+    "csv": (".csv", ".csv.gz"),
+    "parquet": (".parquet", ""),
+    "arrow": (".arrow", ".feather"),
+}
+
+# Marca de agua: mayor `timestamp` ya cargado en silver (JSON de una línea, como lo escribe Spark)
+RUTA_WATERMARK = "_watermarks/interacciones"
+# Marcas de gold (gold/_watermarks/<tabla>): hasta qué `timestamp` tiene sumado cada tabla y
+# si su última escritura terminó. Evitan sumar dos veces si una carga falla antes del watermark.
+RUTA_MARCAS_GOLD = "_watermarks"
+FORMATO_WATERMARK = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def _resolver(ruta: str) -> Tuple[pafs.FileSystem, str]:
+    """Sistema de archivos + ruta: URIs (s3://, file://...) con pyarrow.fs, el resto local."""
+    if "://" in ruta:
+        return pafs.FileSystem.from_uri(ruta)
+    return pafs.LocalFileSystem(), os.path.abspath(ruta)
+
+
+def _unir(base: str, *partes: str) -> str:
+    return "/".join([base.rstrip("/"), *partes])
+
+
+def _castear_columna(columna: pa.ChunkedArray, tipo: pa.DataType) -> pa.ChunkedArray:
+    """Cast de Arrow; si hay valores inválidos se pasa por pandas para dejarlos nulos, como cast en Spark."""
+    if columna.type == tipo:
+        return columna
+    if pa.types.is_dictionary(tipo):
+        if pa.types.is_dictionary(columna.type):
+            columna = columna.cast(tipo.value_type)
+        return pc.dictionary_encode(columna.cast(tipo.value_type)).cast(tipo)
+    try:
+        return columna.cast(tipo)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        serie = columna.to_pandas()
+        if pa.types.is_timestamp(tipo):
+            serie = pd.to_datetime(serie, format="ISO8601", errors="coerce")
+            return pa.chunked_array([pa.array(serie, type=pa.timestamp("us"))]).cast(tipo)
+        return pa.chunked_array([pa.array(pd.to_numeric(serie, errors="coerce"), type=pa.float64())]).cast(tipo)
+
+
+def _castear(tabla: pa.Table, esquema: pa.Schema) -> pa.Table:
+    """Casts equivalentes a los de etl_spark.py; los timestamps sin zona se etiquetan como UTC."""
+    columnas = []
+    for campo in esquema:
+        columna = tabla.column(campo.name)
+        if pa.types.is_timestamp(campo.type):
+            columna = _castear_columna(columna, pa.timestamp("us"))
+        columnas.append(_castear_columna(columna, campo.type))
+    return pa.Table.from_arrays(columnas, schema=esquema)
+
+
+def _ruta_bronze(fs: pafs.FileSystem, base: str, tabla: str, formato: str) -> str:
+    for sufijo in FORMATOS_BRONZE[formato]:
+        ruta = _unir(base, f"{tabla}{sufijo}")
+        if fs.get_file_info(ruta).type != pafs.FileType.NotFound:
+            return ruta
+    raise FileNotFoundError(f"No hay {tabla} en formato {formato} en {base}")
+
+
+def _leer_bronze(fs: pafs.FileSystem, base: str, tabla: str, columnas, formato: str = "csv",
+                 bloque_mb: int = 16) -> Iterator[pa.Table]:
+    """Lee una tabla de bronze por bloques: CSV (opcionalmente .gz) o Parquet/Arrow ya tipados."""
+    ruta = _ruta_bronze(fs, base, tabla, formato)
+    if formato == "csv":
+        yield from _leer_csv(fs, ruta, columnas, bloque_mb)
+        return
+    # Columnares: sólo se leen las columnas del esquema, en bloques de ~bloque_mb (~64 bytes/fila)
+    dataset = ds.dataset(ruta, filesystem=fs, format="parquet" if formato == "parquet" else "ipc")
+    for batch in dataset.to_batches(columns=list(columnas), batch_size=bloque_mb << 14):
+        yield pa.Table.from_batches([batch])
+
+
+def _leer_csv(fs: pafs.FileSystem, ruta: str, columnas, bloque_mb: int) -> Iterator[pa.Table]:
+    """Lector CSV en streaming de Arrow (bloques de `bloque_mb` MB); todo como texto, los tipos los fija _castear."""
+    with fs.open_input_stream(ruta, compression="detect") as f:
+        lector = pacsv.open_csv(
+            f,
+            read_options=pacsv.ReadOptions(block_size=bloque_mb << 20),
+            convert_options=pacsv.ConvertOptions(
+                column_types={nombre: pa.string() for nombre in columnas},
+                include_columns=list(columnas),
+                strings_can_be_null=True,
+            ),
+        )
+        for batch in lector:
+            yield pa.Table.from_batches([batch])
+
+
+def _leer_parquet(fs: pafs.FileSystem, ruta: str, bloque: int, columnas=None) -> Iterator[pa.Table]:
+    for info in fs.get_file_info(pafs.FileSelector(ruta)):
+        if not info.path.endswith(".parquet"):
+            continue
+        archivo = pq.ParquetFile(info.path, filesystem=fs)
+        for batch in archivo.iter_batches(batch_size=bloque, columns=columnas):
+            yield pa.Table.from_batches([batch])
+
+
+def _agrupar_lotes(lotes: Iterator[pa.RecordBatch], bloque: int) -> Iterator[pa.Table]:
+    """Junta lotes pequeños (p. ej. de muchas particiones) en tablas de ~`bloque` filas."""
+    pendientes, filas = [], 0
+    for lote in lotes:
+        pendientes.append(lote)
+        filas += lote.num_rows
+        if filas >= bloque:
+            yield pa.Table.from_batches(pendientes).unify_dictionaries()
+            pendientes, filas = [], 0
+    if pendientes:
+        yield pa.Table.from_batches(pendientes).unify_dictionaries()
+
+
+def _puntaje(tipo: pa.ChunkedArray) -> pa.Array:
+    """when(compra, 4).when(agregado_al_carrito, 3).when(clic, 2).otherwise(1); nulos -> otherwise."""
+    tipo = tipo.combine_chunks()
+    if pa.types.is_dictionary(tipo.type):
+        # Se puntúa cada valor del diccionario una vez y se reparte por índice
+        puntos = np.array([PUNTAJES.get(valor, PUNTAJE_POR_DEFECTO) for valor in tipo.dictionary.to_pylist()]
+                          + [PUNTAJE_POR_DEFECTO], dtype=np.int64)
+        indices = pc.fill_null(tipo.indices, len(tipo.dictionary)).to_numpy()
+        return pa.array(puntos[indices])
+    puntaje = np.full(len(tipo), PUNTAJE_POR_DEFECTO, dtype=np.int64)
+    for valor, puntos in PUNTAJES.items():
+        puntaje[pc.fill_null(pc.equal(tipo, valor), False).to_numpy(zero_copy_only=False)] = puntos
+    return pa.array(puntaje)
+
+
+def _unir_categoria(tabla: pa.Table, productos: pa.Table) -> pa.Table:
+    """
+    Inner join con la dimensión de productos (product_id único) por búsqueda binaria
+    sobre sus ids ordenados: la categoría sale con `take` y conserva su diccionario.
+    """
+    ids = productos["product_id"].to_numpy(zero_copy_only=False)
+    orden = np.argsort(ids, kind="stable")
+    ids_ordenados = ids[orden]
+    pid = pc.fill_null(tabla["product_id"], -1).to_numpy()
+    pos = np.searchsorted(ids_ordenados, pid).clip(max=max(len(ids) - 1, 0))
+    hit = (ids_ordenados[pos] == pid) & tabla["product_id"].is_valid().to_numpy(zero_copy_only=False) \
+        if len(ids) else np.zeros(len(pid), dtype=bool)
+    filas = np.flatnonzero(hit)
+    unidas = tabla.take(filas)
+    return unidas.append_column("categoria", productos["categoria"].take(orden[pos[filas]]))
+
+
+def _sumar(tabla: pa.Table, claves, columna: str) -> pa.Table:
+    """groupBy(claves).sum(columna), conservando los nombres de las columnas."""
+    suma = tabla.unify_dictionaries().group_by(list(claves), use_threads=False).aggregate([(columna, "sum")])
+    return suma.rename_columns([*claves, columna]).select([*claves, columna])
+
+
+class _SumaParcial:
+    """
+    Suma por claves bloque a bloque: guarda agregados parciales (las sumas son
+    asociativas) y los compacta cuando pasan de `max_filas`, así que la memoria
+    depende del número de claves distintas y no del de filas.
+    """
+
+    def __init__(self, claves, columna: str, max_filas: int):
+        self.claves = list(claves)
+        self.columna = columna
+        self.max_filas = max_filas
+        self.parciales = []
+        self.filas = 0
+
+    def agregar(self, tabla: pa.Table):
+        self.parciales.append(_sumar(tabla, self.claves, self.columna))
+        self.filas += self.parciales[-1].num_rows
+        if self.filas > self.max_filas:
+            self.parciales = [self.resultado()]
+            self.filas = self.parciales[0].num_rows
+
+    def resultado(self) -> Optional[pa.Table]:
+        if not self.parciales:
+            return None
+        return _sumar(pa.concat_tables(self.parciales), self.claves, self.columna)
+
+
+def _bucket(user_id: pa.ChunkedArray) -> pa.Array:
+    """pmod(user_id, N_BUCKETS_GOLD); los user_id nulos van al bucket -1."""
+    ids = pc.fill_null(user_id, -1).to_numpy()
+    bucket = np.mod(ids, N_BUCKETS_GOLD).astype(np.int32)
+    bucket[pc.is_null(user_id).to_numpy(zero_copy_only=False)] = -1
+    return pa.array(bucket)
+
+
+def _nombre_parte(i: str = "00000", lote: Optional[str] = None) -> str:
+    return f"part-{i}-{lote or uuid.uuid4()}.snappy.parquet"
+
+
+def _lote(desde: Optional[pd.Timestamp]) -> str:
+    """Etiqueta de los ficheros añadidos por una carga: depende sólo del watermark de partida."""
+    return "inicial" if desde is None else desde.strftime("w%Y%m%dT%H%M%S%f")
+
+
+def _borrar_lote(fs: pafs.FileSystem, ruta: str, lote: str):
+    """Borra los restos de una ejecución anterior con el mismo watermark (p. ej. si falló antes de guardarlo)."""
+    if not _existe_dir(fs, ruta):
+        return
+    for info in fs.get_file_info(pafs.FileSelector(ruta, recursive=True)):
+        if info.is_file and info.base_name.endswith(f"-{lote}.snappy.parquet"):
+            fs.delete_file(info.path)
+
+
+def _existe_dir(fs: pafs.FileSystem, ruta: str) -> bool:
+    return fs.get_file_info(ruta).type == pafs.FileType.Directory
+
+
+def _marcar_success(fs: pafs.FileSystem, ruta: str):
+    # Igual que Spark: _SUCCESS marca la tabla como completa
+    with fs.open_output_stream(_unir(ruta, "_SUCCESS")):
+        pass
+
+
+def _escribir_particionado(fs: pafs.FileSystem, ruta: str, datos, esquema: pa.Schema, particion,
+                           existentes: str = "overwrite_or_ignore", lote: Optional[str] = None):
+    """
+    Escribe `datos` (tabla o iterable de RecordBatch) con particiones hive.
+    existentes="overwrite_or_ignore" añade ficheros; "delete_matching" reescribe sólo
+    las particiones presentes en `datos` (el partitionOverwriteMode=dynamic de Spark).
+    """
+    fs.create_dir(ruta, recursive=True)
+    ds.write_dataset(
+        datos, ruta, schema=esquema, filesystem=fs, format="parquet", partitioning=particion,
+        basename_template=_nombre_parte("{i}", lote), existing_data_behavior=existentes,
+        # Sin mínimo, cada bloque del CSV dejaría un row group diminuto en cada partición
+        min_rows_per_group=1 << 16, max_rows_per_group=1 << 20,
+        file_options=ds.ParquetFileFormat().make_write_options(compression="snappy"),
+    )
+    _marcar_success(fs, ruta)
+
+
+def _leer_marca(fs: pafs.FileSystem, ruta: str) -> Optional[Dict]:
+    if not _existe_dir(fs, ruta):
+        return None
+    for info in fs.get_file_info(pafs.FileSelector(ruta)):
+        if info.path.endswith(".json"):
+            with fs.open_input_stream(info.path) as f:
+                return json.loads(f.read().decode("utf-8").splitlines()[0])
+    return None
+
+
+def _guardar_marca(fs: pafs.FileSystem, ruta: str, fila: Dict):
+    fs.create_dir(ruta, recursive=True)
+    fs.delete_dir_contents(ruta)
+    with fs.open_output_stream(_unir(ruta, "part-00000.json")) as f:
+        f.write((json.dumps(fila) + "\n").encode("utf-8"))
+    _marcar_success(fs, ruta)
+
+
+def _formatear_ts(ts: Optional[pd.Timestamp]) -> Optional[str]:
+    return None if ts is None else ts.strftime(FORMATO_WATERMARK)
+
+
+def leer_watermark(silver: str) -> Optional[pd.Timestamp]:
+    fs, base = _resolver(silver)
+    fila = _leer_marca(fs, _unir(base, RUTA_WATERMARK))
+    return None if fila is None else pd.Timestamp(fila["timestamp"], tz="UTC")
+
+
+def guardar_watermark(silver: str, watermark: pd.Timestamp):
+    fs, base = _resolver(silver)
+    _guardar_marca(fs, _unir(base, RUTA_WATERMARK), {"timestamp": _formatear_ts(watermark)})
+
+
+def _desde_gold(fs: pafs.FileSystem, base: str, tabla: str, desde: Optional[pd.Timestamp]) -> Optional[pd.Timestamp]:
+    """
+    Timestamp a partir del cual hay que sumar en gold/<tabla>: el watermark de silver o,
+    si una carga anterior ya sumó más y falló antes de guardar el watermark, su marca.
+    """
+    if desde is None:
+        return None
+    marca = _leer_marca(fs, _unir(base, RUTA_MARCAS_GOLD, tabla))
+    if marca is None:
+        # Gold escrito antes de que existieran las marcas
+        return desde
+    if marca.get("estado") != "completo":
+        raise RuntimeError(f"gold/{tabla} quedó a medio escribir en una carga anterior: relanza con --completo")
+    if marca.get("timestamp") is None:
+        return desde
+    return max(desde, pd.Timestamp(marca["timestamp"], tz="UTC"))
+
+
+class ReporteEjecucion:
+    """
+    Tiempo, filas y tamaño final (bytes_tabla) de cada etapa del ETL, para guardarlo en JSON.
+    gold/lectura_silver es la pasada única sobre silver (join y sumas parciales de las
+    dos tablas); las etapas gold/<tabla> son la combinación final y la escritura.
+    """
+
+    def __init__(self, **contexto):
+        self.datos = {"inicio": datetime.now(timezone.utc).isoformat(timespec="seconds"), **contexto, "etapas": []}
+
+    @contextmanager
+    def etapa(self, nombre: str, fs: Optional[pafs.FileSystem] = None, ruta: Optional[str] = None):
+        registro = {"etapa": nombre, "filas": 0}
+        inicio = time.perf_counter()
+        yield registro
+        registro["segundos"] = round(time.perf_counter() - inicio, 3)
+        if fs is not None and ruta is not None and _existe_dir(fs, ruta):
+            registro["bytes_tabla"] = sum(info.size for info in fs.get_file_info(pafs.FileSelector(ruta, recursive=True))
+                                    if info.is_file)
+        self.datos["etapas"].append(registro)
+
+    def guardar(self, ruta: str, **extra):
+        self.datos.update(extra)
+        self.datos["segundos_total"] = round(sum(e["segundos"] for e in self.datos["etapas"]), 3)
+        fs, ruta = _resolver(ruta)
+        with fs.open_output_stream(ruta) as f:
+            f.write(json.dumps(self.datos, indent=2, default=str).encode("utf-8"))
+
+
+class _EscritorTabla:
+    """Escribe una tabla como directorio Parquet (una parte + _SUCCESS), en modo overwrite."""
+
+    def __init__(self, fs: pafs.FileSystem, ruta: str, esquema: pa.Schema):
+        self.fs = fs
+        self.ruta = ruta
+        fs.create_dir(ruta, recursive=True)
+        fs.delete_dir_contents(ruta)
+        self.writer = pq.ParquetWriter(_unir(ruta, _nombre_parte()), esquema, filesystem=fs, compression="snappy")
+        self.filas = 0
+
+    def escribir(self, tabla: pa.Table):
+        self.writer.write_table(tabla)
+        self.filas += tabla.num_rows
+
+    def cerrar(self) -> int:
+        self.writer.close()
+        _marcar_success(self.fs, self.ruta)
+        return self.filas
+
+
+def bronze_a_silver(bronze: str, silver: str, bloque_mb: int = 16, desde: Optional[pd.Timestamp] = None,
+                    formato: str = "csv", reporte: Optional[ReporteEjecucion] = None
+                    ) -> Tuple[Dict[str, int], Optional[pd.Timestamp]]:
+    """
+    Lee los CSV de bronze por bloques, castea los tipos y escribe cada tabla en silver.
+    usuarios y productos se sobrescriben; de interacciones sólo se añaden las filas con
+    timestamp > `desde` (None = carga completa) en su partición `fecha`.
+    Devuelve las filas escritas y el nuevo watermark (mayor timestamp cargado).
+    """
+    reporte = reporte or ReporteEjecucion()
+    fs_in, base_in = _resolver(bronze)
+    fs_out, base_out = _resolver(silver)
+    filas = {}
+    for tabla in ("usuarios", "productos"):
+        esquema = ESQUEMAS_SILVER[tabla]
+        with reporte.etapa(f"silver/{tabla}", fs_out, _unir(base_out, tabla)) as etapa:
+            escritor = _EscritorTabla(fs_out, _unir(base_out, tabla), esquema)
+            for bloque in _leer_bronze(fs_in, base_in, tabla, esquema.names, formato, bloque_mb):
+                escritor.escribir(_castear(bloque, esquema))
+            filas[tabla] = etapa["filas"] = escritor.cerrar()
+
+    esquema = ESQUEMAS_SILVER["interacciones"]
+    ruta = _unir(base_out, "interacciones")
+    if desde is None and _existe_dir(fs_out, ruta):
+        fs_out.delete_dir_contents(ruta)
+    else:
+        _borrar_lote(fs_out, ruta, _lote(desde))
+    nuevas = {"filas": 0, "watermark": desde}
+
+    def bloques_nuevos() -> Iterator[pa.RecordBatch]:
+        for bloque in _leer_bronze(fs_in, base_in, "interacciones", esquema.names, formato, bloque_mb):
+            tabla = _castear(bloque, esquema)
+            if desde is not None:
+                # Las filas que llegan tarde (timestamp <= watermark) no se vuelven a cargar
+                tabla = tabla.filter(pc.greater(tabla["timestamp"], pa.scalar(desde.to_pydatetime(), TIMESTAMP)))
+            if not tabla.num_rows:
+                continue
+            maximo = pc.max(tabla["timestamp"]).as_py()
+            if maximo is not None and (nuevas["watermark"] is None or maximo > nuevas["watermark"]):
+                nuevas["watermark"] = pd.Timestamp(maximo)
+            nuevas["filas"] += tabla.num_rows
+            yield from tabla.append_column("fecha", pc.cast(tabla["timestamp"], pa.date32())).to_batches()
+
+    with reporte.etapa("silver/interacciones", fs_out, ruta) as etapa:
+        _escribir_particionado(fs_out, ruta, bloques_nuevos(), esquema.append(pa.field("fecha", pa.date32())),
+                               PARTICION_FECHA, lote=_lote(desde))
+        filas["interacciones"] = etapa["filas"] = nuevas["filas"]
+    return filas, nuevas["watermark"]
+
+
+def _fusionar_buckets(fs: pafs.FileSystem, ruta: str, nuevas: Optional[pa.Table], esquema: pa.Schema,
+                      claves: List[str], columna: str, desde: Optional[pd.Timestamp]) -> pa.Table:
+    """
+    Sumas de gold listas para escribir por bucket. En una carga completa se vacía la
+    tabla; en una incremental se suman las filas previas de los buckets tocados.
+    """
+    if desde is None and _existe_dir(fs, ruta):
+        fs.delete_dir_contents(ruta)
+    nuevas = esquema.empty_table() if nuevas is None else nuevas.select(esquema.names)
+    nuevas = nuevas.cast(esquema).append_column("bucket", _bucket(nuevas["user_id"]))
+    if desde is not None and nuevas.num_rows and _existe_dir(fs, ruta):
+        # Merge: sumas previas de los buckets tocados + sumas nuevas
+        tocados = pc.unique(nuevas["bucket"])
+        previos = ds.dataset(ruta, filesystem=fs, format="parquet", partitioning=PARTICION_BUCKET) \
+            .to_table(filter=ds.field("bucket").isin(tocados)).select(nuevas.column_names)
+        nuevas = _sumar(pa.concat_tables([previos.cast(nuevas.schema), nuevas]), claves + ["bucket"], columna) \
+            .select(nuevas.column_names).cast(nuevas.schema)
+    # Las columnas de diccionario no se pueden ordenar: basta con agrupar por las numéricas
+    return nuevas.sort_by([(c, "ascending") for c in claves if not pa.types.is_dictionary(esquema.field(c).type)])
+
+
+def silver_a_gold(silver: str, gold: str, bloque: int = 500_000, max_parciales: int = 4_000_000,
+                  desde: Optional[pd.Timestamp] = None, reporte: Optional[ReporteEjecucion] = None) -> Dict[str, int]:
+    """
+    Construye las tablas gold a partir de silver:
+    - ratings: suma de puntajes por (user_id, product_id), agregada por bloques
+    - interacciones_categoria: número de interacciones por (user_id, categoria,
+      tipo_interaccion), con el join (inner) a la categoría hecho y contado bloque a bloque
+
+    Con `desde` sólo se leen las particiones de silver desde el día del watermark, y las
+    sumas de las interacciones con timestamp > `desde` se añaden a las dos tablas
+    reescribiendo sólo los buckets afectados. Cada tabla guarda en gold/_watermarks/<tabla>
+    hasta dónde ha sumado: si una carga falló después de gold y antes del watermark, la
+    siguiente no vuelve a sumar esas filas. Una tabla a medio escribir exige --completo.
+    """
+    reporte = reporte or ReporteEjecucion()
+    fs_in, base_in = _resolver(silver)
+    fs_out, base_out = _resolver(gold)
+
+    # Dimensión de productos: pequeña, se carga entera (equivale al broadcast en Spark)
+    productos = pa.concat_tables(
+        _leer_parquet(fs_in, _unir(base_in, "productos"), bloque, columnas=["product_id", "categoria"])
+    ).unify_dictionaries().combine_chunks()
+
+    # Cada tabla suma desde su propia marca (más reciente que `desde` tras un reintento)
+    nombres = ("interacciones_categoria", "ratings")
+    desde_tabla = {nombre: _desde_gold(fs_out, base_out, nombre, desde) for nombre in nombres}
+
+    interacciones = ds.dataset(_unir(base_in, "interacciones"), filesystem=fs_in, format="parquet",
+                               partitioning=PARTICION_FECHA)
+    # El filtro por fecha poda particiones enteras
+    filtro = None if desde is None else ds.field("fecha") >= pa.scalar(desde.date(), pa.date32())
+    lotes = interacciones.to_batches(columns=["user_id", "product_id", "timestamp", "tipo_interaccion"],
+                                     filter=filtro, batch_size=bloque)
+
+    def posteriores(tabla: pa.Table, nombre: str) -> pa.Table:
+        # Los días frontera ya tienen filas sumadas en gold
+        if desde_tabla[nombre] is None:
+            return tabla
+        return tabla.filter(pc.greater(tabla["timestamp"], pa.scalar(desde_tabla[nombre].to_pydatetime(), TIMESTAMP)))
+
+    sumas = {
+        "interacciones_categoria": _SumaParcial(["user_id", "categoria", "tipo_interaccion"], "n_interacciones",
+                                                max_parciales),
+        "ratings": _SumaParcial(["user_id", "product_id"], "rating", max_parciales),
+    }
+    hasta = None
+    with reporte.etapa("gold/lectura_silver") as etapa:
+        for tabla in _agrupar_lotes(lotes, bloque):
+            etapa["filas"] += tabla.num_rows
+            maximo = pc.max(tabla["timestamp"]).as_py()
+            if maximo is not None and (hasta is None or maximo > hasta):
+                hasta = pd.Timestamp(maximo)
+
+            nuevas = posteriores(tabla, "ratings")
+            sumas["ratings"].agregar(nuevas.select(["user_id", "product_id"]).append_column(
+                "rating", _puntaje(nuevas["tipo_interaccion"])))
+
+            # Join con la dimensión y conteo en el mismo bloque: sólo se guardan conteos
+            unidas = _unir_categoria(posteriores(tabla, "interacciones_categoria"), productos)
+            sumas["interacciones_categoria"].agregar(unidas.select(sumas["interacciones_categoria"].claves)
+                                                     .append_column("n_interacciones",
+                                                                    pa.array(np.ones(unidas.num_rows, dtype=np.int64))))
+
+    filas = {}
+    for nombre in nombres:
+        ruta = _unir(base_out, nombre)
+        ruta_marca = _unir(base_out, RUTA_MARCAS_GOLD, nombre)
+        with reporte.etapa(f"gold/{nombre}", fs_out, ruta) as etapa:
+            # "escribiendo" hasta que todos los buckets estén escritos
+            _guardar_marca(fs_out, ruta_marca, {"timestamp": _formatear_ts(desde_tabla[nombre]), "estado": "escribiendo"})
+            tabla = _fusionar_buckets(fs_out, ruta, sumas[nombre].resultado(), ESQUEMAS_GOLD[nombre],
+                                      sumas[nombre].claves, sumas[nombre].columna, desde)
+            # delete_matching: sólo se reescriben los buckets presentes en esta carga
+            _escribir_particionado(fs_out, ruta, tabla, tabla.schema, PARTICION_BUCKET, existentes="delete_matching")
+            sumado = hasta if desde_tabla[nombre] is None or (hasta is not None and hasta > desde_tabla[nombre]) \
+                else desde_tabla[nombre]
+            _guardar_marca(fs_out, ruta_marca, {"timestamp": _formatear_ts(sumado), "estado": "completo"})
+            filas[nombre] = etapa["filas"] = tabla.num_rows
+    return filas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ETL bronze → silver → gold sin Spark (pyarrow)")
+    parser.add_argument("--bronze", type=str, default=".", help="Directorio/URI con las tablas de origen")
+    parser.add_argument("--bronze-formato", choices=sorted(FORMATOS_BRONZE), default="csv",
+                        help="csv (también .csv.gz), parquet o arrow (IPC/Feather)")
+    parser.add_argument("--silver", type=str, default="datalake/silver")
+    parser.add_argument("--gold", type=str, default="datalake/gold")
+    parser.add_argument("--bloque-mb", type=int, default=16, help="MB de bronze por bloque (bronze -> silver)")
+    parser.add_argument("--bloque", type=int, default=500_000, help="Filas por bloque de Parquet (silver -> gold)")
+    parser.add_argument("--completo", action="store_true", help="Ignora el watermark y recarga todo el histórico")
+    parser.add_argument("--reporte", type=str, default="etl_report.json",
+                        help="JSON con tiempo, filas y bytes de cada etapa ('' para no guardarlo)")
+    args = parser.parse_args()
+
+    desde = None if args.completo else leer_watermark(args.silver)
+    reporte = ReporteEjecucion(motor="local", modo="completo" if desde is None else "incremental",
+                               bronze_formato=args.bronze_formato, watermark_previo=desde)
+    if desde is None:
+        print(f"📁 Bronze -> Silver (carga completa) desde {args.bronze}...")
+    else:
+        print(f"📁 Bronze -> Silver (incremental, timestamp > {desde}) desde {args.bronze}...")
+    filas, watermark = bronze_a_silver(args.bronze, args.silver, args.bloque_mb, desde, args.bronze_formato, reporte)
+
+    if desde is not None and filas["interacciones"] == 0:
+        print("💤 Sin interacciones nuevas: gold no cambia")
+    else:
+        print("🥇 Silver -> Gold...")
+        silver_a_gold(args.silver, args.gold, args.bloque, desde=desde, reporte=reporte)
+    # El watermark se guarda al final: si algo falla antes, la próxima ejecución repite la carga
+    if watermark is not None and watermark != desde:
+        guardar_watermark(args.silver, watermark)
+        print(f"🔖 Watermark: {watermark}")
+
+    for etapa in reporte.datos["etapas"]:
+        tamano = f", {etapa['bytes_tabla'] / 1e6:.1f} MB" if "bytes_tabla" in etapa else ""
+        print(f"✅ {etapa['etapa']}: {etapa['filas']} filas en {etapa['segundos']:.2f}s{tamano}")
+    if args.reporte:
+        reporte.guardar(args.reporte, watermark=watermark)
+        print(f"📝 Reporte de la ejecución: {args.reporte}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,39 @@
 import os
+import json
+import time
 from pyspark.sql import SparkSession
-from pyspark.sql.functions import col, to_timestamp, lit
-from pyspark.sql.types import IntegerType, DoubleType, TimestampType
+from pyspark.sql.functions import col, to_timestamp, to_date, date_format, lit, when, pmod, broadcast
+from pyspark.sql.functions import max as spark_max, sum as spark_sum, count as spark_count, hash as spark_hash
+from pyspark.sql.types import IntegerType, DoubleType, TimestampType, StringType, StructType, StructField
 
 # --- CONFIGURACIÓN IMPORTANTE ---
 
 # ¡¡CAMBIA ESTO!! Pon el nombre exacto de tu bucket
 MI_BUCKET = "mi-proyecto-mlops-juangraciano-25-10-2025" 
 
+# Modo de carga: "incremental" (por defecto) sólo procesa las interacciones con
+# timestamp posterior al watermark guardado en silver; "completo" rehace todo.
+# La primera ejecución (sin watermark) siempre es completa.
+MODO_ETL = os.environ.get("ETL_MODO", "incremental")
+
+# Formato de bronze: "csv" (también .csv.gz, Spark lo descomprime al leer) o
+# "parquet" (<tabla>.parquet, p. ej. exportado desde Arrow con snappy/zstd)
+FORMATO_BRONZE = os.environ.get("BRONZE_FORMATO", "csv")
+
+# Sal para la agregación de ratings: con N > 1 cada (user_id, product_id) se reparte
+# en N sub-grupos (hash de timestamp y tipo, determinista ante reintentos) que se
+# suman en dos fases. AQE sólo parte particiones sesgadas en joins, no en un groupBy;
+# la sal compensa cuando hay pares usuario–producto muy calientes (el resto lo
+# absorbe la agregación parcial map-side de Spark). 0 = sin sal.
+SAL_RATINGS = int(os.environ.get("ETL_SAL_RATINGS", "0"))
+
+# Reporte de la ejecución (tiempo y filas de cada etapa), en el disco del driver
+RUTA_REPORTE = os.environ.get("ETL_REPORTE", "etl_report.json")
+
+# Las tablas gold se particionan en buckets por user_id: una carga incremental sólo
+# reescribe los buckets de los usuarios con interacciones nuevas
+N_BUCKETS_GOLD = 64
+
 # No necesitas tocar esto. Son las librerías mágicas que necesita Spark
 # para poder leer y escribir en S3 (s3a) usando tus credenciales de AWS.
 os.environ['PYSPARK_SUBMIT_ARGS'] = '--packages org.apache.hadoop:hadoop-aws:3.3.4 pyspark-shell'
@@ -51,20 +77,115 @@ print("¡Sesión de Spark creada con éxito!")
 ruta_bronze = f"s3a://{MI_BUCKET}/bronze/"
 ruta_silver = f"s3a://{MI_BUCKET}/silver/"
 ruta_gold = f"s3a://{MI_BUCKET}/gold/"
+ruta_watermark = f"{ruta_silver}_watermarks/interacciones/"
+
+
+def existe_ruta(ruta):
+    """True si la ruta ya existe en S3 (API de Hadoop FileSystem de la JVM)."""
+    ruta_hadoop = spark._jvm.org.apache.hadoop.fs.Path(ruta)
+    return ruta_hadoop.getFileSystem(spark._jsc.hadoopConfiguration()).exists(ruta_hadoop)
+
+
+# Esquemas declarados (tipos de silver): sin inferSchema, que recorre cada CSV dos veces
+ESQUEMA_USUARIOS = StructType([
+    StructField("user_id", IntegerType()),
+    StructField("nombre", StringType()),
+    StructField("ciudad", StringType()),
+    StructField("email", StringType()),
+    StructField("fecha_registro", TimestampType()),
+])
+ESQUEMA_PRODUCTOS = StructType([
+    StructField("product_id", IntegerType()),
+    StructField("nombre_producto", StringType()),
+    StructField("categoria", StringType()),
+    StructField("precio", DoubleType()),
+])
+ESQUEMA_INTERACCIONES = StructType([
+    StructField("user_id", IntegerType()),
+    StructField("product_id", IntegerType()),
+    StructField("timestamp", TimestampType()),
+    StructField("tipo_interaccion", StringType()),
+])
+
+# Columnas de pocos valores: se fuerza su codificación por diccionario en Parquet
+COLUMNAS_DICCIONARIO = ["categoria", "tipo_interaccion"]
+
+
+def ruta_bronze_csv(tabla):
+    """Primer CSV de bronze que exista (tabla.csv o tabla.csv.gz), igual que etl_local.py."""
+    # Un glob tabla.csv* leería las filas dos veces si conviven ambos archivos
+    for sufijo in (".csv", ".csv.gz"):
+        ruta = f"{ruta_bronze}{tabla}{sufijo}"
+        if existe_ruta(ruta):
+            return ruta
+    raise FileNotFoundError(f"No hay {tabla}.csv ni {tabla}.csv.gz en {ruta_bronze}")
+
+
+def leer_bronze(tabla, esquema):
+    """Lee una tabla de bronze con su esquema declarado y la deja con los tipos de silver."""
+    if FORMATO_BRONZE == "parquet":
+        # Columnar: sólo se leen las columnas del esquema
+        df = spark.read.parquet(f"{ruta_bronze}{tabla}.parquet")
+    else:
+        # Los timestamps se leen como texto y se castean como antes (inválidos -> null)
+        esquema_csv = StructType([
+            StructField(c.name, StringType() if isinstance(c.dataType, TimestampType) else c.dataType)
+            for c in esquema
+        ])
+        df = spark.read.csv(ruta_bronze_csv(tabla), header=True, schema=esquema_csv)
+    return df.select([col(c.name).cast(c.dataType) for c in esquema])
+
+
+def escritor_parquet(df):
+    """DataFrameWriter con codificación por diccionario explícita para COLUMNAS_DICCIONARIO."""
+    escritor = df.write.option("parquet.enable.dictionary", "true")
+    for columna in COLUMNAS_DICCIONARIO:
+        if columna in df.columns:
+            escritor = escritor.option(f"parquet.enable.dictionary#{columna}", "true")
+    return escritor
+
+
+reporte = {"motor": "spark", "bronze_formato": FORMATO_BRONZE, "etapas": []}
+
+
+def registrar_etapa(nombre, inicio, filas):
+    segundos = round(time.perf_counter() - inicio, 3)
+    reporte["etapas"].append({"etapa": nombre, "filas": filas, "segundos": segundos})
+    print(f"⏱️ {nombre}: {filas} filas en {segundos:.2f}s")
+
+
+def guardar_reporte(**extra):
+    reporte.update(extra)
+    reporte["segundos_total"] = round(sum(e["segundos"] for e in reporte["etapas"]), 3)
+    with open(RUTA_REPORTE, "w", encoding="utf-8") as f:
+        json.dump(reporte, f, indent=2, default=str)
+    print(f"Reporte de la ejecución guardado en: {RUTA_REPORTE}")
+
+
+# Watermark: mayor 'timestamp' de interacciones ya cargado en silver
+watermark = None
+if MODO_ETL != "completo" and existe_ruta(ruta_watermark):
+    watermark = spark.read.json(ruta_watermark).first()["timestamp"]
+incremental = watermark is not None
+reporte.update(modo="incremental" if incremental else "completo", watermark_previo=watermark)
+if incremental:
+    print(f"Carga incremental: interacciones con timestamp > {watermark}")
+else:
+    print("Carga completa (sin watermark o ETL_MODO=completo)")
 
 
 # --- 2. PROCESO BRONZE -> SILVER ---
 print(f"Iniciando ETL de Bronze a Silver...")
 
-# Leemos nuestros 3 archivos CSV crudos desde S3
+# Leemos nuestras 3 tablas crudas desde S3 con sus esquemas declarados
 try:
-    df_usuarios = spark.read.csv(f"{ruta_bronze}usuarios.csv", header=True, inferSchema=True)
-    df_productos = spark.read.csv(f"{ruta_bronze}productos.csv", header=True, inferSchema=True)
-    df_interacciones = spark.read.csv(f"{ruta_bronze}interacciones.csv", header=True, inferSchema=True)
+    df_usuarios_silver = leer_bronze("usuarios", ESQUEMA_USUARIOS)
+    df_productos_silver = leer_bronze("productos", ESQUEMA_PRODUCTOS)
+    df_interacciones = leer_bronze("interacciones", ESQUEMA_INTERACCIONES)
 
     print("Datos leídos de la capa Bronze:")
-    df_usuarios.printSchema()
-    df_productos.printSchema()
+    df_usuarios_silver.printSchema()
+    df_productos_silver.printSchema()
     df_interacciones.printSchema()
 
 except Exception as e:
@@ -75,33 +196,54 @@ except Exception as e:
 
 
 # ---- Transformación (Limpieza) ----
-# Aquí es donde haríamos la limpieza. Nuestros datos ficticios
-# ya están limpios, pero vamos a hacer las conversiones de tipos
-# de datos para asegurarnos (¡buena práctica!)
-
-# Convertir tipos de datos de productos
-df_productos_silver = df_productos \
-    .withColumn("product_id", col("product_id").cast(IntegerType())) \
-    .withColumn("precio", col("precio").cast(DoubleType()))
-
-# Convertir tipos de datos de usuarios
-df_usuarios_silver = df_usuarios \
-    .withColumn("user_id", col("user_id").cast(IntegerType())) \
-    .withColumn("fecha_registro", col("fecha_registro").cast(TimestampType()))
-
-# Convertir tipos de datos de interacciones
-df_interacciones_silver = df_interacciones \
-    .withColumn("user_id", col("user_id").cast(IntegerType())) \
-    .withColumn("product_id", col("product_id").cast(IntegerType())) \
-    .withColumn("timestamp", col("timestamp").cast(TimestampType()))
+# Los tipos ya vienen del esquema declarado (leer_bronze), así que no hace falta
+# castear otra vez. Sólo añadimos 'fecha' (día del timestamp), la columna de
+# partición de las interacciones en silver.
+df_interacciones_silver = df_interacciones.withColumn("fecha", to_date(col("timestamp")))
+
+# Sólo las interacciones posteriores al watermark (las que llegan tarde no se recargan)
+df_nuevas = df_interacciones_silver
+if incremental:
+    df_nuevas = df_nuevas.where(col("timestamp") > to_timestamp(lit(watermark)))
+inicio = time.perf_counter()
+df_nuevas = df_nuevas.cache()
+n_nuevas = df_nuevas.count()
+nuevo_watermark = df_nuevas.agg(date_format(spark_max("timestamp"), "yyyy-MM-dd HH:mm:ss.SSSSSS")).first()[0]
+print(f"Interacciones a cargar: {n_nuevas}")
 
 # ---- Escritura en Silver ----
 # Guardamos los datos limpios en formato Parquet.
 # Parquet es mucho más rápido y eficiente que CSV.
 print("Guardando datos limpios en capa Silver (Formato Parquet)...")
-df_usuarios_silver.write.mode("overwrite").parquet(f"{ruta_silver}usuarios/")
-df_productos_silver.write.mode("overwrite").parquet(f"{ruta_silver}productos/")
-df_interacciones_silver.write.mode("overwrite").parquet(f"{ruta_silver}interacciones/")
+for tabla, df_tabla in [("usuarios", df_usuarios_silver), ("productos", df_productos_silver)]:
+    inicio_tabla = time.perf_counter()
+    df_tabla = df_tabla.cache()
+    escritor_parquet(df_tabla).mode("overwrite").parquet(f"{ruta_silver}{tabla}/")
+    registrar_etapa(f"silver/{tabla}", inicio_tabla, df_tabla.count())
+    df_tabla.unpersist()
+
+if incremental and n_nuevas == 0:
+    print("Sin interacciones nuevas desde el watermark: interacciones y gold no cambian.")
+    guardar_reporte(watermark=watermark)
+    spark.stop()
+    exit()
+
+if incremental:
+    # Se reescriben sólo los días con filas nuevas (partitionOverwriteMode=dynamic):
+    # sus filas ya cargadas (<= watermark) + las nuevas. Si un intento anterior falló
+    # antes de guardar el watermark, sus filas (> watermark) se descartan y no se duplican.
+    fechas_nuevas = [fila["fecha"] for fila in df_nuevas.select("fecha").distinct().collect()]
+    df_dias_previos = spark.read.parquet(f"{ruta_silver}interacciones/") \
+        .where(col("fecha").isin(fechas_nuevas) & (col("timestamp") <= to_timestamp(lit(watermark))))
+    # localCheckpoint corta el linaje: no se puede sobrescribir lo que se está leyendo
+    df_dias = df_dias_previos.unionByName(df_nuevas).localCheckpoint()
+    escritor_parquet(df_dias).mode("overwrite").option("partitionOverwriteMode", "dynamic") \
+        .partitionBy("fecha").parquet(f"{ruta_silver}interacciones/")
+else:
+    escritor_parquet(df_nuevas).mode("overwrite").partitionBy("fecha").parquet(f"{ruta_silver}interacciones/")
+# Incluye la lectura de bronze (el count que materializa df_nuevas)
+registrar_etapa("silver/interacciones", inicio, n_nuevas)
+df_nuevas.unpersist()
 
 print("¡Capa Silver completada!")
 
@@ -109,9 +251,71 @@ print("¡Capa Silver completada!")
 # --- 3. PROCESO SILVER -> GOLD ---
 print("Iniciando ETL de Silver a Gold...")
 
-# Ahora que los datos están limpios (en Parquet), los leemos de Silver
-df_interacciones_limpias = spark.read.parquet(f"{ruta_silver}interacciones/")
-df_productos_limpios = spark.read.parquet(f"{ruta_silver}productos/")
+# Ahora que los datos están limpios (en Parquet), los leemos de Silver.
+# En modo incremental el filtro por 'fecha' poda las particiones anteriores al watermark,
+# y de los días frontera sólo cuentan las filas posteriores (las demás ya suman en gold).
+# Sólo se leen las columnas que usa gold (Parquet lee por columnas)
+df_interacciones_limpias = spark.read.parquet(f"{ruta_silver}interacciones/") \
+    .select("user_id", "product_id", "timestamp", "tipo_interaccion", "fecha")
+df_productos_limpios = spark.read.parquet(f"{ruta_silver}productos/").select("product_id", "categoria")
+if incremental:
+    df_interacciones_limpias = df_interacciones_limpias \
+        .where((col("fecha") >= to_date(lit(watermark))) & (col("timestamp") > to_timestamp(lit(watermark))))
+
+
+# Marcas de gold (gold/_watermarks/<tabla>/): hasta qué timestamp tiene sumado cada tabla
+# y si su última escritura terminó. Si una carga falla entre gold y el watermark de silver,
+# el reintento no vuelve a sumar esas filas. Mismo formato que etl_local.py.
+ESQUEMA_MARCA_GOLD = "timestamp STRING, estado STRING"
+
+
+def ruta_marca_gold(tabla):
+    return f"{ruta_gold}_watermarks/{tabla}/"
+
+
+def guardar_marca_gold(tabla, timestamp, estado):
+    spark.createDataFrame([(timestamp, estado)], ESQUEMA_MARCA_GOLD) \
+        .coalesce(1).write.mode("overwrite").json(ruta_marca_gold(tabla))
+
+
+def desde_gold(tabla):
+    """Timestamp desde el que se suma en gold/<tabla>: el watermark o la marca, si va por delante."""
+    if not incremental:
+        return None
+    if not existe_ruta(ruta_marca_gold(tabla)):
+        # Gold escrito antes de que existieran las marcas
+        return watermark
+    marca = spark.read.schema(ESQUEMA_MARCA_GOLD).json(ruta_marca_gold(tabla)).first()
+    if marca["estado"] != "completo":
+        raise RuntimeError(f"gold/{tabla} quedó a medio escribir en una carga anterior: relanza con ETL_MODO=completo")
+    # Ambos con formato yyyy-MM-dd HH:mm:ss.SSSSSS: el orden de texto es el cronológico
+    return max(watermark, marca["timestamp"] or watermark)
+
+
+desde_tabla = {tabla: desde_gold(tabla) for tabla in ("ratings", "interacciones_categoria")}
+
+
+def posteriores(df, tabla):
+    """Interacciones que gold/<tabla> todavía no ha sumado."""
+    if desde_tabla[tabla] is None:
+        return df
+    return df.where(col("timestamp") > to_timestamp(lit(desde_tabla[tabla])))
+
+
+def fusionar_buckets(df_tabla, tabla, claves, columna):
+    """Añade la columna 'bucket' y, en incremental, suma lo ya guardado en los buckets afectados."""
+    df_tabla = df_tabla.withColumn(
+        "bucket", when(col("user_id").isNull(), -1).otherwise(pmod(col("user_id"), lit(N_BUCKETS_GOLD))))
+    if not (incremental and existe_ruta(f"{ruta_gold}{tabla}/")):
+        return df_tabla
+    buckets_nuevos = [fila["bucket"] for fila in df_tabla.select("bucket").distinct().collect()]
+    df_previo = spark.read.parquet(f"{ruta_gold}{tabla}/").where(col("bucket").isin(buckets_nuevos))
+    # localCheckpoint corta el linaje: no se puede sobrescribir lo que se está leyendo
+    return df_previo.unionByName(df_tabla) \
+        .groupBy("bucket", *claves) \
+        .agg(spark_sum(columna).alias(columna)) \
+        .localCheckpoint()
+
 
 # ---- Creación de "Features" para ML ----
 # Esta es la parte más importante para Data Science.
@@ -120,41 +324,70 @@ df_productos_limpios = spark.read.parquet(f"{ruta_silver}productos/")
 # Tabla 1: "user_features"
 # Crearemos un "puntaje" simple para cada usuario basado en sus interacciones
 # (compra=4, carrito=3, clic=2, visto=1)
-from pyspark.sql.functions import when
-
-df_puntajes = df_interacciones_limpias.withColumn("puntaje",
+df_puntajes = posteriores(df_interacciones_limpias, "ratings").withColumn("puntaje",
     when(col("tipo_interaccion") == "compra", 4)
     .when(col("tipo_interaccion") == "agregado_al_carrito", 3)
     .when(col("tipo_interaccion") == "clic", 2)
     .otherwise(1)
 )
-
 # Agrupamos por usuario y producto, y sumamos los puntajes
+if SAL_RATINGS > 1:
+    # Fase 1 con sal: un par muy caliente se reparte entre SAL_RATINGS particiones
+    df_puntajes = df_puntajes \
+        .withColumn("sal", pmod(spark_hash(col("timestamp"), col("tipo_interaccion")), lit(SAL_RATINGS))) \
+        .groupBy("user_id", "product_id", "sal") \
+        .agg(spark_sum("puntaje").alias("puntaje"))
 df_rating = df_puntajes.groupBy("user_id", "product_id") \
-    .sum("puntaje") \
-    .withColumnRenamed("sum(puntaje)", "rating")
+    .agg(spark_sum("puntaje").alias("rating"))
+df_rating = fusionar_buckets(df_rating, "ratings", ["user_id", "product_id"], "rating")
 
 print("Tabla 'ratings' (user_id, product_id, rating) creada.")
-df_rating.show(5)
 
 # Tabla 2: "product_features"
-# Vamos a unir las interacciones con las categorías de productos
-# para saber qué categorías ve o compra cada usuario.
-df_interacciones_categoria = df_interacciones_limpias \
-    .join(df_productos_limpios, "product_id") \
-    .select("user_id", "categoria", "tipo_interaccion")
+# Cuántas interacciones de cada tipo tiene cada usuario en cada categoría:
+# (user_id, categoria, tipo_interaccion, n_interacciones) en lugar de una fila por
+# interacción. productos es pequeña y va en broadcast, así que el join no baraja las
+# interacciones y la agregación parcial se hace en el mismo stage (map-side).
+# Como ratings, se particiona por bucket y en incremental se suman los conteos nuevos.
+df_interacciones_categoria = posteriores(df_interacciones_limpias, "interacciones_categoria") \
+    .join(broadcast(df_productos_limpios), "product_id") \
+    .groupBy("user_id", "categoria", "tipo_interaccion") \
+    .agg(spark_count(lit(1)).alias("n_interacciones"))
+df_interacciones_categoria = fusionar_buckets(
+    df_interacciones_categoria, "interacciones_categoria", ["user_id", "categoria", "tipo_interaccion"],
+    "n_interacciones")
 
 print("Tabla 'interacciones_categoria' creada.")
-df_interacciones_categoria.show(5)
 
 # ---- Escritura en Gold ----
 print("Guardando tablas agregadas en capa Gold (Formato Parquet)...")
 
-# Guardamos nuestras dos tablas de features
-df_rating.write.mode("overwrite").parquet(f"{ruta_gold}ratings/")
-df_interacciones_categoria.write.mode("overwrite").parquet(f"{ruta_gold}interacciones_categoria/")
+# Guardamos nuestras dos tablas de features. En incremental, "overwrite" dinámico
+# sólo sustituye los buckets que aparecen en los datos nuevos.
+# Se cachean antes de escribir para contar las filas del reporte sin recalcular.
+modo_particiones = "dynamic" if incremental else "static"
+for tabla, df_tabla in [("ratings", df_rating), ("interacciones_categoria", df_interacciones_categoria)]:
+    inicio_tabla = time.perf_counter()
+    df_tabla = df_tabla.cache()
+    # "escribiendo" hasta que todos los buckets estén escritos
+    guardar_marca_gold(tabla, desde_tabla[tabla], "escribiendo")
+    escritor_parquet(df_tabla).mode("overwrite").option("partitionOverwriteMode", modo_particiones) \
+        .partitionBy("bucket").parquet(f"{ruta_gold}{tabla}/")
+    guardar_marca_gold(tabla, max((t for t in (desde_tabla[tabla], nuevo_watermark) if t is not None), default=None),
+                       "completo")
+    registrar_etapa(f"gold/{tabla}", inicio_tabla, df_tabla.count())
+    df_tabla.show(5)
+    df_tabla.unpersist()
 
 print("¡Capa Gold completada!")
+
+# El watermark se guarda al final: si algo falla antes, la próxima ejecución repite
+# la carga. Las marcas de gold evitan volver a sumar lo que ya se sumó en gold.
+if nuevo_watermark is not None:
+    spark.createDataFrame([(nuevo_watermark,)], ["timestamp"]) \
+        .coalesce(1).write.mode("overwrite").json(ruta_watermark)
+    print(f"Watermark actualizado: {nuevo_watermark}")
+guardar_reporte(watermark=nuevo_watermark or watermark)
 print("¡Proceso ETL de Spark finalizado con éxito!")
 
 # --- 4. Finalizar Sesión ---
@@ -0,0 +1,123 @@
+"""
+📤 Exportación de los factores del modelo ALS (servir sin Spark)
+===============================================================
+
+Lee el ALSModel guardado por entrenar_modelo.py y escribe sus factores latentes
+en un directorio de .npy con un manifest.json versionado:
+
+    modelo_als_factores/
+    ├── manifest.json
+    ├── user_ids.npy        # int64, ID real de cada fila (ordenado)
+    ├── user_factors.npy    # float32 (n_usuarios, rank)
+    ├── item_ids.npy        # int64, product_id de cada fila (ordenado)
+    └── item_factors.npy    # float32 (n_productos, rank)
+
+La predicción de ALS para (usuario, producto) es el producto punto de sus
+factores, así que api_als.py responde /recomendar/{user_id} con NumPy, sin JVM.
+
+Uso:
+    python exportar_factores_als.py --modelo s3a://<bucket>/models/modelo_als_v1 --salida modelo_als_factores
+"""
+
+import argparse
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Tuple
+
+import numpy as np
+
+FORMATO = "factores-als"
+FORMATO_VERSION = 1
+
+# ¡¡CAMBIA ESTO!! Mismo bucket que entrenar_modelo.py
+MI_BUCKET = "mi-proyecto-mlops-juangraciano-25-10-2025"
+
+ARCHIVOS = {
+    "user_ids": "user_ids.npy",
+    "user_factors": "user_factors.npy",
+    "item_ids": "item_ids.npy",
+    "item_factors": "item_factors.npy",
+}
+
+
+def factores_a_numpy(df_factores, rank: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Convierte un DataFrame (id, features) de ALS en (ids ordenados, matriz float32 alineada)"""
+    filas = df_factores.select("id", "features").toPandas()
+    ids = filas["id"].to_numpy(dtype=np.int64)
+    factores = np.zeros((len(filas), rank), dtype=np.float32)
+    if len(filas):
+        factores[:] = np.stack(filas["features"].to_numpy())
+    orden = np.argsort(ids, kind="stable")
+    return ids[orden], factores[orden]
+
+
+def exportar_factores(modelo, destino: Path) -> Dict:
+    """Escribe los factores de usuario y de producto de un ALSModel en `destino`"""
+    destino.mkdir(parents=True, exist_ok=True)
+    user_ids, user_factors = factores_a_numpy(modelo.userFactors, modelo.rank)
+    item_ids, item_factors = factores_a_numpy(modelo.itemFactors, modelo.rank)
+    for nombre, valores in (("user_ids", user_ids), ("user_factors", user_factors),
+                            ("item_ids", item_ids), ("item_factors", item_factors)):
+        np.save(destino / ARCHIVOS[nombre], valores)
+
+    manifest = {
+        "formato": FORMATO,
+        "version": FORMATO_VERSION,
+        "creado": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "rank": int(modelo.rank),
+        "usuarios": len(user_ids),
+        "productos": len(item_ids),
+        "archivos": ARCHIVOS,
+    }
+    # El manifest se escribe al final: un directorio sin manifest está incompleto
+    (destino / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    return manifest
+
+
+def cargar_factores(ruta: Path) -> Dict:
+    """Abre los factores exportados (memory-mapped) y valida el formato"""
+    ruta = Path(ruta)
+    manifest = json.loads((ruta / "manifest.json").read_text(encoding="utf-8"))
+    if manifest.get("formato") != FORMATO or manifest.get("version") != FORMATO_VERSION:
+        raise ValueError(f"Factores ALS no soportados: {manifest.get('formato')} v{manifest.get('version')}")
+    factores = {nombre: np.load(ruta / archivo, mmap_mode="r") for nombre, archivo in manifest["archivos"].items()}
+    factores["manifest"] = manifest
+    return factores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta los factores de un ALSModel a .npy para api_als.py")
+    parser.add_argument("--modelo", type=str, default=f"s3a://{MI_BUCKET}/models/modelo_als_v1")
+    parser.add_argument("--salida", type=str, default="modelo_als_factores")
+    args = parser.parse_args()
+
+    # Spark sólo hace falta para exportar; la API sólo carga los .npy
+    from pyspark.sql import SparkSession
+    from pyspark.ml.recommendation import ALSModel
+
+    os.environ['PYSPARK_SUBMIT_ARGS'] = '--packages org.apache.hadoop:hadoop-aws:3.3.4 pyspark-shell'
+    spark = SparkSession.builder \
+        .appName("Exportacion de factores ALS") \
+        .config("spark.hadoop.fs.s3a.aws.credentials.provider", "com.amazonaws.auth.DefaultAWSCredentialsProviderChain") \
+        .config("spark.hadoop.fs.s3a.impl", "org.apache.hadoop.fs.s3a.S3AFileSystem") \
+        .config("spark.hadoop.fs.s3a.path.style.access", "true") \
+        .config("spark.hadoop.fs.s3a.connection.timeout", "200000") \
+        .config("spark.hadoop.fs.s3a.connection.establish.timeout", "5000") \
+        .config("spark.hadoop.io.native.lib.available", "false") \
+        .getOrCreate()
+    spark.sparkContext.setLogLevel("ERROR")
+
+    try:
+        print(f"📁 Cargando modelo ALS desde {args.modelo}...")
+        modelo = ALSModel.load(args.modelo)
+        manifest = exportar_factores(modelo, Path(args.salida))
+        print(f"✅ Factores guardados en {args.salida}: {manifest['usuarios']} usuarios, "
+              f"{manifest['productos']} productos, rank {manifest['rank']}")
+    finally:
+        spark.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark del coste de excluir items vistos en la recuperación top-k.
+Mide la función de la API (`_search` de services/api/main.py) para k=10 y k=100,
+sin exclusión frente a:
+  - mask: scores de los vistos a -inf antes de argpartition (fallback brute-force)
+  - overfetch: pedir k + vistos candidatos al índice y filtrar (FAISS), con el mismo
+    límite SEEN_OVERFETCH_FACTOR * k que la API
+
+Uso:
+    python bench_seen_exclusion.py --artifacts .artifacts
+    python bench_seen_exclusion.py --synthetic --n-users 50000 --n-items 20000 --seen-per-user 50
+"""
+import argparse
+import importlib.util
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+try:
+    import faiss  # type: ignore
+except Exception:
+    faiss = None
+
+# Se mide el código que sirve la API, no una copia
+_API_MAIN = Path(__file__).resolve().parents[1] / "services" / "api" / "main.py"
+_spec = importlib.util.spec_from_file_location("two_tower_api", _API_MAIN)
+api = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(api)
+
+
+def _timeit(fn, repeats: int) -> float:
+    fn()  # calentamiento
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - t0) / repeats * 1000.0
+
+
+def benchmark_seen_exclusion(user_vecs: np.ndarray, item_vecs: np.ndarray, seen, k_list=(10, 100),
+                             batch_size: int = 1024, repeats: int = 5, seed: int = 0) -> List[Dict]:
+    """Milisegundos por lote de `batch_size` usuarios con y sin exclusión de vistos."""
+    rng = np.random.default_rng(seed)
+    users = rng.choice(user_vecs.shape[0], size=min(batch_size, user_vecs.shape[0]), replace=False)
+    item_matrix, item_scale = api._prepare_item_matrix(item_vecs, "float32")
+    n_items = item_matrix.shape[0]
+    indptr = np.asarray(seen[0])
+    n_seen = indptr[users + 1] - indptr[users]
+
+    index = None
+    if faiss is not None:
+        index = faiss.IndexFlatIP(item_matrix.shape[1])
+        index.add(item_matrix)
+
+    def bundle(with_index: bool, with_seen: bool):
+        return api.ModelBundle(
+            version="bench", meta=None, index=index if with_index else None, user_vecs=user_vecs,
+            item_matrix=item_matrix, item_scale=item_scale,
+            seen_indptr=indptr if with_seen else None, seen_items=seen[1] if with_seen else None,
+        )
+
+    results = []
+    for k in k_list:
+        k = min(k, n_items)
+        row = {"k": k, "users": len(users), "max_seen": int(n_seen.max()),
+               "exact_rows": int((n_seen > api.SEEN_OVERFETCH_FACTOR * k).sum())}
+        for name, with_index, with_seen in (("brute_ms", False, False), ("brute_mask_ms", False, True),
+                                            ("faiss_ms", True, False), ("faiss_overfetch_ms", True, True)):
+            if with_index and index is None:
+                continue
+            b = bundle(with_index, with_seen)
+            row[name] = _timeit(lambda: api._search(b, users, k), repeats)
+        results.append(row)
+    return results
+
+
+def _synthetic(n_users: int, n_items: int, dim: int, seen_per_user: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    user_vecs = rng.normal(size=(n_users, dim)).astype(np.float32)
+    item_vecs = rng.normal(size=(n_items, dim)).astype(np.float32)
+    counts = rng.poisson(seen_per_user, size=n_users).clip(0, n_items)
+    indptr = np.zeros(n_users + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    indices = np.concatenate([np.sort(rng.choice(n_items, size=c, replace=False)) for c in counts]).astype(np.int32)
+    return user_vecs, item_vecs, (indptr, indices)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coste de excluir items vistos en el top-k")
+    parser.add_argument("--artifacts", type=str, default=".artifacts")
+    parser.add_argument("--synthetic", action="store_true", help="Datos aleatorios en lugar de artefactos")
+    parser.add_argument("--n-users", type=int, default=20000)
+    parser.add_argument("--n-items", type=int, default=10000)
+    parser.add_argument("--dim", type=int, default=32)
+    parser.add_argument("--seen-per-user", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        user_vecs, item_vecs, seen = _synthetic(args.n_users, args.n_items, args.dim, args.seen_per_user)
+    else:
+        artifacts = Path(args.artifacts)
+        user_vecs = np.load(artifacts / "user_vecs.npy")
+        item_vecs = np.load(artifacts / "item_vecs.npy")
+        seen = (np.load(artifacts / "seen_indptr.npy"), np.load(artifacts / "seen_items.npy"))
+
+    print(f"Usuarios: {user_vecs.shape[0]}, Items: {item_vecs.shape[0]}, pares vistos: {len(seen[1])}")
+    for row in benchmark_seen_exclusion(user_vecs, item_vecs, seen, batch_size=args.batch_size, repeats=args.repeats):
+        line = (f"k={row['k']:>4} lote={row['users']} max_vistos={row['max_seen']} "
+                f"exactas={row['exact_rows']} | "
+                f"brute {row['brute_ms']:.2f} ms -> mask {row['brute_mask_ms']:.2f} ms "
+                f"({(row['brute_mask_ms'] / row['brute_ms'] - 1) * 100:+.0f}%)")
+        if "faiss_ms" in row:
+            line += (f" | faiss {row['faiss_ms']:.2f} ms -> overfetch {row['faiss_overfetch_ms']:.2f} ms "
+                     f"({(row['faiss_overfetch_ms'] / row['faiss_ms'] - 1) * 100:+.0f}%)")
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,10 +4,11 @@ Busca la mejor combinación de dim, lr, epochs, batch_size para maximizar Recall
 """
 import argparse
 import json
+import os
 from pathlib import Path
 import numpy as np
 import pandas as pd
-from typing import Dict
+from typing import Dict, Optional
 
 try:
     import optuna
@@ -34,7 +35,7 @@ except ImportError:
 try:
     import torch
     import torch.nn as nn
-    from torch.utils.data import Dataset, DataLoader
+    from torch.utils.data import Dataset
 except Exception:
     torch = None
     nn = None
@@ -44,64 +45,120 @@ import sys
 sys.path.append(str(Path(__file__).parent))
 from train_two_tower import (
     load_data, train_val_split, compute_metrics,
-    InteractionsDataset, TwoTower
+    build_seen_items, save_seen_items, remap_ids, save_id_vocabs, resolve_split_cache, TwoTower
 )
+if torch is not None:
+    from train_two_tower import TensorInteractions, build_batches, make_loss_fn
+
+# Artefactos del modelo final (re-entrenado con los mejores hiperparámetros)
+ARTIFACTS_DIR = Path(".artifacts_best")
 
 
 def train_trial(
-    train_df: pd.DataFrame,
+    train_df: "pd.DataFrame | TensorInteractions",
     val_df: pd.DataFrame,
     n_users: int,
     n_items: int,
     dim: int,
     lr: float,
     epochs: int,
-    batch_size: int
+    batch_size: int,
+    objective: str = "mse",
+    seen=None,
+    trial: "optuna.Trial" = None,
+    **loss_kwargs
 ) -> Dict[str, float]:
-    """Entrena un trial y retorna métricas de validación."""
+    """
+    Entrena un trial y retorna métricas de validación.
+    `train_df` puede ser un TensorInteractions ya construido para no convertir los datos en cada trial.
+    `seen` (CSR de build_seen_items) excluye de la evaluación los items vistos en train.
+    Con `trial`, reporta Recall@10 al final de cada epoch y lanza TrialPruned si el pruner lo decide.
+    """
     if torch is None:
         raise RuntimeError("Torch no disponible. HPO requiere PyTorch.")
     
     model = TwoTower(n_users=n_users, n_items=n_items, dim=dim)
     opt = torch.optim.Adam(model.parameters(), lr=lr)
-    ds = InteractionsDataset(train_df, n_users, n_items)
-    dl = DataLoader(ds, batch_size=batch_size, shuffle=True)
+    train_items = train_df.items.numpy() if isinstance(train_df, TensorInteractions) else train_df["product_id"].to_numpy()
+    loss_fn = make_loss_fn(objective, train_items, n_items, **loss_kwargs)
     
     model.train()
     final_loss = 0.0
     for ep in range(epochs):
         total = 0.0
+        dl, n_samples = build_batches(train_df, n_users, n_items, batch_size=batch_size, shuffle=True)
         for u, i, y in dl:
             u = u.long()
             i = i.long()
             y = y.float()
-            pred = model(u, i)
-            loss = ((pred - y)**2).mean()
+            loss = loss_fn(model, u, i, y)
             opt.zero_grad()
             loss.backward()
             opt.step()
             total += loss.item() * len(u)
-        final_loss = total / len(ds)
+        final_loss = total / n_samples
+        if trial is not None and ep < epochs - 1:
+            step_metrics = compute_metrics(model.user_vectors(), model.item_vectors(), val_df, k_list=[10], seen=seen)
+            trial.report(step_metrics["recall@10"], ep)
+            if trial.should_prune():
+                raise optuna.TrialPruned()
     
     # Evaluar
     user_vecs = model.user_vectors()
     item_vecs = model.item_vectors()
-    val_metrics = compute_metrics(user_vecs, item_vecs, val_df, k_list=[5, 10, 20])
+    val_metrics = compute_metrics(user_vecs, item_vecs, val_df, k_list=[5, 10, 20], seen=seen)
     val_metrics["final_train_loss"] = final_loss
     
     return val_metrics
 
 
-def objective(trial: "optuna.Trial", train_df: pd.DataFrame, val_df: pd.DataFrame, n_users: int, n_items: int) -> float:
-    """Función objetivo de Optuna: maximizar Recall@10."""
+def loss_params(params: Dict) -> Dict:
+    """Extrae de los hiperparámetros (trial o best_params) los argumentos de la función de pérdida."""
+    if params.get("objective", "mse") != "inbatch":
+        return {"objective": params.get("objective", "mse")}
+    return {
+        "objective": "inbatch",
+        "temperature": params["temperature"],
+        "logq_correction": params["logq_correction"],
+        "n_negatives": params["extra_negatives"],
+        "negative_sampling": params.get("negative_sampling", "uniform"),
+    }
+
+
+def objective(trial: "optuna.Trial", train_df: "pd.DataFrame | TensorInteractions", val_df: pd.DataFrame, n_users: int, n_items: int,
+              objectives=("mse", "inbatch"), seen=None, prune: bool = False, levels=None,
+              reduction_factor: int = 3) -> float:
+    """
+    Función objetivo de Optuna: maximizar Recall@10.
+    Con `levels` (ver build_fidelity_levels) el trial pasa antes por los subconjuntos baratos:
+    cada nivel reporta Recall@10 en el paso reduction_factor**nivel y el SuccessiveHalvingPruner
+    decide si el trial sigue al siguiente nivel; sólo los que sobreviven entrenan con todos los datos.
+    """
     # Espacio de búsqueda
     dim = trial.suggest_int("dim", 8, 64, step=8)
     lr = trial.suggest_float("lr", 1e-4, 1e-1, log=True)
     epochs = trial.suggest_int("epochs", 3, 15)
     batch_size = trial.suggest_categorical("batch_size", [128, 256, 512])
+    trial.suggest_categorical("objective", list(objectives))
+    if trial.params["objective"] == "inbatch":
+        trial.suggest_float("temperature", 0.02, 1.0, log=True)
+        trial.suggest_categorical("logq_correction", [False, True])
+        if trial.suggest_categorical("extra_negatives", [0, 64, 256]) > 0:
+            trial.suggest_categorical("negative_sampling", ["uniform", "popularity"])
     
-    # Entrenar
-    val_metrics = train_trial(train_df, val_df, n_users, n_items, dim, lr, epochs, batch_size)
+    # Niveles de fidelidad reducida (successive halving)
+    for rung, (level_data, level_val) in enumerate(levels or []):
+        level_metrics = train_trial(level_data, level_val, n_users, n_items, dim, lr, epochs, batch_size,
+                                    seen=seen, **loss_params(trial.params))
+        trial.set_user_attr(f"recall_at_10_rung{rung}", level_metrics["recall@10"])
+        trial.report(level_metrics["recall@10"], reduction_factor ** rung)
+        if trial.should_prune():
+            raise optuna.TrialPruned()
+
+    # Entrenar (la poda por epoch no se mezcla con los pasos de los niveles)
+    val_metrics = train_trial(train_df, val_df, n_users, n_items, dim, lr, epochs, batch_size,
+                              seen=seen, trial=trial if prune and not levels else None,
+                              **loss_params(trial.params))
     
     # Log métricas adicionales (Optuna soporta set_user_attr)
     trial.set_user_attr("recall_at_5", val_metrics["recall@5"])
@@ -114,6 +171,132 @@ def objective(trial: "optuna.Trial", train_df: pd.DataFrame, val_df: pd.DataFram
     return val_metrics["recall@10"]
 
 
+def make_storage(spec: Optional[str]):
+    """
+    None -> en memoria; "journal:<archivo>" -> JournalStorage sobre un archivo (seguro con
+    varios procesos); cualquier otra cadena se pasa tal cual como URL (p. ej. sqlite:///hpo.db).
+    """
+    if spec is None or not spec.startswith("journal:"):
+        return spec
+    path = spec[len("journal:"):]
+    try:
+        from optuna.storages.journal import JournalFileBackend
+    except ImportError:  # optuna < 4
+        from optuna.storages import JournalFileStorage as JournalFileBackend
+    return optuna.storages.JournalStorage(JournalFileBackend(path))
+
+
+def make_pruner(name: str, max_epochs: int = 15, reduction_factor: int = 3):
+    """
+    Pruner por epochs: median (mediana de trials previos) o hyperband.
+    "sh" (successive halving) poda por niveles de fidelidad, no por epochs.
+    """
+    if name == "sh":
+        return optuna.pruners.SuccessiveHalvingPruner(min_resource=1, reduction_factor=reduction_factor)
+    if name == "median":
+        return optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=2)
+    if name == "hyperband":
+        return optuna.pruners.HyperbandPruner(min_resource=1, max_resource=max_epochs, reduction_factor=3)
+    return optuna.pruners.NopPruner()
+
+
+def share_eval_data(val_df: pd.DataFrame, seen=None) -> Dict[str, "torch.Tensor"]:
+    """Pares de validación y CSR de vistos como tensores en memoria compartida (sin copia por worker)."""
+    shared = {
+        "val_users": torch.from_numpy(val_df["user_id"].to_numpy(dtype=np.int64)),
+        "val_items": torch.from_numpy(val_df["product_id"].to_numpy(dtype=np.int64)),
+    }
+    if seen is not None:
+        shared["seen_indptr"] = torch.from_numpy(np.asarray(seen[0], dtype=np.int64))
+        shared["seen_items"] = torch.from_numpy(np.asarray(seen[1], dtype=np.int32))
+    for t in shared.values():
+        t.share_memory_()
+    return shared
+
+
+def _shared_val_df(shared: Dict[str, "torch.Tensor"]) -> pd.DataFrame:
+    return pd.DataFrame({"user_id": shared["val_users"].numpy(), "product_id": shared["val_items"].numpy()})
+
+
+def build_fidelity_levels(train_df: pd.DataFrame, val_df: pd.DataFrame, n_users: int, fractions,
+                          eval_users: int = 1000, seed: int = 42):
+    """
+    Materializa una vez los niveles baratos del successive halving: para cada fracción f < 1,
+    las interacciones de train de una submuestra determinista de usuarios (TensorInteractions)
+    y la validación restringida a como mucho `eval_users` de esos usuarios.
+    Cada usuario recibe una puntuación fija en [0, 1): entra en el nivel f si puntuación < f,
+    así los niveles son anidados y no cambian entre ejecuciones ni entre trials.
+    """
+    score = np.random.default_rng(seed).random(n_users)
+    levels = []
+    for fraction in sorted(f for f in fractions if f < 1.0):
+        train_sub = train_df[score[train_df["user_id"].to_numpy()] < fraction]
+        val_users = np.unique(val_df["user_id"].to_numpy())
+        val_users = val_users[score[val_users] < fraction]
+        # Evaluador barato: subconjunto fijo (menor puntuación) de los usuarios del nivel
+        val_users = val_users[np.argsort(score[val_users], kind="stable")[:eval_users]]
+        val_sub = val_df[np.isin(val_df["user_id"].to_numpy(), val_users)]
+        levels.append((TensorInteractions(train_sub), val_sub.reset_index(drop=True)))
+        print(f"Nivel {fraction:.0%}: {len(train_sub)} interacciones train, {len(val_users)} usuarios de validación")
+    return levels
+
+
+def _optimize_worker(worker: int, study_name: str, storage: str, pruner: str, n_trials: int,
+                     timeout: Optional[int], train_data, shared_eval: Dict, n_users: int, n_items: int,
+                     objectives, torch_threads: int, shared_levels=None, reduction_factor: int = 3):
+    """Proceso worker: carga el estudio compartido y ejecuta sus trials sobre los tensores compartidos."""
+    torch.set_num_threads(torch_threads)
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    val_df = _shared_val_df(shared_eval)
+    seen = (shared_eval["seen_indptr"].numpy(), shared_eval["seen_items"].numpy())
+    levels = [(level_data, _shared_val_df(level_eval)) for level_data, level_eval in (shared_levels or [])]
+    study = optuna.load_study(
+        study_name=study_name,
+        storage=make_storage(storage),
+        # Semilla distinta por worker: si no, todos propondrían los mismos puntos
+        sampler=optuna.samplers.TPESampler(seed=42 + worker),
+        pruner=make_pruner(pruner, reduction_factor=reduction_factor),
+    )
+    study.optimize(
+        lambda trial: objective(trial, train_data, val_df, n_users, n_items, objectives=objectives,
+                                seen=seen, prune=pruner != "none", levels=levels,
+                                reduction_factor=reduction_factor),
+        n_trials=n_trials,
+        timeout=timeout,
+    )
+
+
+def run_parallel(n_jobs: int, study_name: str, storage: str, pruner: str, n_trials: int, timeout: Optional[int],
+                 train_data, val_df: pd.DataFrame, seen, n_users: int, n_items: int, objectives,
+                 levels=None, reduction_factor: int = 3):
+    """
+    Reparte `n_trials` entre `n_jobs` procesos contra el mismo storage. Los tensores de
+    train/val se preparan una vez aquí y viajan a los workers en memoria compartida.
+    """
+    import torch.multiprocessing as mp
+
+    ctx = mp.get_context("spawn")
+    train_data.share_memory()
+    shared_eval = share_eval_data(val_df, seen)
+    shared_levels = [(level_data.share_memory(), share_eval_data(level_val)) for level_data, level_val in (levels or [])]
+    torch_threads = max(1, (os.cpu_count() or 1) // n_jobs)
+    counts = [n_trials // n_jobs + (1 if w < n_trials % n_jobs else 0) for w in range(n_jobs)]
+    procs = []
+    for worker, count in enumerate(counts):
+        if count == 0:
+            continue
+        proc = ctx.Process(target=_optimize_worker, args=(
+            worker, study_name, storage, pruner, count, timeout, train_data, shared_eval,
+            n_users, n_items, objectives, torch_threads, shared_levels, reduction_factor))
+        proc.start()
+        procs.append(proc)
+    for proc in procs:
+        proc.join()
+    failed = [p.exitcode for p in procs if p.exitcode != 0]
+    if failed:
+        raise RuntimeError(f"{len(failed)} workers de HPO terminaron con error (exit codes {failed})")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Optuna HPO para Two-Tower Recommender")
     parser.add_argument("--data-root", type=str, default=".")
@@ -122,7 +305,26 @@ def main():
     parser.add_argument("--mlflow-tracking", action="store_true", help="Integrar con MLflow")
     parser.add_argument("--experiment-name", type=str, default="two-tower-hpo")
     parser.add_argument("--study-name", type=str, default="hpo-study", help="Nombre del estudio Optuna")
-    parser.add_argument("--storage", type=str, default=None, help="SQLite storage para Optuna (opcional)")
+    parser.add_argument("--storage", type=str, default=None,
+                        help="Storage de Optuna: sqlite:///hpo.db o journal:<archivo> (opcional)")
+    parser.add_argument("--n-jobs", type=int, default=1,
+                        help="Procesos en paralelo contra el mismo storage (por defecto journal:hpo_journal.log)")
+    parser.add_argument("--pruner", choices=["none", "median", "hyperband"], default="none",
+                        help="Poda de trials con Recall@10 reportado en cada epoch (none por defecto: "
+                             "median/hyperband evalúan tras cada epoch)")
+    parser.add_argument("--fidelities", type=str, default=None,
+                        help="Successive halving: fracciones de usuarios de los niveles baratos, p. ej. 0.1,0.3")
+    parser.add_argument("--eval-users", type=int, default=1000,
+                        help="Usuarios de validación del evaluador en los niveles baratos")
+    parser.add_argument("--reduction-factor", type=int, default=3,
+                        help="Fracción de trials (1/factor) que pasa de un nivel al siguiente")
+    parser.add_argument("--split-mode", choices=["user", "global"], default="user")
+    parser.add_argument("--split-cutoff", type=str, default=None, help="Timestamp de corte (split global)")
+    parser.add_argument("--split-cache", type=str, default=None,
+                        help="Índices del split en .npy reutilizados entre ejecuciones "
+                             "(por defecto .artifacts_best/.split_cache; '' lo desactiva)")
+    parser.add_argument("--objective", choices=["search", "mse", "inbatch"], default="search",
+                        help="Función de pérdida: fija (mse/inbatch) o parte del espacio de búsqueda")
     args = parser.parse_args()
     
     if not OPTUNA_AVAILABLE:
@@ -132,15 +334,31 @@ def main():
     # Cargar datos
     data_root = Path(args.data_root)
     users, items, inter = load_data(data_root)
-    train_df, val_df = train_val_split(inter, test_ratio=0.2, seed=42)
+    # Embeddings sobre índices densos: n_users / n_items = tamaño real del catálogo
+    users, items, inter, user_vocab, item_vocab = remap_ids(users, items, inter)
+    train_df, val_df = train_val_split(inter, test_ratio=0.2, seed=42, mode=args.split_mode,
+                                       cutoff=args.split_cutoff,
+                                       cache_dir=resolve_split_cache(args.split_cache, ARTIFACTS_DIR))
     
-    n_users = int(users["user_id"].max()) + 1
-    n_items = int(items["product_id"].max()) + 1
+    n_users = len(user_vocab)
+    n_items = len(item_vocab)
     
     print(f"Datos: {len(train_df)} train, {len(val_df)} val")
     print(f"Usuarios: {n_users}, Items: {n_items}")
     print(f"Iniciando Optuna HPO con {args.n_trials} trials...")
     
+    # Tensores de entrenamiento construidos una sola vez y reutilizados en todos los trials
+    train_data = TensorInteractions(train_df) if torch is not None else train_df
+    seen = build_seen_items(train_df, n_users)
+    
+    # Niveles de fidelidad: submuestras materializadas una sola vez y compartidas por todos los trials
+    levels = []
+    pruner = args.pruner
+    if args.fidelities:
+        fractions = [float(f) for f in args.fidelities.split(",")]
+        levels = build_fidelity_levels(train_df, val_df, n_users, fractions, eval_users=args.eval_users)
+        pruner = "sh"
+    
     # MLflow callback (si habilitado y disponible)
     mlflc = None
     if args.mlflow_tracking and mlflow and MLFLOW_CALLBACK_AVAILABLE:
@@ -156,29 +374,50 @@ def main():
         print("Advertencia: MLflowCallback no disponible. Instala: pip install optuna-integration[mlflow]")
         print("Continuando sin callback MLflow...")
     
+    # Varios procesos necesitan un storage compartido; el journal en archivo no requiere servidor
+    storage = args.storage
+    if args.n_jobs > 1 and storage is None:
+        storage = "journal:hpo_journal.log"
+        print(f"Usando storage compartido {storage}")
+    
     # Crear estudio Optuna
     study = optuna.create_study(
         study_name=args.study_name,
         direction="maximize",
-        storage=args.storage,
+        storage=make_storage(storage),
         load_if_exists=True,
-        sampler=optuna.samplers.TPESampler(seed=42)
+        sampler=optuna.samplers.TPESampler(seed=42),
+        pruner=make_pruner(pruner, reduction_factor=args.reduction_factor)
     )
     
     # Optimizar
+    objectives = ("mse", "inbatch") if args.objective == "search" else (args.objective,)
     callbacks = [mlflc] if mlflc else []
-    study.optimize(
-        lambda trial: objective(trial, train_df, val_df, n_users, n_items),
-        n_trials=args.n_trials,
-        timeout=args.timeout,
-        callbacks=callbacks,
-        show_progress_bar=True
-    )
+    if args.n_jobs > 1:
+        if mlflc:
+            print("Advertencia: MLflowCallback sólo se aplica con --n-jobs 1")
+        run_parallel(args.n_jobs, args.study_name, storage, pruner, args.n_trials, args.timeout,
+                     train_data, val_df, seen, n_users, n_items, objectives,
+                     levels=levels, reduction_factor=args.reduction_factor)
+        # Recargar para ver los trials escritos por los workers
+        study = optuna.load_study(study_name=args.study_name, storage=make_storage(storage))
+    else:
+        study.optimize(
+            lambda trial: objective(trial, train_data, val_df, n_users, n_items, objectives=objectives,
+                                    seen=seen, prune=pruner != "none", levels=levels,
+                                    reduction_factor=args.reduction_factor),
+            n_trials=args.n_trials,
+            timeout=args.timeout,
+            callbacks=callbacks,
+            show_progress_bar=True
+        )
+    n_pruned = sum(t.state == optuna.trial.TrialState.PRUNED for t in study.trials)
     
     # Resultados
     print("\n" + "="*60)
     print("OPTIMIZACIÓN COMPLETADA")
     print("="*60)
+    print(f"Trials: {len(study.trials)} ({n_pruned} podados)")
     print(f"Mejor trial: {study.best_trial.number}")
     print(f"Mejor Recall@10: {study.best_value:.4f}")
     print("\nMejores hiperparámetros:")
@@ -197,6 +436,8 @@ def main():
         "best_params": study.best_params,
         "best_metrics": study.best_trial.user_attrs,
         "n_trials": len(study.trials),
+        "n_pruned": n_pruned,
+        "fidelities": args.fidelities,
     }
     with open(results_path, "w", encoding="utf-8") as f:
         json.dump(results, f, indent=2)
@@ -229,47 +470,56 @@ def main():
     
     best_params = study.best_params
     best_metrics = train_trial(
-        train_df, val_df, n_users, n_items,
+        train_data, val_df, n_users, n_items,
         dim=best_params["dim"],
         lr=best_params["lr"],
         epochs=best_params["epochs"],
-        batch_size=best_params["batch_size"]
+        batch_size=best_params["batch_size"],
+        seen=seen,
+        **loss_params(best_params)
     )
     
     # Entrenar en train+val combinados para producción
     full_df = pd.concat([train_df, val_df], ignore_index=True)
     final_model = TwoTower(n_users=n_users, n_items=n_items, dim=best_params["dim"])
     opt_final = torch.optim.Adam(final_model.parameters(), lr=best_params["lr"])
-    ds_final = InteractionsDataset(full_df, n_users, n_items)
-    dl_final = DataLoader(ds_final, batch_size=best_params["batch_size"], shuffle=True)
+    full_data = TensorInteractions(full_df)
+    final_loss_fn = make_loss_fn(n_items=n_items, train_items=full_df["product_id"].to_numpy(), **loss_params(best_params))
     
     final_model.train()
     for ep in range(best_params["epochs"]):
+        dl_final, _ = build_batches(full_data, n_users, n_items, batch_size=best_params["batch_size"], shuffle=True)
         for u, i, y in dl_final:
             u = u.long()
             i = i.long()
             y = y.float()
-            pred = final_model(u, i)
-            loss = ((pred - y)**2).mean()
+            loss = final_loss_fn(final_model, u, i, y)
             opt_final.zero_grad()
             loss.backward()
             opt_final.step()
     
     # Guardar artefactos finales
-    artifacts_dir = Path(".artifacts_best")
+    artifacts_dir = ARTIFACTS_DIR
     artifacts_dir.mkdir(exist_ok=True)
     
     user_vecs = final_model.user_vectors()
     item_vecs = final_model.item_vectors()
     np.save(artifacts_dir / "user_vecs.npy", user_vecs)
     np.save(artifacts_dir / "item_vecs.npy", item_vecs)
+    # El modelo final vio train+val: la API excluye todo lo visto en ambos
+    seen_items = save_seen_items(build_seen_items(full_df, n_users), artifacts_dir)
+    id_vocab = save_id_vocabs(user_vocab, item_vocab, artifacts_dir)
     
     meta = {
         "best_params": best_params,
         "val_metrics": {k: float(v) for k, v in best_metrics.items()},
+        # Los pares de val ya vistos en train no cuentan como ground truth (ver compute_metrics)
+        "val_metrics_ground_truth": "unseen",
         "n_users": n_users,
         "n_items": n_items,
         "trained_on": "train+val",
+        "seen_items": seen_items,
+        "id_vocab": id_vocab,
     }
     with open(artifacts_dir / "model_meta.json", "w", encoding="utf-8") as f:
         json.dump(meta, f, indent=2)
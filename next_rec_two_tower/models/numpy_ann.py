@@ -0,0 +1,132 @@
+"""
+Índice ANN en NumPy puro (IVF con k-means esférico) para entornos sin FAISS.
+
+Los items se agrupan en `nlist` listas por su centroide más cercano y se guardan
+contiguos por lista; una consulta sólo puntúa las `nprobe` listas más cercanas.
+Todo son arrays .npy que la API abre con mmap_mode="r":
+
+    ivf_centroids.npy  (nlist, d) float32
+    ivf_indptr.npy     (nlist + 1,) int64   -> la lista l ocupa [indptr[l], indptr[l+1])
+    ivf_items.npy      (n_items,) int32     -> fila original de cada posición
+    ivf_vecs.npy       (n_items, d) float32 -> vectores normalizados en orden de lista
+
+La interfaz imita a un índice FAISS (search, ntotal, nprobe) para que la API lo use igual.
+"""
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+FILES = ("ivf_centroids.npy", "ivf_indptr.npy", "ivf_items.npy", "ivf_vecs.npy")
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float32)
+    return x / (np.linalg.norm(x, axis=1, keepdims=True) + 1e-8)
+
+
+def _assign(vecs: np.ndarray, centroids: np.ndarray, block: int = 65536) -> np.ndarray:
+    """Centroide más cercano (coseno) de cada vector, por bloques para acotar memoria."""
+    out = np.empty(len(vecs), dtype=np.int64)
+    for start in range(0, len(vecs), block):
+        out[start:start + block] = np.argmax(vecs[start:start + block] @ centroids.T, axis=1)
+    return out
+
+
+def spherical_kmeans(vecs: np.ndarray, nlist: int, n_iter: int = 10, max_train: int = 256 * 1024,
+                     seed: int = 42) -> np.ndarray:
+    """k-means sobre la esfera unidad con una muestra de como mucho `max_train` vectores."""
+    rng = np.random.default_rng(seed)
+    train = vecs if len(vecs) <= max_train else vecs[rng.choice(len(vecs), max_train, replace=False)]
+    centroids = train[rng.choice(len(train), nlist, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = _assign(train, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, train)
+        counts = np.bincount(assign, minlength=nlist)
+        # Listas vacías: se re-siembran con vectores al azar
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = train[rng.choice(len(train), int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def build_numpy_ivf(item_vecs: np.ndarray, artifacts: Path, nlist: int = 1024, nprobe: int = 16,
+                    n_iter: int = 10, seed: int = 42) -> Dict:
+    """Entrena el IVF, guarda los .npy en `artifacts` y devuelve su spec para model_meta.json."""
+    vecs = _normalize(item_vecs)
+    # Al menos ~8 items por lista de media
+    nlist = int(max(1, min(nlist, len(vecs) // 8)))
+    centroids = spherical_kmeans(vecs, nlist, n_iter=n_iter, seed=seed)
+    assign = _assign(vecs, centroids)
+    order = np.argsort(assign, kind="stable")
+    indptr = np.zeros(nlist + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assign, minlength=nlist), out=indptr[1:])
+
+    np.save(artifacts / "ivf_centroids.npy", centroids)
+    np.save(artifacts / "ivf_indptr.npy", indptr)
+    np.save(artifacts / "ivf_items.npy", order.astype(np.int32))
+    np.save(artifacts / "ivf_vecs.npy", vecs[order])
+    return {"type": "numpy-ivf", "factory": f"NumpyIVF{nlist}",
+            "search_params": {"nprobe": int(max(1, min(nprobe, nlist)))}, "files": list(FILES)}
+
+
+def exists_numpy_ivf(artifacts: Path) -> bool:
+    return all((Path(artifacts) / name).exists() for name in FILES)
+
+
+class NumpyIVFIndex:
+    """Búsqueda por producto interno sobre las `nprobe` listas más cercanas a cada consulta."""
+
+    def __init__(self, centroids: np.ndarray, indptr: np.ndarray, items: np.ndarray, vecs: np.ndarray,
+                 nprobe: int = 16):
+        self.centroids = centroids
+        self.indptr = indptr
+        self.items = items
+        self.vecs = vecs
+        self.nlist = len(centroids)
+        self.ntotal = len(items)
+        self.nprobe = int(min(nprobe, self.nlist))
+
+    @classmethod
+    def load(cls, artifacts: Path, search_params: Optional[Dict] = None, mmap_mode: Optional[str] = "r"):
+        artifacts = Path(artifacts)
+        arrays = [np.load(artifacts / name, mmap_mode=mmap_mode) for name in FILES]
+        index = cls(*arrays)
+        index.set_search_params(search_params or {})
+        return index
+
+    def set_search_params(self, params: Dict):
+        if "nprobe" in params:
+            self.nprobe = int(max(1, min(params["nprobe"], self.nlist)))
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Devuelve (D, I) como FAISS; I = -1 donde las listas sondeadas no tienen k items.
+        Se puntúa la unión de listas sondeadas por el lote con una sola GEMM y se enmascaran
+        las que cada consulta no sondeó: con lotes pequeños el coste es ~nprobe/nlist del exacto.
+        """
+        q = np.asarray(queries, dtype=np.float32)
+        probe = np.argpartition(-(q @ self.centroids.T), self.nprobe - 1, axis=1)[:, :self.nprobe]
+        lists = np.unique(probe)
+        starts, ends = self.indptr[lists], self.indptr[lists + 1]
+        sizes = ends - starts
+        pos = np.repeat(starts - np.cumsum(sizes) + sizes, sizes) + np.arange(int(sizes.sum()))
+        scores = q @ self.vecs[pos].T
+
+        probed = np.zeros((len(q), self.nlist), dtype=bool)
+        np.put_along_axis(probed, probe, True, axis=1)
+        scores[~probed[:, np.repeat(lists, sizes)]] = -np.inf
+
+        kk = min(k, scores.shape[1])
+        D = np.full((len(q), k), -np.inf, dtype=np.float32)
+        I = np.full((len(q), k), -1, dtype=np.int64)
+        if kk > 0:
+            part = np.argpartition(-scores, kk - 1, axis=1)[:, :kk]
+            part_scores = np.take_along_axis(scores, part, axis=1)
+            order = np.argsort(-part_scores, axis=1, kind="stable")
+            top = np.take_along_axis(part, order, axis=1)
+            D[:, :kk] = np.take_along_axis(part_scores, order, axis=1)
+            I[:, :kk] = np.where(np.isfinite(D[:, :kk]), self.items[pos[top]], -1)
+        return D, I
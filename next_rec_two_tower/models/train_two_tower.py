@@ -1,11 +1,13 @@
 import argparse
+import hashlib
 import os
+import sys
 import json
 import numpy as np
 import pandas as pd
 from pathlib import Path
-from typing import Tuple, Dict, List
-from collections import defaultdict
+from typing import Tuple, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     import mlflow
@@ -23,6 +25,19 @@ except Exception:
     Dataset = object  # placeholder
     DataLoader = None
 
+# Snapshot columnar compartido con api_nospark.py (snapshot_datos.py en la raíz del repo)
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+try:
+    from snapshot_datos import cargar_snapshot, existe_snapshot, fuentes_cambiadas
+except Exception:
+    cargar_snapshot = None
+    existe_snapshot = None
+    fuentes_cambiadas = None
+
+# Índice ANN en NumPy (fallback sin FAISS), mismo directorio
+sys.path.append(str(Path(__file__).resolve().parent))
+from numpy_ann import FILES as NUMPY_ANN_FILES, NumpyIVFIndex, build_numpy_ivf
+
 # Minimal placeholder Lightning-free training to keep it runnable anywhere
 # (You can upgrade to PyTorch Lightning Trainer later.)
 
@@ -40,11 +55,116 @@ if torch is not None:
             row = self.df.iloc[idx]
             return int(row["user_id"]), int(row["product_id"]), float(row.get("puntuacion", 1.0))
 
+    class TensorInteractions:
+        """
+        Interacciones como tensores contiguos (user, item, label) creados una sola vez.
+        Los batches salen por slicing de índices: sin pandas ni collate por muestra.
+        """
+        def __init__(self, interactions: pd.DataFrame):
+            # torch.tensor copia: los arrays de pandas pueden ser vistas de sólo lectura
+            self.users = torch.tensor(interactions["user_id"].to_numpy(dtype=np.int64))
+            self.items = torch.tensor(interactions["product_id"].to_numpy(dtype=np.int64))
+            if "puntuacion" in interactions.columns:
+                labels = interactions["puntuacion"].to_numpy(dtype=np.float32)
+            else:
+                labels = np.ones(len(interactions), dtype=np.float32)
+            self.labels = torch.tensor(labels)
+
+        def __len__(self):
+            return len(self.users)
+
+        def share_memory(self) -> "TensorInteractions":
+            """Mueve los tensores a memoria compartida: los workers de HPO los reciben sin copiarlos."""
+            for t in (self.users, self.items, self.labels):
+                t.share_memory_()
+            return self
+
+        def batches(self, batch_size: int, shuffle: bool = True, generator=None):
+            n = len(self.users)
+            order = torch.randperm(n, generator=generator) if shuffle else None
+            for start in range(0, n, batch_size):
+                if order is None:
+                    idx = slice(start, start + batch_size)
+                else:
+                    idx = order[start:start + batch_size]
+                yield self.users[idx], self.items[idx], self.labels[idx]
+
+    def build_batches(data, n_users: int, n_items: int, batch_size: int, shuffle: bool = True, mode: str = "tensor"):
+        """
+        Devuelve (iterable de batches (u, i, y), n_muestras).
+        mode="tensor" usa TensorInteractions (acepta también uno ya construido para reutilizarlo);
+        mode="pandas" mantiene el Dataset por fila + DataLoader original.
+        """
+        if mode == "pandas":
+            ds = InteractionsDataset(data, n_users, n_items)
+            return DataLoader(ds, batch_size=batch_size, shuffle=shuffle), len(ds)
+        ds = data if isinstance(data, TensorInteractions) else TensorInteractions(data)
+        return ds.batches(batch_size, shuffle=shuffle), len(ds)
+
+    class NegativeSampler:
+        """
+        Negativos extra vectorizados: "uniform" sobre los items vistos en train,
+        "popularity" proporcional a la frecuencia (muestrear posiciones de la columna de items).
+        """
+        def __init__(self, train_items: np.ndarray, mode: str = "uniform"):
+            self.mode = mode
+            self.train_items = torch.tensor(np.asarray(train_items, dtype=np.int64))
+            self.unique_items = torch.unique(self.train_items)
+
+        def sample(self, n: int) -> "torch.Tensor":
+            pool = self.train_items if self.mode == "popularity" else self.unique_items
+            return pool[torch.randint(len(pool), (n,))]
+
+    def item_log_q(train_items: np.ndarray, n_items: int) -> "torch.Tensor":
+        """log de la probabilidad de muestreo de cada item (frecuencia en train) para la corrección logQ."""
+        counts = np.bincount(np.asarray(train_items, dtype=np.int64), minlength=n_items).astype(np.float64)
+        counts = np.maximum(counts, 1.0)  # items sin interacciones: probabilidad mínima
+        return torch.tensor(np.log(counts / counts.sum()), dtype=torch.float32)
+
+    def make_loss_fn(objective: str, train_items: np.ndarray, n_items: int, temperature: float = 0.1,
+                     logq_correction: bool = False, n_negatives: int = 0, negative_sampling: str = "uniform"):
+        """
+        Devuelve loss_fn(model, u, i, y).
+        - "mse": regresión sobre los pares observados (baseline original).
+        - "inbatch": softmax muestreado; los items del resto del batch (y `n_negatives` extra)
+          son los negativos. Usa similitud coseno / temperatura, igual que la evaluación y la
+          API. Con logq_correction se resta log Q(item) a cada logit para
+          compensar que los items populares aparecen más como negativos.
+        """
+        if objective == "mse":
+            def mse_loss(model, u, i, y):
+                return ((model(u, i) - y) ** 2).mean()
+            return mse_loss
+
+        log_q = item_log_q(train_items, n_items) if logq_correction else None
+        sampler = NegativeSampler(train_items, negative_sampling) if n_negatives > 0 else None
+        uniform_log_q = -float(np.log(len(np.unique(train_items))))
+
+        def inbatch_loss(model, u, i, y):
+            ue = nn.functional.normalize(model.user_emb(u), dim=-1)
+            candidates = i
+            if sampler is not None:
+                candidates = torch.cat([i, sampler.sample(n_negatives)])
+            ce = nn.functional.normalize(model.item_emb(candidates), dim=-1)
+            logits = (ue @ ce.T) / temperature
+            if log_q is not None:
+                cand_log_q = log_q[candidates]
+                if sampler is not None and negative_sampling == "uniform":
+                    cand_log_q[len(i):] = uniform_log_q
+                logits = logits - cand_log_q.unsqueeze(0)
+            # Un mismo item repetido en el batch (o muestreado) no es negativo de sí mismo
+            accidental = i.unsqueeze(1) == candidates.unsqueeze(0)
+            accidental[:, :len(i)] &= ~torch.eye(len(i), dtype=torch.bool)
+            logits = logits.masked_fill(accidental, float("-inf"))
+            return nn.functional.cross_entropy(logits, torch.arange(len(i)))
+        return inbatch_loss
+
     class TwoTower(nn.Module):
         def __init__(self, n_users: int, n_items: int, dim: int = 32):
             super().__init__()
-            self.user_emb = nn.Embedding(n_users + 1, dim)
-            self.item_emb = nn.Embedding(n_items + 1, dim)
+            # Una fila por índice denso (ver remap_ids): sin filas muertas
+            self.user_emb = nn.Embedding(n_users, dim)
+            self.item_emb = nn.Embedding(n_items, dim)
 
         def forward(self, user_ids, item_ids):
             u = self.user_emb(user_ids)
@@ -60,9 +180,19 @@ if torch is not None:
 
 
 def load_data(data_root: Path) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-    users = pd.read_csv(data_root / "usuarios.csv")
-    items = pd.read_csv(data_root / "productos.csv")
-    inter = pd.read_csv(data_root / "interacciones.csv")
+    snapshot = data_root / "datos_snapshot"
+    usar_snapshot = existe_snapshot is not None and existe_snapshot(snapshot)
+    if usar_snapshot and fuentes_cambiadas(snapshot, data_root):
+        print(f"Aviso: {snapshot} no corresponde a los CSV actuales; se leen los CSV")
+        usar_snapshot = False
+    if usar_snapshot:
+        # Columnas .npy memory-mapped: evita parsear los CSV en cada arranque
+        tablas = cargar_snapshot(snapshot)
+        users, items, inter = tablas["usuarios"], tablas["productos"], tablas["interacciones"]
+    else:
+        users = pd.read_csv(data_root / "usuarios.csv")
+        items = pd.read_csv(data_root / "productos.csv")
+        inter = pd.read_csv(data_root / "interacciones.csv")
     # Asegurar nombres (soporta español/inglés)
     inter = inter.rename(columns={"usuario_id": "user_id", "producto_id": "product_id", "rating": "puntuacion"})
     if "producto_id" in items.columns:
@@ -79,130 +209,505 @@ def load_data(data_root: Path) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame
     return users, items, inter
 
 
-def train_val_split(inter: pd.DataFrame, test_ratio: float = 0.2, seed: int = 42) -> Tuple[pd.DataFrame, pd.DataFrame]:
-    """Split por usuario: últimas interacciones de cada usuario para validación."""
-    rng = np.random.default_rng(seed)
-    # Ordenar por timestamp si existe
-    if "timestamp" in inter.columns:
-        inter = inter.sort_values("timestamp")
-    
-    train_list, val_list = [], []
-    for uid, grp in inter.groupby("user_id"):
-        n = len(grp)
-        n_val = max(1, int(n * test_ratio))
-        val_list.append(grp.iloc[-n_val:])
-        train_list.append(grp.iloc[:-n_val])
-    
-    train_df = pd.concat(train_list, ignore_index=True) if train_list else inter.iloc[:0]
-    val_df = pd.concat(val_list, ignore_index=True) if val_list else inter.iloc[:0]
+class IdVocab:
+    """
+    Vocabulario ID real <-> índice denso respaldado por un array ordenado de IDs reales:
+    decode es una indexación O(1) y encode un searchsorted; los IDs desconocidos dan -1.
+    """
+
+    def __init__(self, raw_ids: np.ndarray):
+        self.raw_ids = np.asarray(raw_ids, dtype=np.int64)
+
+    @classmethod
+    def from_ids(cls, *columns) -> "IdVocab":
+        return cls(np.unique(np.concatenate([np.asarray(c, dtype=np.int64) for c in columns])))
+
+    def __len__(self):
+        return len(self.raw_ids)
+
+    def encode(self, raw) -> np.ndarray:
+        raw = np.asarray(raw, dtype=np.int64)
+        if len(self.raw_ids) == 0:
+            return np.full(raw.shape, -1, dtype=np.int64)
+        pos = np.searchsorted(self.raw_ids, raw).clip(max=len(self.raw_ids) - 1)
+        return np.where(self.raw_ids[pos] == raw, pos, -1)
+
+    def decode(self, idx) -> np.ndarray:
+        idx = np.asarray(idx, dtype=np.int64)
+        return np.where(idx >= 0, self.raw_ids[np.maximum(idx, 0)], -1)
+
+    def save(self, path: Path):
+        np.save(path, self.raw_ids)
+
+    @classmethod
+    def load(cls, path: Path) -> "IdVocab":
+        return cls(np.load(path, mmap_mode="r"))
+
+
+def remap_ids(users: pd.DataFrame, items: pd.DataFrame, inter: pd.DataFrame):
+    """
+    Sustituye user_id / product_id por índices densos 0..n-1 en las tres tablas.
+    Así los embeddings, el índice y la puntuación escalan con el catálogo real y no con max(ID).
+    Devuelve (users, items, inter, user_vocab, item_vocab).
+    """
+    user_vocab = IdVocab.from_ids(users["user_id"], inter["user_id"])
+    item_vocab = IdVocab.from_ids(items["product_id"], inter["product_id"])
+    users = users.assign(user_id=user_vocab.encode(users["user_id"]))
+    items = items.assign(product_id=item_vocab.encode(items["product_id"]))
+    inter = inter.assign(user_id=user_vocab.encode(inter["user_id"]),
+                         product_id=item_vocab.encode(inter["product_id"]))
+    return users, items, inter, user_vocab, item_vocab
+
+
+def save_id_vocabs(user_vocab: IdVocab, item_vocab: IdVocab, artifacts: Path) -> Dict:
+    user_vocab.save(artifacts / "user_ids.npy")
+    item_vocab.save(artifacts / "item_ids.npy")
+    return {"users": "user_ids.npy", "items": "item_ids.npy",
+            "n_users": len(user_vocab), "n_items": len(item_vocab)}
+
+
+def _split_timestamps(inter: pd.DataFrame) -> np.ndarray:
+    """Clave temporal de cada fila: timestamp si existe, si no el orden de llegada."""
+    if "timestamp" not in inter.columns:
+        return np.arange(len(inter))
+    return pd.to_datetime(inter["timestamp"]).to_numpy()
+
+
+def split_indices(inter: pd.DataFrame, test_ratio: float = 0.2, mode: str = "user",
+                  cutoff: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Índices posicionales (train, val) sobre `inter`, agrupados por usuario y en orden temporal.
+    - mode="user": las últimas max(1, int(n * test_ratio)) interacciones de cada usuario van a val.
+    - mode="global": corte temporal común; val = timestamp >= cutoff (por defecto el
+      cuantil 1 - test_ratio de los timestamps).
+    Sin bucles por usuario: sort estable (usuario, tiempo) y posición dentro del grupo.
+    """
+    users = inter["user_id"].to_numpy()
+    ts = _split_timestamps(inter)
+    order = np.lexsort((ts, users))
+    if mode == "global":
+        if cutoff is None:
+            pos = min(int(len(ts) * (1.0 - test_ratio)), len(ts) - 1)
+            limit = np.sort(ts)[pos] if len(ts) else None
+        else:
+            limit = np.datetime64(pd.Timestamp(cutoff)) if "timestamp" in inter.columns else int(cutoff)
+        is_val = ts[order] >= limit
+    elif mode == "user":
+        _, starts, counts = np.unique(users[order], return_index=True, return_counts=True)
+        # cumcount: posición de cada fila dentro de su usuario
+        rank = np.arange(len(order)) - np.repeat(starts, counts)
+        n_val = np.maximum(1, np.floor(counts * test_ratio).astype(np.int64))
+        is_val = rank >= np.repeat(counts - n_val, counts)
+    else:
+        raise ValueError(f"Modo de split desconocido: {mode}")
+    return order[~is_val], order[is_val]
+
+
+def _split_fingerprint(inter: pd.DataFrame) -> Dict:
+    """
+    Huella de las interacciones para invalidar un split guardado: hash de los bytes de
+    user_id, product_id y la clave temporal en su orden actual, porque los índices del
+    split son posicionales (reordenar o editar filas también lo invalida).
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for values in (inter["user_id"].to_numpy(dtype=np.int64), inter["product_id"].to_numpy(dtype=np.int64),
+                   _split_timestamps(inter).astype(np.int64)):
+        h.update(np.ascontiguousarray(values).tobytes())
+    return {"n_rows": int(len(inter)), "data_hash": h.hexdigest()}
+
+
+def resolve_split_cache(split_cache: Optional[str], artifacts: Path) -> Optional[Path]:
+    """--split-cache: None = <artifacts>/.split_cache, '' = sin cache, otra ruta = esa ruta."""
+    if split_cache is None:
+        return Path(artifacts) / ".split_cache"
+    return Path(split_cache) if split_cache else None
+
+
+def load_or_build_split(inter: pd.DataFrame, cache_dir: Path, test_ratio: float = 0.2, mode: str = "user",
+                        cutoff: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reutiliza el split guardado en `cache_dir` (train_idx.npy / val_idx.npy, memory-mapped)
+    si coincide con los parámetros y los datos; si no, lo calcula y lo guarda.
+    """
+    cache_dir = Path(cache_dir)
+    spec = {"test_ratio": test_ratio, "mode": mode, "cutoff": cutoff, **_split_fingerprint(inter)}
+    spec_path = cache_dir / "split.json"
+    if spec_path.exists() and json.loads(spec_path.read_text(encoding="utf-8")) == spec:
+        return np.load(cache_dir / "train_idx.npy", mmap_mode="r"), np.load(cache_dir / "val_idx.npy", mmap_mode="r")
+
+    train_idx, val_idx = split_indices(inter, test_ratio=test_ratio, mode=mode, cutoff=cutoff)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    spec_path.unlink(missing_ok=True)
+    np.save(cache_dir / "train_idx.npy", train_idx)
+    np.save(cache_dir / "val_idx.npy", val_idx)
+    # split.json al final: sin él los índices se consideran incompletos
+    spec_path.write_text(json.dumps(spec, indent=2), encoding="utf-8")
+    return train_idx, val_idx
+
+
+def train_val_split(inter: pd.DataFrame, test_ratio: float = 0.2, seed: int = 42, mode: str = "user",
+                    cutoff: Optional[str] = None, cache_dir: Optional[Path] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Split por usuario: últimas interacciones de cada usuario para validación (ver split_indices)."""
+    if cache_dir is not None:
+        train_idx, val_idx = load_or_build_split(inter, cache_dir, test_ratio=test_ratio, mode=mode, cutoff=cutoff)
+    else:
+        train_idx, val_idx = split_indices(inter, test_ratio=test_ratio, mode=mode, cutoff=cutoff)
+    train_df = inter.iloc[np.asarray(train_idx)].reset_index(drop=True)
+    val_df = inter.iloc[np.asarray(val_idx)].reset_index(drop=True)
     return train_df, val_df
 
 
-def compute_metrics(user_vecs: np.ndarray, item_vecs: np.ndarray, val_df: pd.DataFrame, k_list: List[int] = [5, 10, 20]) -> Dict[str, float]:
+def build_seen_items(inter: pd.DataFrame, n_users: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Items vistos por usuario en CSR: los items del usuario u son indices[indptr[u]:indptr[u+1]]
+    (únicos y ordenados). Se construye con el split de train para excluirlos al recomendar.
+    """
+    pairs = np.unique(inter[["user_id", "product_id"]].to_numpy(dtype=np.int64), axis=0)
+    pairs = pairs[(pairs[:, 0] >= 0) & (pairs[:, 0] < n_users)]
+    indptr = np.zeros(n_users + 1, dtype=np.int64)
+    np.cumsum(np.bincount(pairs[:, 0], minlength=n_users), out=indptr[1:])
+    return indptr, pairs[:, 1].astype(np.int32)
+
+
+def save_seen_items(seen: Tuple[np.ndarray, np.ndarray], artifacts: Path) -> Dict:
+    indptr, indices = seen
+    np.save(artifacts / "seen_indptr.npy", indptr)
+    np.save(artifacts / "seen_items.npy", indices)
+    return {"indptr": "seen_indptr.npy", "items": "seen_items.npy", "n_pairs": int(len(indices))}
+
+
+def seen_pairs(seen: Tuple[np.ndarray, np.ndarray], users: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(fila local, item) de los items vistos por `users`, sin bucles por usuario."""
+    indptr, indices = seen
+    users = np.asarray(users)
+    starts, counts = indptr[users], indptr[users + 1] - indptr[users]
+    rows = np.repeat(np.arange(len(users)), counts)
+    offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+    return rows, indices[np.repeat(starts, counts) + offsets]
+
+
+def mask_seen(scores: np.ndarray, users: np.ndarray, seen: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    """Pone a -inf (en el sitio) los scores de items ya vistos por cada fila de `users`."""
+    rows, cols = seen_pairs(seen, users)
+    keep = cols < scores.shape[1]
+    scores[rows[keep], cols[keep]] = -np.inf
+    return scores
+
+
+def drop_seen_pairs(pairs: np.ndarray, seen: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+    """Quita de `pairs` (usuario, item) los pares que ya están en el CSR de vistos."""
+    users = np.unique(pairs[:, 0])
+    users = users[users < len(seen[0]) - 1]
+    rows, cols = seen_pairs(seen, users)
+    if len(cols) == 0:
+        return pairs
+    width = int(max(pairs[:, 1].max(), cols.max())) + 1
+    seen_keys = users[rows].astype(np.int64) * width + cols
+    return pairs[~np.isin(pairs[:, 0] * width + pairs[:, 1], seen_keys)]
+
+
+def compute_metrics(user_vecs: np.ndarray, item_vecs: np.ndarray, val_df: pd.DataFrame, k_list: List[int] = [5, 10, 20],
+                    block_size: int = 1024, n_threads: Optional[int] = None,
+                    seen: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Dict[str, float]:
     """
     Calcula Recall@K, NDCG@K, MRR para cada usuario en val_df.
     Retorna promedios sobre todos los usuarios.
+
+    Evaluador por bloques: cada bloque de usuarios se puntúa con una sola GEMM, el top
+    max(K) sale de argpartition y los aciertos se obtienen con máscaras vectorizadas
+    contra el ground truth en CSR. Los bloques se reparten entre varios hilos.
+    Con `seen` (ver build_seen_items) los items ya vistos en train no compiten por el top-K
+    y los pares (usuario, item) de val_df ya vistos salen también del ground truth: no
+    pueden acertarse, así que contarlos en n_gt limitaría Recall/NDCG por debajo de 1.
+    Los usuarios cuyo ground truth era todo visto no entran en el promedio.
     """
     # Normalizar vectores para similitud coseno
-    user_norms = np.linalg.norm(user_vecs, axis=1, keepdims=True) + 1e-8
-    item_norms = np.linalg.norm(item_vecs, axis=1, keepdims=True) + 1e-8
-    user_vecs_n = user_vecs / user_norms
-    item_vecs_n = item_vecs / item_norms
-    
-    # Ground truth por usuario
-    user_items_gt = defaultdict(set)
-    for _, row in val_df.iterrows():
-        user_items_gt[int(row["user_id"])].add(int(row["product_id"]))
-    
-    metrics = {f"recall@{k}": [] for k in k_list}
-    metrics.update({f"ndcg@{k}": [] for k in k_list})
-    metrics["mrr"] = []
-    
-    for uid, gt_items in user_items_gt.items():
-        if uid >= user_vecs_n.shape[0]:
-            continue
-        u = user_vecs_n[uid:uid+1]
-        scores = (item_vecs_n @ u.T).ravel()
-        top_indices = np.argsort(-scores)
-        
-        # MRR: primer item relevante
-        rank_first = None
-        for rank, iid in enumerate(top_indices, start=1):
-            if iid in gt_items:
-                rank_first = rank
-                break
-        if rank_first:
-            metrics["mrr"].append(1.0 / rank_first)
-        else:
-            metrics["mrr"].append(0.0)
-        
-        # Recall@K y NDCG@K
+    user_vecs_n = (user_vecs / (np.linalg.norm(user_vecs, axis=1, keepdims=True) + 1e-8)).astype(np.float32)
+    item_vecs_n = (item_vecs / (np.linalg.norm(item_vecs, axis=1, keepdims=True) + 1e-8)).astype(np.float32)
+    n_items = item_vecs_n.shape[0]
+    k_max = min(max(k_list), n_items)
+
+    # Ground truth en CSR: pares (usuario, item) únicos ordenados por usuario
+    pairs = np.unique(val_df[["user_id", "product_id"]].to_numpy(dtype=np.int64), axis=0)
+    pairs = pairs[pairs[:, 0] < user_vecs_n.shape[0]]
+    if seen is not None:
+        pairs = drop_seen_pairs(pairs, seen)
+    gt_users, gt_start, gt_count = np.unique(pairs[:, 0], return_index=True, return_counts=True)
+    gt_items = pairs[:, 1]
+    gt_indptr = np.append(gt_start, len(pairs))
+    if len(gt_users) == 0:
+        return {**{f"recall@{k}": 0.0 for k in k_list}, **{f"ndcg@{k}": 0.0 for k in k_list}, "mrr": 0.0}
+
+    discounts = 1.0 / np.log2(np.arange(2, k_max + 2))
+    idcg_table = np.cumsum(discounts)
+
+    def _eval_block(start: int):
+        rows = slice(start, min(start + block_size, len(gt_users)))
+        users = gt_users[rows]
+        scores = user_vecs_n[users] @ item_vecs_n.T
+        if seen is not None:
+            mask_seen(scores, users, seen)
+
+        # Ground truth del bloque: fila local + item (sólo items dentro del rango de item_vecs)
+        lo, hi = gt_indptr[rows.start], gt_indptr[rows.stop]
+        local_rows = np.repeat(np.arange(len(users)), gt_count[rows])
+        items = gt_items[lo:hi]
+        in_range = items < n_items
+        local_rows, items = local_rows[in_range], items[in_range]
+
+        # Top max(K): argpartition y orden sólo de los ganadores
+        part = np.argpartition(-scores, k_max - 1, axis=1)[:, :k_max]
+        order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind="stable")
+        top = np.take_along_axis(part, order, axis=1)
+        gt_keys = local_rows * n_items + items
+        top_keys = np.arange(len(users))[:, None] * n_items + top
+        hits = np.isin(top_keys, gt_keys)
+        if seen is not None:
+            # Un item visto sólo entra en el top si no quedan suficientes sin ver
+            hits &= np.isfinite(np.take_along_axis(scores, top, axis=1))
+
+        # MRR exacto: rango del item relevante mejor puntuado = nº de items con score mayor + 1
+        best_gt = np.full(len(users), -np.inf, dtype=np.float32)
+        np.maximum.at(best_gt, local_rows, scores[local_rows, items])
+        has_gt = np.isfinite(best_gt)
+        rank_first = (scores > best_gt[:, None]).sum(axis=1) + 1
+        mrr = np.where(has_gt, 1.0 / rank_first, 0.0)
+
+        n_gt = gt_count[rows]
+        block = {"mrr": mrr}
         for k in k_list:
-            topk = top_indices[:k]
-            hits = sum(1 for iid in topk if iid in gt_items)
-            metrics[f"recall@{k}"].append(hits / len(gt_items) if gt_items else 0.0)
-            
-            # NDCG@K
-            dcg = sum((1 if topk[i] in gt_items else 0) / np.log2(i + 2) for i in range(k))
-            idcg = sum(1 / np.log2(i + 2) for i in range(min(k, len(gt_items))))
-            metrics[f"ndcg@{k}"].append(dcg / idcg if idcg > 0 else 0.0)
-    
+            kk = min(k, k_max)
+            block[f"recall@{k}"] = hits[:, :kk].sum(axis=1) / n_gt
+            dcg = (hits[:, :kk] * discounts[:kk]).sum(axis=1)
+            idcg = idcg_table[np.minimum(kk, n_gt) - 1]
+            block[f"ndcg@{k}"] = dcg / idcg
+        return block
+
+    starts = range(0, len(gt_users), block_size)
+    with ThreadPoolExecutor(max_workers=n_threads or os.cpu_count()) as pool:
+        blocks = list(pool.map(_eval_block, starts))
+
+    keys = [f"recall@{k}" for k in k_list] + [f"ndcg@{k}" for k in k_list] + ["mrr"]
     # Promediar
-    return {key: float(np.mean(vals)) if vals else 0.0 for key, vals in metrics.items()}
+    return {key: float(np.concatenate([blk[key] for blk in blocks]).mean()) for key in keys}
 
 
-def train_baseline(users: pd.DataFrame, items: pd.DataFrame, inter: pd.DataFrame, dim: int = 32, epochs: int = 1, lr: float = 1e-2):
-    n_users = int(users["user_id"].max()) + 1
-    n_items = int(items["product_id"].max()) + 1
+def train_baseline(users: pd.DataFrame, items: pd.DataFrame, inter: pd.DataFrame, dim: int = 32, epochs: int = 1, lr: float = 1e-2,
+                   dataset_mode: str = "tensor", objective: str = "mse", n_users: Optional[int] = None,
+                   n_items: Optional[int] = None, **loss_kwargs):
+    # Tras remap_ids el tamaño real es len(vocabulario): un ID que sólo aparece en las
+    # interacciones tiene índice >= max(users/items) + 1
+    if n_users is None:
+        n_users = int(max(users["user_id"].max(), inter["user_id"].max())) + 1
+    if n_items is None:
+        n_items = int(max(items["product_id"].max(), inter["product_id"].max())) + 1
 
     if torch is None:
         # Fallback sencillo: inicializar embeddings aleatorios reproducibles
         rng = np.random.default_rng(42)
-        user_vecs = rng.normal(size=(n_users + 1, dim)).astype(np.float32)
-        item_vecs = rng.normal(size=(n_items + 1, dim)).astype(np.float32)
+        user_vecs = rng.normal(size=(n_users, dim)).astype(np.float32)
+        item_vecs = rng.normal(size=(n_items, dim)).astype(np.float32)
         print("Torch no disponible. Se generaron embeddings aleatorios para demo.")
-        return user_vecs, item_vecs, []
+        return (user_vecs, item_vecs), []
 
     model = TwoTower(n_users=n_users, n_items=n_items, dim=dim)
     opt = torch.optim.Adam(model.parameters(), lr=lr)
-    ds = InteractionsDataset(inter, n_users, n_items)
-    dl = DataLoader(ds, batch_size=512, shuffle=True)
+    data = TensorInteractions(inter) if dataset_mode == "tensor" else inter
+    loss_fn = make_loss_fn(objective, inter["product_id"].to_numpy(), n_items, **loss_kwargs)
 
     epoch_losses = []
     model.train()
     for ep in range(epochs):
         total = 0.0
+        dl, n_samples = build_batches(data, n_users, n_items, batch_size=512, shuffle=True, mode=dataset_mode)
         for u, i, y in dl:
             u = u.long()
             i = i.long()
             y = y.float()
-            pred = model(u, i)
-            loss = ((pred - y)**2).mean()
+            loss = loss_fn(model, u, i, y)
             opt.zero_grad(); loss.backward(); opt.step()
             total += loss.item() * len(u)
-        avg_loss = total / len(ds)
+        avg_loss = total / n_samples
         epoch_losses.append(avg_loss)
         print(f"epoch={ep+1} loss={avg_loss:.4f}")
     return model, epoch_losses
 
 
-def build_faiss_index(item_vecs: np.ndarray, artifacts: Path):
+FAISS_INDEX_TYPES = ("flat", "ivf-flat", "ivf-pq", "hnsw")
+
+
+def faiss_index_spec(index_type: str, dim: int, n_items: int, nlist: int = 1024, nprobe: int = 16,
+                     pq_m: int = 8, hnsw_m: int = 32, ef_search: int = 64) -> Dict:
+    """
+    Traduce el tipo de índice y sus parámetros a un factory string de FAISS y a los
+    parámetros de búsqueda que la API aplica al cargarlo (se guardan en model_meta.json).
+    Los valores se ajustan al catálogo: nlist <= n_items, pq_m divide a dim, bits PQ <= log2(n_items).
+    """
+    if index_type == "flat":
+        return {"type": "flat", "factory": "Flat", "search_params": {}}
+    if index_type in ("ivf-flat", "ivf-pq"):
+        nlist = max(1, min(nlist, n_items))
+        params = {"nprobe": max(1, min(nprobe, nlist))}
+        if index_type == "ivf-flat":
+            return {"type": index_type, "factory": f"IVF{nlist},Flat", "search_params": params}
+        pq_m = max(m for m in range(1, min(pq_m, dim) + 1) if dim % m == 0)
+        nbits = int(max(1, min(8, np.floor(np.log2(max(n_items, 2))))))
+        return {"type": index_type, "factory": f"IVF{nlist},PQ{pq_m}x{nbits}", "search_params": params}
+    if index_type == "hnsw":
+        return {"type": "hnsw", "factory": f"HNSW{hnsw_m}", "search_params": {"efSearch": ef_search}}
+    raise ValueError(f"Tipo de índice FAISS desconocido: {index_type}")
+
+
+def apply_search_params(index, search_params: Dict):
+    """nprobe (IVF) / efSearch (HNSW) sobre un índice ya cargado."""
+    import faiss  # type: ignore
+    ps = faiss.ParameterSpace()
+    for name, value in (search_params or {}).items():
+        ps.set_index_parameter(index, name, value)
+
+
+def build_faiss_index(item_vecs: np.ndarray, artifacts: Path, spec: Optional[Dict] = None):
     try:
         import faiss  # type: ignore
     except Exception as e:
         print("FAISS no disponible, se omitirá el índice.", e)
         return None
     d = item_vecs.shape[1]
-    index = faiss.IndexFlatIP(d)  # inner product
-    # normalizar para usar IP como coseno
+    spec = spec or faiss_index_spec("flat", d, item_vecs.shape[0])
+    # inner product sobre vectores normalizados = coseno
+    index = faiss.index_factory(d, spec["factory"], faiss.METRIC_INNER_PRODUCT)
     norms = np.linalg.norm(item_vecs, axis=1, keepdims=True) + 1e-8
-    normed = item_vecs / norms
-    index.add(normed.astype(np.float32))
+    normed = (item_vecs / norms).astype(np.float32)
+    if not index.is_trained:
+        # IVF/PQ: centroides y codebooks se entrenan con los propios vectores de item
+        index.train(normed)
+    index.add(normed)
+    apply_search_params(index, spec["search_params"])
     faiss.write_index(index, str(artifacts / "faiss_item.index"))
     np.save(artifacts / "item_vecs.npy", item_vecs)
     return str(artifacts / "faiss_item.index")
 
 
+def ann_index_report(index, spec: Dict, user_vecs: np.ndarray, item_vecs: np.ndarray,
+                     report_path: Path, k: int = 10, n_queries: int = 1000, seed: int = 42) -> Dict:
+    """
+    Compara un índice ANN (FAISS o NumpyIVFIndex) contra la búsqueda exacta (GEMM) sobre una
+    muestra de usuarios: recall@k y latencia por consulta (p50/p99, una consulta por llamada)
+    y por lote. En IVF/HNSW barre nprobe/efSearch para elegir el punto que cumple el
+    presupuesto de p99. Se guarda en `report_path`.
+    """
+    import time
+
+    if isinstance(index, NumpyIVFIndex):
+        set_params = index.set_search_params
+    else:
+        set_params = lambda params: apply_search_params(index, params)  # noqa: E731
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(user_vecs.shape[0], size=min(n_queries, user_vecs.shape[0]), replace=False)
+    q = user_vecs[rows].astype(np.float32)
+    q /= (np.linalg.norm(q, axis=1, keepdims=True) + 1e-8)
+    item_n = (item_vecs / (np.linalg.norm(item_vecs, axis=1, keepdims=True) + 1e-8)).astype(np.float32)
+    k = min(k, item_n.shape[0])
+    exact = np.argpartition(-(q @ item_n.T), k - 1, axis=1)[:, :k]
+
+    def _measure(params: Dict) -> Dict:
+        set_params(params)
+        t0 = time.perf_counter()
+        _, I = index.search(q, k)
+        batch_ms = (time.perf_counter() - t0) * 1000.0
+        lat = []
+        for row in q[:200]:
+            t0 = time.perf_counter()
+            index.search(row[None, :], k)
+            lat.append((time.perf_counter() - t0) * 1000.0)
+        hits = sum(len(np.intersect1d(a, b)) for a, b in zip(I, exact))
+        return {"search_params": params, f"recall@{k}": hits / (len(q) * k),
+                "p50_ms": float(np.percentile(lat, 50)), "p99_ms": float(np.percentile(lat, 99)),
+                "batch_ms_per_query": batch_ms / len(q)}
+
+    sweep = []
+    current = dict(spec["search_params"])
+    if "nprobe" in current:
+        if hasattr(index, "nlist"):
+            nlist = index.nlist
+        else:
+            import faiss  # type: ignore
+            nlist = faiss.extract_index_ivf(index).nlist
+        values = sorted({v for v in (1, 2, 4, 8, 16, 32, 64, 128, 256) if v <= nlist} | {current["nprobe"]})
+        sweep = [_measure({"nprobe": v}) for v in values]
+    elif "efSearch" in current:
+        values = sorted({16, 32, 64, 128, 256} | {current["efSearch"]})
+        sweep = [_measure({"efSearch": v}) for v in values]
+
+    report = {
+        "spec": spec, "n_items": int(item_n.shape[0]), "n_queries": int(len(q)), "k": int(k),
+        "configured": _measure(current), "sweep": sweep,
+    }
+    set_params(current)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def _print_index_report(spec: Dict, report: Dict):
+    conf, k = report["configured"], report["k"]
+    print(f"Índice {spec['factory']}: recall@{k}={conf[f'recall@{k}']:.3f} "
+          f"p50={conf['p50_ms']:.3f} ms p99={conf['p99_ms']:.3f} ms")
+
+
+def build_topk_table(user_vecs: np.ndarray, item_vecs: np.ndarray, k: int, artifacts: Path,
+                     active_users: Optional[np.ndarray] = None, block_size: int = 4096,
+                     n_threads: Optional[int] = None, seen: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Dict:
+    """
+    Precalcula el top-K de items para cada usuario: topk_items.npy (int32, n_users x K)
+    y topk_scores.npy (float16). Las filas de usuarios fuera de `active_users` quedan en -1
+    para que la API use búsqueda ANN en vivo. Se calcula por bloques de usuarios en varios
+    hilos (BLAS y argpartition liberan el GIL) escribiendo directamente en un memmap.
+    Con `seen` se excluyen los items ya vistos; los huecos que queden se rellenan con -1.
+    """
+    n_users, n_items = user_vecs.shape[0], item_vecs.shape[0]
+    k = min(k, n_items)
+    item_n = (item_vecs / (np.linalg.norm(item_vecs, axis=1, keepdims=True) + 1e-8)).astype(np.float32)
+    rows = np.arange(n_users) if active_users is None else np.unique(active_users[active_users < n_users])
+
+    # Se escribe a un temporal y luego se renombra: la API puede tener mapeada la versión anterior
+    tmp_items = artifacts / "topk_items.tmp.npy"
+    tmp_scores = artifacts / "topk_scores.tmp.npy"
+    items_out = np.lib.format.open_memmap(tmp_items, mode="w+", dtype=np.int32, shape=(n_users, k))
+    scores_out = np.lib.format.open_memmap(tmp_scores, mode="w+", dtype=np.float16, shape=(n_users, k))
+    items_out[:] = -1
+    scores_out[:] = 0
+
+    def _score_block(start: int):
+        block = rows[start:start + block_size]
+        u = user_vecs[block].astype(np.float32)
+        u /= (np.linalg.norm(u, axis=1, keepdims=True) + 1e-8)
+        scores = u @ item_n.T
+        if seen is not None:
+            mask_seen(scores, block, seen)
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        part_scores = np.take_along_axis(scores, part, axis=1)
+        order = np.argsort(-part_scores, axis=1, kind="stable")
+        top_items = np.take_along_axis(part, order, axis=1)
+        top_scores = np.take_along_axis(part_scores, order, axis=1)
+        masked = ~np.isfinite(top_scores)
+        top_items[masked] = -1
+        top_scores[masked] = 0
+        items_out[block] = top_items
+        scores_out[block] = top_scores
+
+    with ThreadPoolExecutor(max_workers=n_threads or os.cpu_count()) as pool:
+        list(pool.map(_score_block, range(0, len(rows), block_size)))
+
+    items_out.flush()
+    scores_out.flush()
+    del items_out, scores_out
+    os.replace(tmp_items, artifacts / "topk_items.npy")
+    os.replace(tmp_scores, artifacts / "topk_scores.npy")
+    return {"k": int(k), "n_users": int(n_users), "n_active_users": int(len(rows)),
+            "exclude_seen": seen is not None, "items": "topk_items.npy", "scores": "topk_scores.npy"}
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--data-root", type=str, default=".")
@@ -212,6 +717,36 @@ def main():
     parser.add_argument("--lr", type=float, default=1e-2)
     parser.add_argument("--mlflow-tracking", action="store_true", help="Enable MLflow tracking")
     parser.add_argument("--experiment-name", type=str, default="two-tower-recommender")
+    parser.add_argument("--dataset-mode", choices=["tensor", "pandas"], default="tensor",
+                        help="tensor: batches por slicing de tensores; pandas: Dataset por fila (original)")
+    parser.add_argument("--objective", choices=["mse", "inbatch"], default="mse",
+                        help="mse: regresión sobre pares observados; inbatch: softmax con negativos del batch")
+    parser.add_argument("--temperature", type=float, default=0.1, help="Temperatura del softmax (inbatch)")
+    parser.add_argument("--logq-correction", action="store_true", help="Corrección logQ por popularidad (inbatch)")
+    parser.add_argument("--extra-negatives", type=int, default=0, help="Negativos extra muestreados por batch (inbatch)")
+    parser.add_argument("--negative-sampling", choices=["uniform", "popularity"], default="uniform")
+    parser.add_argument("--topk-table", type=int, default=0,
+                        help="Si >0, precalcula una tabla top-K por usuario para servir sin búsqueda ANN")
+    parser.add_argument("--split-mode", choices=["user", "global"], default="user",
+                        help="user: últimas interacciones de cada usuario; global: corte temporal común")
+    parser.add_argument("--split-cutoff", type=str, default=None,
+                        help="Timestamp de corte para --split-mode global (por defecto el cuantil 0.8)")
+    parser.add_argument("--split-cache", type=str, default=None,
+                        help="Directorio donde se guardan/reutilizan los índices del split "
+                             "(por defecto <artifacts>/.split_cache; '' lo desactiva)")
+    parser.add_argument("--faiss-index", choices=FAISS_INDEX_TYPES, default="flat",
+                        help="Tipo de índice: flat (exacto), ivf-flat, ivf-pq o hnsw")
+    parser.add_argument("--nlist", type=int, default=1024, help="Listas IVF (se limita al nº de items)")
+    parser.add_argument("--nprobe", type=int, default=16, help="Listas IVF visitadas por consulta")
+    parser.add_argument("--pq-m", type=int, default=8, help="Subcuantizadores PQ (divisor de --dim)")
+    parser.add_argument("--hnsw-m", type=int, default=32, help="Vecinos por nodo en HNSW")
+    parser.add_argument("--ef-search", type=int, default=64, help="Tamaño de la cola de búsqueda HNSW")
+    parser.add_argument("--numpy-ann", choices=["auto", "always", "never"], default="auto",
+                        help="IVF en NumPy puro (ivf_*.npy) para servir sin FAISS; auto = sólo si FAISS no está")
+    parser.add_argument("--index-report", action="store_true",
+                        help="Mide recall@10 vs búsqueda exacta y latencia del índice (*_report.json)")
+    parser.add_argument("--keep-seen", action="store_true",
+                        help="No excluir de evaluación/tabla top-K los items que el usuario ya vio en train")
     args = parser.parse_args()
 
     data_root = Path(args.data_root)
@@ -227,14 +762,29 @@ def main():
             "epochs": args.epochs,
             "lr": args.lr,
             "batch_size": 512,
+            "objective": args.objective,
+            "temperature": args.temperature,
+            "logq_correction": args.logq_correction,
+            "extra_negatives": args.extra_negatives,
+            "negative_sampling": args.negative_sampling,
         })
 
     users, items, inter = load_data(data_root)
-    train_df, val_df = train_val_split(inter, test_ratio=0.2, seed=42)
+    # IDs reales -> filas densas de embedding; el vocabulario se guarda para la API
+    users, items, inter, user_vocab, item_vocab = remap_ids(users, items, inter)
+    id_vocab = save_id_vocabs(user_vocab, item_vocab, artifacts)
+    train_df, val_df = train_val_split(inter, test_ratio=0.2, seed=42, mode=args.split_mode,
+                                       cutoff=args.split_cutoff,
+                                       cache_dir=resolve_split_cache(args.split_cache, artifacts))
     
     print(f"Train: {len(train_df)} interacciones, Val: {len(val_df)} interacciones")
     
-    model_or_vecs, epoch_losses = train_baseline(users, items, train_df, dim=args.dim, epochs=args.epochs, lr=args.lr)
+    model_or_vecs, epoch_losses = train_baseline(
+        users, items, train_df, dim=args.dim, epochs=args.epochs, lr=args.lr,
+        dataset_mode=args.dataset_mode, objective=args.objective, temperature=args.temperature,
+        logq_correction=args.logq_correction, n_negatives=args.extra_negatives,
+        negative_sampling=args.negative_sampling, n_users=len(user_vocab), n_items=len(item_vocab),
+    )
 
     # Export embeddings
     if torch is not None and isinstance(model_or_vecs, nn.Module):
@@ -246,8 +796,19 @@ def main():
     np.save(artifacts / "user_vecs.npy", user_vecs)
     np.save(artifacts / "item_vecs.npy", item_vecs)
 
+    # Items vistos en train (CSR): se excluyen en evaluación, tabla top-K y API
+    seen = None
+    seen_items = None
+    if not args.keep_seen:
+        seen = build_seen_items(train_df, user_vecs.shape[0])
+        seen_items = save_seen_items(seen, artifacts)
+    else:
+        # Que la API no aplique la exclusión de un entrenamiento anterior
+        for name in ("seen_indptr.npy", "seen_items.npy"):
+            (artifacts / name).unlink(missing_ok=True)
+
     # Compute validation metrics
-    val_metrics = compute_metrics(user_vecs, item_vecs, val_df, k_list=[5, 10, 20])
+    val_metrics = compute_metrics(user_vecs, item_vecs, val_df, k_list=[5, 10, 20], seen=seen)
     print("\n=== Validation Metrics ===")
     for k, v in val_metrics.items():
         print(f"{k}: {v:.4f}")
@@ -269,16 +830,57 @@ def main():
         if torch is not None and isinstance(model_or_vecs, nn.Module):
             mlflow.pytorch.log_model(model_or_vecs, "model")
 
-    index_path = build_faiss_index(item_vecs, artifacts)
+    faiss_spec = faiss_index_spec(args.faiss_index, item_vecs.shape[1], item_vecs.shape[0], nlist=args.nlist,
+                                  nprobe=args.nprobe, pq_m=args.pq_m, hnsw_m=args.hnsw_m, ef_search=args.ef_search)
+    index_path = build_faiss_index(item_vecs, artifacts, faiss_spec)
+    if index_path is None:
+        faiss_spec = None
+    elif args.index_report:
+        import faiss  # type: ignore
+        _print_index_report(faiss_spec, ann_index_report(faiss.read_index(index_path), faiss_spec, user_vecs,
+                                                         item_vecs, artifacts / "faiss_report.json"))
+
+    # IVF en NumPy: por defecto sólo si no hay FAISS (la API lo usa en contenedores sin FAISS)
+    numpy_ann = None
+    if args.numpy_ann == "always" or (args.numpy_ann == "auto" and index_path is None):
+        numpy_ann = build_numpy_ivf(item_vecs, artifacts, nlist=args.nlist, nprobe=args.nprobe)
+        print(f"Índice NumPy {numpy_ann['factory']} (nprobe={numpy_ann['search_params']['nprobe']})")
+        if args.index_report:
+            index = NumpyIVFIndex.load(artifacts, numpy_ann["search_params"])
+            _print_index_report(numpy_ann, ann_index_report(index, numpy_ann, user_vecs, item_vecs,
+                                                            artifacts / "numpy_ann_report.json"))
+    else:
+        # Que la API no cargue el IVF de un entrenamiento anterior
+        for name in NUMPY_ANN_FILES:
+            (artifacts / name).unlink(missing_ok=True)
+
+    topk_table = None
+    if args.topk_table > 0:
+        topk_table = build_topk_table(user_vecs, item_vecs, args.topk_table, artifacts,
+                                      active_users=train_df["user_id"].to_numpy(), seen=seen)
+        print(f"Tabla top-{topk_table['k']} precalculada para {topk_table['n_active_users']} usuarios")
+    else:
+        # Que la API no sirva la tabla top-K de un entrenamiento anterior
+        for name in ("topk_items.npy", "topk_scores.npy"):
+            (artifacts / name).unlink(missing_ok=True)
 
     meta = {
         "dim": args.dim,
         "epochs": args.epochs,
         "lr": args.lr,
-        "n_users": int(users["user_id"].max()) + 1,
-        "n_items": int(items["product_id"].max()) + 1,
+        "objective": args.objective,
+        "split": {"mode": args.split_mode, "cutoff": args.split_cutoff, "n_train": len(train_df), "n_val": len(val_df)},
+        "n_users": len(user_vocab),
+        "n_items": len(item_vocab),
+        "id_vocab": id_vocab,
         "index_path": index_path,
+        "faiss_index": faiss_spec,
+        "numpy_ann": numpy_ann,
+        "topk_table": topk_table,
+        "seen_items": seen_items,
         "val_metrics": val_metrics,
+        # "unseen": los pares de val ya vistos en train no cuentan como ground truth
+        "val_metrics_ground_truth": "all" if seen is None else "unseen",
     }
     with open(artifacts / "model_meta.json", "w", encoding="utf-8") as f:
         json.dump(meta, f, indent=2)
@@ -1,9 +1,17 @@
+import asyncio
+import hashlib
+from collections import Counter
 import json
+import os
+import sys
+from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Dict
+from typing import Any, List, Dict, Iterator, Optional
 
 import numpy as np
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 
 app = FastAPI(title="Two‑Tower Recommender API", version="0.1.0")
 
@@ -12,69 +20,552 @@ ITEM_VECS = ARTIFACTS / "item_vecs.npy"
 USER_VECS = ARTIFACTS / "user_vecs.npy"
 META_JSON = ARTIFACTS / "model_meta.json"
 FAISS_INDEX = ARTIFACTS / "faiss_item.index"
+# Tabla top-K precalculada (train_two_tower.py --topk-table K); opcional
+TOPK_ITEMS = ARTIFACTS / "topk_items.npy"
+TOPK_SCORES = ARTIFACTS / "topk_scores.npy"
+# Items vistos por usuario en train (CSR, train_two_tower.py); opcional
+SEEN_INDPTR = ARTIFACTS / "seen_indptr.npy"
+SEEN_ITEMS = ARTIFACTS / "seen_items.npy"
+# Vocabulario de IDs: fila densa i <-> ID real user_ids[i] / item_ids[i] (ordenados)
+USER_IDS = ARTIFACTS / "user_ids.npy"
+ITEM_IDS = ARTIFACTS / "item_ids.npy"
+
+# Excluir de las recomendaciones los items que el usuario ya vio (si hay artefactos seen_*)
+EXCLUDE_SEEN = os.environ.get("EXCLUDE_SEEN", "1") != "0"
+# Con índice ANN se piden k + vistos candidatos, como mucho SEEN_OVERFETCH_FACTOR * k de más;
+# los usuarios con más vistos se puntúan con brute-force exacto
+SEEN_OVERFETCH_FACTOR = int(os.environ.get("SEEN_OVERFETCH_FACTOR", "4"))
+
+# Copia de item_vecs usada por el fallback brute-force: float32, float16 o int8
+ITEM_MATRIX_DTYPE = os.environ.get("ITEM_MATRIX_DTYPE", "float32")
+# Filas por bloque al puntuar una copia cuantizada (acota la memoria temporal)
+SCORE_BLOCK_ROWS = 65536
+# Scores por bloque de usuarios en brute-force (2^24 float32 = 64 MB): con catálogos
+# grandes cada bloque lleva menos usuarios, así la memoria no crece con el lote
+SCORE_BLOCK_ELEMENTS = int(os.environ.get("SCORE_BLOCK_ELEMENTS", str(1 << 24)))
+
+# Usuarios por búsqueda en /rec/batch (una GEMM o un index.search por bloque)
+BATCH_CHUNK_USERS = int(os.environ.get("BATCH_CHUNK_USERS", "4096"))
+
+# Micro-batching de /rec/{user_id}: hasta MAX_SIZE peticiones o MAX_WAIT_MS por búsqueda
+# (MICROBATCH_MAX_SIZE <= 1 lo desactiva y cada petición busca por separado)
+MICROBATCH_MAX_SIZE = int(os.environ.get("MICROBATCH_MAX_SIZE", "64"))
+MICROBATCH_MAX_WAIT_MS = float(os.environ.get("MICROBATCH_MAX_WAIT_MS", "2"))
+
+# Cada cuántos segundos se comprueba si hay artefactos nuevos (0 desactiva el watcher)
+POLL_SECONDS = float(os.environ.get("ARTIFACTS_POLL_SECONDS", "5"))
 
 try:
     import faiss  # type: ignore
 except Exception:
     faiss = None
 
-_index = None
-_item_vecs = None
-_user_vecs = None
-_meta = None
+# IVF en NumPy puro (models/numpy_ann.py): índice aproximado cuando FAISS no está
+sys.path.append(str(Path(__file__).resolve().parents[2] / "models"))
+try:
+    from numpy_ann import FILES as NUMPY_ANN_FILES, NumpyIVFIndex, exists_numpy_ivf
+except Exception:
+    NUMPY_ANN_FILES = ()
+    NumpyIVFIndex = None
+    exists_numpy_ivf = None
+
+
+@dataclass(frozen=True)
+class ModelBundle:
+    """Artefactos de una versión del modelo. Inmutable: se reemplaza entero, nunca se modifica."""
+    version: Optional[str]
+    meta: Optional[Dict[str, Any]]
+    index: Any
+    user_vecs: Optional[np.ndarray]
+    # item_vecs normalizados (coseno) en ITEM_MATRIX_DTYPE; score real = item_matrix @ u * item_scale.
+    # Es la única copia de los items que se guarda: item_vecs sólo se lee para construirla
+    item_matrix: Optional[np.ndarray] = None
+    item_scale: float = 1.0
+    # Tabla top-K (n_users x K) memory-mapped; filas con -1 = usuario no precalculado
+    topk_items: Optional[np.ndarray] = None
+    topk_scores: Optional[np.ndarray] = None
+    # CSR de items vistos (memory-mapped): los del usuario u son seen_items[seen_indptr[u]:seen_indptr[u+1]]
+    seen_indptr: Optional[np.ndarray] = None
+    seen_items: Optional[np.ndarray] = None
+    # IDs reales por fila (memory-mapped); None = artefactos antiguos donde fila == ID
+    user_ids: Optional[np.ndarray] = None
+    item_ids: Optional[np.ndarray] = None
+
+
+_EMPTY_BUNDLE = ModelBundle(version=None, meta=None, index=None, user_vecs=None)
+
+# Referencia al bundle activo; el watcher la sustituye de forma atómica
+_bundle: ModelBundle = _EMPTY_BUNDLE
+_watcher_task: Optional[asyncio.Task] = None
+
+
+def _artifacts_version() -> Optional[str]:
+    """Huella (nombre, tamaño, mtime) de los artefactos presentes; None si no hay ninguno."""
+    h = hashlib.sha1()
+    found = False
+    for path in (META_JSON, FAISS_INDEX, ITEM_VECS, USER_VECS, TOPK_ITEMS, TOPK_SCORES, SEEN_INDPTR, SEEN_ITEMS,
+                 USER_IDS, ITEM_IDS, *(ARTIFACTS / name for name in NUMPY_ANN_FILES)):
+        if path.exists():
+            st = path.stat()
+            h.update(f"{path.name}:{st.st_size}:{st.st_mtime_ns};".encode())
+            found = True
+    return h.hexdigest()[:12] if found else None
+
+
+def _prepare_item_matrix(item_vecs: np.ndarray, dtype: str):
+    """Normaliza item_vecs una sola vez por versión y opcionalmente los cuantiza."""
+    normed = item_vecs.astype(np.float32)
+    normed /= (np.linalg.norm(normed, axis=1, keepdims=True) + 1e-8)
+    if dtype == "float16":
+        return normed.astype(np.float16), 1.0
+    if dtype == "int8":
+        # Cuantización simétrica: las componentes normalizadas están en [-1, 1]
+        return np.round(normed * 127.0).astype(np.int8), 1.0 / 127.0
+    return normed, 1.0
+
+
+def _apply_search_params(index, meta: Optional[Dict[str, Any]]):
+    """nprobe / efSearch guardados por el entrenador en model_meta.json["faiss_index"]."""
+    spec = (meta or {}).get("faiss_index") or {}
+    ps = faiss.ParameterSpace()
+    for name, value in (spec.get("search_params") or {}).items():
+        ps.set_index_parameter(index, name, value)
+
+
+def _topk_matches_meta(topk_items: np.ndarray, meta: Optional[dict]) -> bool:
+    """La tabla top-K sólo es válida si meta.json la declara con el mismo K y número de filas."""
+    table_meta = (meta or {}).get("topk_table")
+    if not table_meta:
+        return False
+    return (table_meta.get("k") == topk_items.shape[1]
+            and table_meta.get("n_users", topk_items.shape[0]) == topk_items.shape[0])
+
+
+def _load_bundle() -> ModelBundle:
+    version = _artifacts_version()
+    meta = json.loads(META_JSON.read_text(encoding="utf-8")) if META_JSON.exists() else None
+    index = faiss.read_index(str(FAISS_INDEX)) if FAISS_INDEX.exists() and faiss is not None else None
+    if index is not None:
+        _apply_search_params(index, meta)
+    elif NumpyIVFIndex is not None and (meta or {}).get("numpy_ann") and exists_numpy_ivf(ARTIFACTS):
+        # Sin FAISS: IVF en NumPy memory-mapped, misma interfaz search/ntotal
+        index = NumpyIVFIndex.load(ARTIFACTS, meta["numpy_ann"].get("search_params"))
+    # Memory-mapped: se lee una vez al construir item_matrix y no queda residente
+    item_vecs = np.load(ITEM_VECS, mmap_mode="r") if ITEM_VECS.exists() else None
+    user_vecs = np.load(USER_VECS) if USER_VECS.exists() else None
+    # El entrenador reemplaza la tabla con os.replace, así que mapearla es seguro ante un swap
+    has_topk = TOPK_ITEMS.exists() and TOPK_SCORES.exists()
+    topk_items = np.load(TOPK_ITEMS, mmap_mode="r") if has_topk else None
+    topk_scores = np.load(TOPK_SCORES, mmap_mode="r") if has_topk else None
+    if topk_items is not None and not _topk_matches_meta(topk_items, meta):
+        # Tabla de un entrenamiento anterior: sus listas no corresponden a estos vectores
+        topk_items = topk_scores = None
+    has_seen = EXCLUDE_SEEN and SEEN_INDPTR.exists() and SEEN_ITEMS.exists()
+    seen_indptr = np.load(SEEN_INDPTR, mmap_mode="r") if has_seen else None
+    seen_items = np.load(SEEN_ITEMS, mmap_mode="r") if has_seen else None
+    has_vocab = USER_IDS.exists() and ITEM_IDS.exists()
+    user_ids = np.load(USER_IDS, mmap_mode="r") if has_vocab else None
+    item_ids = np.load(ITEM_IDS, mmap_mode="r") if has_vocab else None
+    item_matrix, item_scale = (None, 1.0) if item_vecs is None else _prepare_item_matrix(item_vecs, ITEM_MATRIX_DTYPE)
+    # Si los archivos cambiaron mientras se leían (entrenamiento escribiendo), descartar
+    if _artifacts_version() != version:
+        raise RuntimeError("Artefactos modificados durante la carga")
+    return ModelBundle(
+        version=version, meta=meta, index=index, user_vecs=user_vecs,
+        item_matrix=item_matrix, item_scale=item_scale,
+        topk_items=topk_items, topk_scores=topk_scores,
+        seen_indptr=seen_indptr, seen_items=seen_items,
+        user_ids=user_ids, item_ids=item_ids,
+    )
+
+
+async def _watch_artifacts():
+    """Carga en segundo plano las versiones nuevas y las publica cuando están completas."""
+    global _bundle
+    while True:
+        await asyncio.sleep(POLL_SECONDS)
+        version = _artifacts_version()
+        if version is None or version == _bundle.version:
+            continue
+        try:
+            new_bundle = await asyncio.to_thread(_load_bundle)
+        except Exception as e:
+            print(f"No se pudo cargar la versión {version} de los artefactos: {e}")
+            continue
+        _bundle = new_bundle
+        print(f"Artefactos actualizados a la versión {new_bundle.version}")
+
+
+class MicroBatcher:
+    """
+    Agrupa las peticiones concurrentes de /rec/{user_id} en una sola búsqueda:
+    espera como mucho `max_wait_ms` (o hasta juntar `max_size`) y devuelve a cada
+    petición su fila del resultado.
+    """
+
+    def __init__(self, max_size: int, max_wait_ms: float):
+        self.max_size = max_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+        # Métricas de llenado
+        self.batches = 0
+        self.requests = 0
+        self.size_counts: Counter = Counter()
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._full = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def submit(self, bundle: ModelBundle, user_id: int, k: int) -> List[int]:
+        fut = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((bundle, user_id, k, fut))
+        # El primer elemento ya lo tiene el lote en curso
+        if self._queue.qsize() >= self.max_size - 1:
+            self._full.set()
+        return await fut
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            if self._queue.qsize() < self.max_size - 1:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+            while len(batch) < self.max_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            self.batches += 1
+            self.requests += len(batch)
+            self.size_counts[len(batch)] += 1
+            # La búsqueda corre en un hilo; mientras tanto se puede ir formando el siguiente lote
+            task = asyncio.create_task(self._execute(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _execute(self, batch):
+        # Normalmente todas las peticiones comparten bundle; si hubo swap se agrupan por versión
+        groups: Dict[int, list] = {}
+        for item in batch:
+            groups.setdefault(id(item[0]), []).append(item)
+        for items in groups.values():
+            bundle = items[0][0]
+            user_ids = np.array([user_id for _, user_id, _, _ in items], dtype=np.int64)
+            k_max = max(k for _, _, k, _ in items)
+            try:
+                results = await asyncio.to_thread(_search, bundle, user_ids, k_max)
+            except Exception as e:
+                for _, _, _, fut in items:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for row, (_, _, k, fut) in enumerate(items):
+                if not fut.done():
+                    fut.set_result(results[row, :k].tolist())
+
+    def stats(self) -> Dict[str, Any]:
+        mean_size = self.requests / self.batches if self.batches else 0.0
+        return {
+            "enabled": True,
+            "max_size": self.max_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch_size": mean_size,
+            "fill_rate": mean_size / self.max_size,
+            "batch_size_counts": dict(sorted(self.size_counts.items())),
+        }
+
+
+_batcher: Optional[MicroBatcher] = MicroBatcher(MICROBATCH_MAX_SIZE, MICROBATCH_MAX_WAIT_MS) if MICROBATCH_MAX_SIZE > 1 else None
+
+
+@app.on_event("startup")
+async def startup_event():
+    global _bundle, _watcher_task
+    if _artifacts_version() is not None:
+        try:
+            _bundle = _load_bundle()
+        except Exception as e:
+            print(f"No se pudieron cargar los artefactos al arrancar: {e}")
+    if POLL_SECONDS > 0:
+        _watcher_task = asyncio.create_task(_watch_artifacts())
+    if _batcher is not None:
+        _batcher.start()
 
 
-def _load_artifacts():
-    global _index, _item_vecs, _user_vecs, _meta
-    if META_JSON.exists():
-        _meta = json.loads(META_JSON.read_text(encoding="utf-8"))
-    if FAISS_INDEX.exists() and faiss is not None:
-        _index = faiss.read_index(str(FAISS_INDEX))
-    if ITEM_VECS.exists():
-        _item_vecs = np.load(ITEM_VECS)
-    if USER_VECS.exists():
-        _user_vecs = np.load(USER_VECS)
+@app.on_event("shutdown")
+async def shutdown_event():
+    if _watcher_task is not None:
+        _watcher_task.cancel()
+    if _batcher is not None:
+        _batcher.stop()
+
+
+def _index_type(bundle: ModelBundle) -> Optional[str]:
+    if bundle.index is None:
+        return None
+    key = "numpy_ann" if NumpyIVFIndex is not None and isinstance(bundle.index, NumpyIVFIndex) else "faiss_index"
+    return ((bundle.meta or {}).get(key) or {}).get("factory")
 
 
 @app.get("/health")
 async def health():
-    _load_artifacts()
+    bundle = _bundle
     return {
         "status": "ok",
-        "index_loaded": _index is not None,
-        "items_vecs": bool(_item_vecs is not None),
-        "users_vecs": bool(_user_vecs is not None),
+        "model_version": bundle.version,
+        "index_loaded": bundle.index is not None,
+        "index_type": _index_type(bundle),
+        "items_vecs": bool(bundle.item_matrix is not None),
+        "users_vecs": bool(bundle.user_vecs is not None),
+        "topk_table": None if bundle.topk_items is None else int(bundle.topk_items.shape[1]),
+        "exclude_seen": bundle.seen_indptr is not None,
     }
 
 
-def _ann_search_from_user(user_id: int, k: int = 5) -> List[int]:
-    if _user_vecs is None or _item_vecs is None:
-        raise HTTPException(status_code=503, detail="Embeddings no disponibles. Entrena primero.")
-    if user_id >= _user_vecs.shape[0]:
-        raise HTTPException(status_code=404, detail="Usuario fuera de rango.")
+def _score_items(bundle: ModelBundle, u: np.ndarray) -> np.ndarray:
+    """Similitud coseno de todos los items contra las filas de `u` (ya normalizadas)."""
+    m = bundle.item_matrix
+    if m.dtype == np.float32:
+        return u @ m.T
+    # Copia cuantizada: se promueve a float32 por bloques para no duplicar la matriz en memoria
+    out = np.empty((u.shape[0], m.shape[0]), dtype=np.float32)
+    for start in range(0, m.shape[0], SCORE_BLOCK_ROWS):
+        block = m[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+        out[:, start:start + len(block)] = u @ block.T
+    out *= bundle.item_scale
+    return out
+
+
+def _topk(scores: np.ndarray, k: int) -> np.ndarray:
+    """Índices top-k por fila: argpartition O(n) y después sólo se ordenan los k ganadores."""
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(part, order, axis=-1)
 
-    u = _user_vecs[user_id:user_id + 1].astype(np.float32)
+
+def _normalized_queries(bundle: ModelBundle, user_ids: np.ndarray) -> np.ndarray:
+    u = bundle.user_vecs[user_ids].astype(np.float32)
     # normalizar para similitud coseno
     u /= (np.linalg.norm(u, axis=1, keepdims=True) + 1e-8)
+    return u
+
+
+def _seen_pairs(bundle: ModelBundle, user_ids: np.ndarray):
+    """(fila local, item) de los items vistos por cada usuario de `user_ids`."""
+    indptr = bundle.seen_indptr
+    # Usuarios sin fila en el CSR (no estaban en train) no tienen vistos
+    known = user_ids < len(indptr) - 1
+    ids = np.where(known, user_ids, 0)
+    starts = indptr[ids]
+    counts = np.where(known, indptr[ids + 1] - starts, 0)
+    rows = np.repeat(np.arange(len(user_ids)), counts)
+    offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+    return rows, bundle.seen_items[np.repeat(starts, counts) + offsets].astype(np.int64)
+
+
+def _subset_seen(seen, mask: np.ndarray):
+    """Pares (fila local, item) de las filas de `mask`, renumeradas dentro del subconjunto."""
+    rows, items = seen
+    keep = mask[rows]
+    new_rows = np.cumsum(mask) - 1
+    return new_rows[rows[keep]], items[keep]
+
+
+def _search_exact(bundle: ModelBundle, queries: np.ndarray, seen, k: int) -> np.ndarray:
+    """
+    Brute-force sobre item_matrix; los vistos se enmascaran con -inf y los huecos quedan en -1.
+    Se puntúa por bloques de SCORE_BLOCK_ELEMENTS // n_items usuarios.
+    """
+    n_items = bundle.item_matrix.shape[0]
+    step = max(1, SCORE_BLOCK_ELEMENTS // max(n_items, 1))
+    out = np.empty((len(queries), min(k, n_items)), dtype=np.int64)
+    for start in range(0, len(queries), step):
+        block_seen = None
+        if seen is not None:
+            # Las filas de los pares vistos vienen ordenadas: el bloque es un rango contiguo
+            lo, hi = np.searchsorted(seen[0], [start, start + step])
+            block_seen = (seen[0][lo:hi] - start, seen[1][lo:hi])
+        out[start:start + step] = _search_exact_block(bundle, queries[start:start + step], block_seen, k)
+    return out
+
+
+def _search_exact_block(bundle: ModelBundle, queries: np.ndarray, seen, k: int) -> np.ndarray:
+    scores = _score_items(bundle, queries)
+    if seen is None:
+        return _topk(scores, k)
+    rows, cols = seen
+    valid = cols < scores.shape[1]
+    scores[rows[valid], cols[valid]] = -np.inf
+    top = _topk(scores, k)
+    return np.where(np.isfinite(np.take_along_axis(scores, top, axis=1)), top, -1)
+
+
+def _search_ann_filtered(bundle: ModelBundle, queries: np.ndarray, seen, k: int, over: int) -> np.ndarray:
+    """Pide k + over candidatos al índice y quita los vistos; los huecos quedan en -1."""
+    n_items = bundle.index.ntotal
+    D, I = bundle.index.search(queries, min(k + over, n_items))
+    rows = np.arange(len(queries))[:, None]
+    # Las claves (fila, item) del CSR ya están ordenadas: pertenencia con searchsorted
+    seen_keys = seen[0] * n_items + seen[1]
+    keys = rows * n_items + I
+    pos = np.searchsorted(seen_keys, keys).clip(max=max(len(seen_keys) - 1, 0))
+    keep = (I >= 0) & ((seen_keys[pos] != keys) if len(seen_keys) else True)
+    # Orden estable: los candidatos conservados pasan delante sin perder su ranking
+    order = np.argsort(~keep, axis=1, kind="stable")[:, :k]
+    out = np.take_along_axis(np.where(keep, I, -1), order, axis=1)
+    return out if out.shape[1] == k else np.pad(out, ((0, 0), (0, k - out.shape[1])), constant_values=-1)
+
+
+def _search(bundle: ModelBundle, user_ids: np.ndarray, k: int) -> np.ndarray:
+    """
+    Top-k items para un bloque de usuarios: una sola llamada a FAISS o una sola GEMM.
+    Si hay CSR de vistos, brute-force los enmascara con -inf y el índice pide k + max(vistos)
+    candidatos y los filtra. El sobre-pedido se acota a SEEN_OVERFETCH_FACTOR * k: las filas
+    con más vistos se resuelven con brute-force exacto para no inflar la búsqueda del bloque.
+    Los huecos que no se puedan llenar quedan en -1.
+    """
+    queries = _normalized_queries(bundle, user_ids)
+    seen = None
+    if bundle.seen_indptr is not None:
+        seen = _seen_pairs(bundle, user_ids)
+    if bundle.index is None:
+        # Fallback brute-force si no hay índice (matriz normalizada cacheada en el bundle)
+        return _search_exact(bundle, queries, seen, k)
+    if seen is None:
+        return bundle.index.search(queries, k)[1]
+    counts = np.bincount(seen[0], minlength=len(user_ids))
+    heavy = counts > SEEN_OVERFETCH_FACTOR * k
+    if not heavy.any():
+        return _search_ann_filtered(bundle, queries, seen, k, int(counts.max()))
+    out = np.full((len(user_ids), k), -1, dtype=np.int64)
+    exact = _search_exact(bundle, queries[heavy], _subset_seen(seen, heavy), k)
+    out[heavy, :exact.shape[1]] = exact
+    light = ~heavy
+    if light.any():
+        out[light] = _search_ann_filtered(bundle, queries[light], _subset_seen(seen, light), k,
+                                          int(counts[light].max()))
+    return out
 
-    if _index is not None:
-        D, I = _index.search(u, k)
-        return I[0].tolist()
-    # Fallback brute-force si FAISS no está
-    norms = np.linalg.norm(_item_vecs, axis=1, keepdims=True) + 1e-8
-    iv = (_item_vecs / norms).astype(np.float32)
-    sims = (iv @ u.T).ravel()
-    topk = np.argsort(-sims)[:k]
-    return topk.tolist()
+
+def _lookup_topk(bundle: ModelBundle, user_ids: np.ndarray, k: int) -> np.ndarray:
+    """Máscara de usuarios servibles desde la tabla top-K precalculada (lookup O(1) por fila)."""
+    table = bundle.topk_items
+    if table is None or k > table.shape[1]:
+        return np.zeros(len(user_ids), dtype=bool)
+    # Una tabla calculada sin exclusión no sirve si la API debe excluir los vistos
+    table_meta = (bundle.meta or {}).get("topk_table") or {}
+    if bundle.seen_indptr is not None and not table_meta.get("exclude_seen", False):
+        return np.zeros(len(user_ids), dtype=bool)
+    hit = user_ids < table.shape[0]
+    hit[hit] = table[user_ids[hit], 0] >= 0
+    return hit
+
+
+def _encode_users(bundle: ModelBundle, raw_ids: np.ndarray) -> np.ndarray:
+    """IDs reales de usuario -> filas de user_vecs (-1 si el usuario no existe)."""
+    raw_ids = np.asarray(raw_ids, dtype=np.int64)
+    if bundle.user_ids is None:
+        return np.where((raw_ids >= 0) & (raw_ids < bundle.user_vecs.shape[0]), raw_ids, -1)
+    vocab = bundle.user_ids
+    pos = np.searchsorted(vocab, raw_ids).clip(max=len(vocab) - 1)
+    return np.where(vocab[pos] == raw_ids, pos, -1)
+
+
+def _decode_items(bundle: ModelBundle, rows: np.ndarray) -> List[int]:
+    """Filas de item_vecs -> product_id reales, descartando los huecos (-1)."""
+    rows = np.asarray(rows, dtype=np.int64)
+    rows = rows[rows >= 0]
+    return (rows if bundle.item_ids is None else bundle.item_ids[rows]).tolist()
+
+
+async def _ann_search_from_user(bundle: ModelBundle, user_id: int, k: int = 5) -> List[int]:
+    """Top-k de un usuario (ID real) como filas de item_vecs."""
+    if bundle.user_vecs is None or bundle.item_matrix is None:
+        raise HTTPException(status_code=503, detail="Embeddings no disponibles. Entrena primero.")
+    row = int(_encode_users(bundle, [user_id])[0])
+    if row < 0:
+        raise HTTPException(status_code=404, detail="Usuario desconocido.")
+
+    if _lookup_topk(bundle, np.array([row]), k)[0]:
+        return bundle.topk_items[row, :k].tolist()
+    if _batcher is not None:
+        return await _batcher.submit(bundle, row, k)
+    return _search(bundle, np.array([row]), k)[0].tolist()
 
 
 @app.get("/rec/{user_id}")
 async def recommend(user_id: int, k: int = 5) -> Dict:
-    _load_artifacts()
-    indices = _ann_search_from_user(user_id, k)
+    # Una sola lectura de la referencia: toda la petición usa la misma versión
+    bundle = _bundle
+    rows = await _ann_search_from_user(bundle, user_id, k)
     return {
         "user_id": user_id,
         "k": k,
-        "item_indices": indices,
-        "note": "Indices corresponden a posicion en item_vecs; mapea a producto_id segun tu catalogo.",
+        "model_version": bundle.version,
+        "product_ids": _decode_items(bundle, rows),
     }
+
+
+@app.get("/metrics/batching")
+async def batching_metrics():
+    """Tasa de llenado del micro-batcher: ayuda a ajustar MAX_SIZE/MAX_WAIT_MS (p50 vs throughput)."""
+    if _batcher is None:
+        return {"enabled": False}
+    return _batcher.stats()
+
+
+class BatchRequest(BaseModel):
+    user_ids: List[int] = Field(..., description="IDs de usuario a recomendar")
+    k: int = Field(5, ge=1, le=1000)
+
+
+def _batch_lines(bundle: ModelBundle, user_ids: List[int], k: int) -> Iterator[str]:
+    """Genera una línea NDJSON por usuario, procesando BATCH_CHUNK_USERS usuarios por búsqueda."""
+    for start in range(0, len(user_ids), BATCH_CHUNK_USERS):
+        raw = np.asarray(user_ids[start:start + BATCH_CHUNK_USERS], dtype=np.int64)
+        chunk = _encode_users(bundle, raw)
+        valid = chunk >= 0
+        # Usuarios de la tabla top-K por lookup; el resto con una sola búsqueda
+        from_table = np.zeros(len(chunk), dtype=bool)
+        from_table[valid] = _lookup_topk(bundle, chunk[valid], k)
+        live = valid & ~from_table
+        # _search devuelve min(k, n_items) columnas sin índice ANN; el resto queda en -1
+        results = np.full((len(chunk), k), -1, dtype=np.int64)
+        if from_table.any():
+            results[from_table] = bundle.topk_items[chunk[from_table], :k]
+        if live.any():
+            found = _search(bundle, chunk[live], k)
+            results[live, :found.shape[1]] = found
+        for row, (user_id, ok) in enumerate(zip(raw.tolist(), valid.tolist())):
+            if ok:
+                line = {"user_id": user_id, "product_ids": _decode_items(bundle, results[row])}
+            else:
+                line = {"user_id": user_id, "error": "Usuario desconocido."}
+            yield json.dumps(line) + "\n"
+
+
+@app.post("/rec/batch")
+async def recommend_batch(req: BatchRequest):
+    """Top-k para muchos usuarios; respuesta NDJSON en streaming (una línea por usuario)."""
+    bundle = _bundle
+    if bundle.user_vecs is None or bundle.item_matrix is None:
+        raise HTTPException(status_code=503, detail="Embeddings no disponibles. Entrena primero.")
+    # El generador es síncrono: Starlette lo itera en el threadpool, fuera del event loop
+    return StreamingResponse(
+        _batch_lines(bundle, req.user_ids, req.k),
+        media_type="application/x-ndjson",
+        headers={"X-Model-Version": bundle.version or ""},
+    )
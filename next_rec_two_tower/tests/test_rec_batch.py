@@ -0,0 +1,138 @@
+import importlib.util
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+API_MAIN = Path(__file__).resolve().parents[1] / "services" / "api" / "main.py"
+
+
+def _load_api(tmp_path, monkeypatch):
+    """Módulo de la API apuntando a artefactos sintéticos (4 usuarios, 5 items) y sin índice ANN."""
+    spec = importlib.util.spec_from_file_location("two_tower_api", API_MAIN)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    rng = np.random.default_rng(0)
+    np.save(tmp_path / "user_vecs.npy", rng.normal(size=(4, 8)).astype(np.float32))
+    np.save(tmp_path / "item_vecs.npy", rng.normal(size=(5, 8)).astype(np.float32))
+    np.save(tmp_path / "user_ids.npy", np.array([10, 20, 30, 40], dtype=np.int64))
+    np.save(tmp_path / "item_ids.npy", np.array([1001, 1002, 1003, 1004, 1005], dtype=np.int64))
+    # Usuario 20 (fila 1) ya vio los items de las filas 0 y 3
+    np.save(tmp_path / "seen_indptr.npy", np.array([0, 0, 2, 2, 2], dtype=np.int64))
+    np.save(tmp_path / "seen_items.npy", np.array([0, 3], dtype=np.int32))
+
+    for name in ("ITEM_VECS", "USER_VECS", "META_JSON", "FAISS_INDEX", "TOPK_ITEMS", "TOPK_SCORES",
+                 "SEEN_INDPTR", "SEEN_ITEMS", "USER_IDS", "ITEM_IDS"):
+        monkeypatch.setattr(module, name, tmp_path / getattr(module, name).name)
+    monkeypatch.setattr(module, "ARTIFACTS", tmp_path)
+    monkeypatch.setattr(module, "POLL_SECONDS", 0)
+    monkeypatch.setattr(module, "faiss", None)
+    monkeypatch.setattr(module, "NumpyIVFIndex", None)
+    return module
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    with TestClient(_load_api(tmp_path, monkeypatch).app) as client:
+        yield client
+
+
+def _batch(client, user_ids, k):
+    response = client.post("/rec/batch", json={"user_ids": user_ids, "k": k})
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_batch_k_mayor_que_n_items(api):
+    lines = _batch(api, [10, 20, 99], k=8)
+    assert len(lines[0]["product_ids"]) == 5
+    # Los vistos se excluyen y los huecos (-1) no llegan a la respuesta
+    assert sorted(lines[1]["product_ids"]) == [1002, 1003, 1005]
+    assert lines[2] == {"user_id": 99, "error": "Usuario desconocido."}
+
+
+def test_batch_coincide_con_rec(api):
+    lines = _batch(api, [10, 30], k=3)
+    for line in lines:
+        assert line["product_ids"] == api.get(f"/rec/{line['user_id']}?k=3").json()["product_ids"]
+
+
+class _ExactIndex:
+    """Índice exacto de prueba con la interfaz search/ntotal; registra cuántos candidatos se piden."""
+
+    def __init__(self, item_matrix: np.ndarray):
+        self.items = item_matrix.astype(np.float32)
+        self.ntotal = len(self.items)
+        self.requested = []
+
+    def search(self, queries, k):
+        self.requested.append(k)
+        scores = queries @ self.items.T
+        top = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(scores, top, axis=1), top
+
+
+def test_sobrepedido_acotado_con_usuarios_con_muchos_vistos(monkeypatch):
+    spec = importlib.util.spec_from_file_location("two_tower_api", API_MAIN)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    rng = np.random.default_rng(1)
+    n_users, n_items = 6, 200
+    item_matrix, _ = module._prepare_item_matrix(rng.normal(size=(n_items, 8)).astype(np.float32), "float32")
+    # Usuario 0 vio 150 items; el resto, 2
+    seen_lists = [np.arange(150)] + [np.array([3, 7])] * (n_users - 1)
+    indptr = np.concatenate([[0], np.cumsum([len(x) for x in seen_lists])]).astype(np.int64)
+    index = _ExactIndex(item_matrix)
+    bundle = module.ModelBundle(
+        version="t", meta=None, index=index, user_vecs=rng.normal(size=(n_users, 8)).astype(np.float32),
+        item_matrix=item_matrix, seen_indptr=indptr, seen_items=np.concatenate(seen_lists).astype(np.int32),
+    )
+    monkeypatch.setattr(module, "SEEN_OVERFETCH_FACTOR", 4)
+    user_ids = np.arange(n_users)
+    got = module._search(bundle, user_ids, 5)
+
+    assert max(index.requested) <= 5 + 4 * 5
+    exact = module._search_exact(bundle, module._normalized_queries(bundle, user_ids),
+                                 module._seen_pairs(bundle, user_ids), 5)
+    np.testing.assert_array_equal(got, exact)
+
+
+def test_tabla_topk_de_otro_entrenamiento_no_se_usa(tmp_path, monkeypatch):
+    module = _load_api(tmp_path, monkeypatch)
+    np.save(tmp_path / "topk_items.npy", np.tile(np.arange(3, dtype=np.int32), (4, 1)))
+    np.save(tmp_path / "topk_scores.npy", np.zeros((4, 3), dtype=np.float16))
+
+    # Reentrenado sin --topk-table: model_meta.json ya no declara la tabla
+    (tmp_path / "model_meta.json").write_text(json.dumps({"topk_table": None}), encoding="utf-8")
+    assert module._load_bundle().topk_items is None
+    # Tabla declarada con otro K
+    (tmp_path / "model_meta.json").write_text(json.dumps({"topk_table": {"k": 10, "n_users": 4}}), encoding="utf-8")
+    assert module._load_bundle().topk_items is None
+
+    (tmp_path / "model_meta.json").write_text(json.dumps({"topk_table": {"k": 3, "n_users": 4}}), encoding="utf-8")
+    assert module._load_bundle().topk_items.shape == (4, 3)
+
+
+def test_busqueda_exacta_por_bloques_de_usuarios(monkeypatch):
+    spec = importlib.util.spec_from_file_location("two_tower_api", API_MAIN)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    rng = np.random.default_rng(2)
+    n_users, n_items = 9, 40
+    item_matrix, _ = module._prepare_item_matrix(rng.normal(size=(n_items, 8)).astype(np.float32), "float32")
+    seen_lists = [rng.choice(n_items, size=c, replace=False) for c in (0, 3, 1, 0, 5, 2, 0, 4, 1)]
+    indptr = np.concatenate([[0], np.cumsum([len(x) for x in seen_lists])]).astype(np.int64)
+    bundle = module.ModelBundle(
+        version="t", meta=None, index=None, user_vecs=rng.normal(size=(n_users, 8)).astype(np.float32),
+        item_matrix=item_matrix, seen_indptr=indptr, seen_items=np.concatenate(seen_lists).astype(np.int32),
+    )
+    user_ids = np.arange(n_users)
+    full = module._search(bundle, user_ids, 6)
+    # 2 usuarios por bloque: los bloques y sus vistos deben dar el mismo resultado
+    monkeypatch.setattr(module, "SCORE_BLOCK_ELEMENTS", 2 * n_items)
+    np.testing.assert_array_equal(module._search(bundle, user_ids, 6), full)
@@ -0,0 +1,152 @@
+"""
+📦 Snapshot columnar de los datos (arranque rápido)
+==================================================
+
+Convierte usuarios.csv, productos.csv e interacciones.csv en un directorio
+con una columna por archivo .npy y un manifest.json versionado:
+
+    datos_snapshot/
+    ├── manifest.json
+    ├── interacciones.user_id.npy
+    ├── interacciones.timestamp.npy                    # datetime64[s]
+    ├── interacciones.tipo_interaccion.codigos.npy     # columnas de texto:
+    ├── interacciones.tipo_interaccion.categorias.npy  # codificación por diccionario
+    └── ...
+
+Las columnas se abren con np.load(mmap_mode="r"): no se parsea texto al
+arrancar y varios workers comparten las mismas páginas del sistema operativo.
+
+Uso:
+    python snapshot_datos.py --data-root . --salida datos_snapshot
+"""
+
+import argparse
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+FORMATO = "snapshot-columnar"
+FORMATO_VERSION = 1
+
+TABLAS = ("usuarios", "productos", "interacciones")
+
+# Columnas que se guardan como fecha (datetime64[s]) en lugar de texto
+COLUMNAS_FECHA = {
+    "interacciones": ["timestamp"],
+}
+
+
+def _guardar_columna(destino: Path, tabla: str, serie: pd.Series, es_fecha: bool) -> Dict:
+    """Escribe una columna en .npy y devuelve su entrada del manifest"""
+    nombre = serie.name
+    base = f"{tabla}.{nombre}"
+    if es_fecha:
+        valores = pd.to_datetime(serie).to_numpy().astype("datetime64[s]")
+        np.save(destino / f"{base}.npy", valores)
+        return {"nombre": nombre, "tipo": "fecha", "dtype": str(valores.dtype)}
+    if not pd.api.types.is_numeric_dtype(serie):
+        codigos, categorias = pd.factorize(serie, sort=True)
+        np.save(destino / f"{base}.codigos.npy", codigos.astype(np.int32))
+        np.save(destino / f"{base}.categorias.npy", np.asarray(categorias, dtype=str))
+        return {"nombre": nombre, "tipo": "categorica", "categorias": len(categorias)}
+    valores = serie.to_numpy()
+    np.save(destino / f"{base}.npy", valores)
+    return {"nombre": nombre, "tipo": "numerica", "dtype": str(valores.dtype)}
+
+
+def construir_snapshot(data_root: Path, destino: Path) -> Dict:
+    """Lee los CSV de `data_root` y escribe el snapshot columnar en `destino`"""
+    destino.mkdir(parents=True, exist_ok=True)
+    manifest = {
+        "formato": FORMATO,
+        "version": FORMATO_VERSION,
+        "creado": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "tablas": {},
+    }
+    for tabla in TABLAS:
+        fuente = data_root / f"{tabla}.csv"
+        df = pd.read_csv(fuente)
+        fechas = COLUMNAS_FECHA.get(tabla, [])
+        manifest["tablas"][tabla] = {
+            "fuente": fuente.name,
+            "fuente_bytes": fuente.stat().st_size,
+            "fuente_mtime_ns": fuente.stat().st_mtime_ns,
+            "filas": len(df),
+            "columnas": [_guardar_columna(destino, tabla, df[col], col in fechas) for col in df.columns],
+        }
+    # El manifest se escribe al final: un snapshot sin manifest está incompleto
+    with open(destino / "manifest.json", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def existe_snapshot(ruta: Path) -> bool:
+    return (Path(ruta) / "manifest.json").exists()
+
+
+def fuentes_cambiadas(ruta: Path, data_root: Path) -> List[str]:
+    """
+    Tablas cuyo CSV en `data_root` ya no coincide (tamaño o mtime) con el que se usó
+    para construir el snapshot. Un CSV que no existe no cuenta como cambio.
+    """
+    manifest = json.loads((Path(ruta) / "manifest.json").read_text(encoding="utf-8"))
+    cambiadas = []
+    for tabla, info in manifest["tablas"].items():
+        fuente = Path(data_root) / info["fuente"]
+        if not fuente.exists():
+            continue
+        estado = fuente.stat()
+        # Los manifest anteriores no guardaban el mtime: sólo se compara el tamaño
+        if estado.st_size != info["fuente_bytes"] or \
+                info.get("fuente_mtime_ns", estado.st_mtime_ns) != estado.st_mtime_ns:
+            cambiadas.append(tabla)
+    return cambiadas
+
+
+def cargar_snapshot(ruta: Path) -> Dict[str, pd.DataFrame]:
+    """
+    Abre el snapshot con memory-mapping y devuelve un DataFrame por tabla.
+    Las columnas de texto se reconstruyen como pd.Categorical sobre los códigos.
+    """
+    ruta = Path(ruta)
+    manifest = json.loads((ruta / "manifest.json").read_text(encoding="utf-8"))
+    if manifest.get("formato") != FORMATO or manifest.get("version") != FORMATO_VERSION:
+        raise ValueError(
+            f"Snapshot no soportado: {manifest.get('formato')} v{manifest.get('version')} "
+            f"(se esperaba {FORMATO} v{FORMATO_VERSION})"
+        )
+
+    tablas = {}
+    for tabla, info in manifest["tablas"].items():
+        columnas = {}
+        for col in info["columnas"]:
+            base = ruta / f"{tabla}.{col['nombre']}"
+            if col["tipo"] == "categorica":
+                codigos = np.load(f"{base}.codigos.npy", mmap_mode="r")
+                categorias = np.load(f"{base}.categorias.npy", mmap_mode="r")
+                columnas[col["nombre"]] = pd.Categorical.from_codes(codigos, categories=categorias.astype(object))
+            else:
+                columnas[col["nombre"]] = np.load(f"{base}.npy", mmap_mode="r")
+        tablas[tabla] = pd.DataFrame(columnas, copy=False)
+    return tablas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construye el snapshot columnar a partir de los CSV")
+    parser.add_argument("--data-root", type=str, default=".")
+    parser.add_argument("--salida", type=str, default="datos_snapshot")
+    args = parser.parse_args()
+
+    print(f"📁 Leyendo CSV desde {args.data_root}...")
+    manifest = construir_snapshot(Path(args.data_root), Path(args.salida))
+    for tabla, info in manifest["tablas"].items():
+        print(f"✅ {tabla}: {info['filas']} filas, {len(info['columnas'])} columnas")
+    print(f"📦 Snapshot v{FORMATO_VERSION} guardado en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()